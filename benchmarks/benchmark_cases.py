@@ -0,0 +1,248 @@
+# Benchmark cases run by run_benchmarks.py, each in its own process so its peak memory is measured alone.
+#
+# A case prepares its inputs (not timed) and returns the function which is timed. The models are
+# replaced by stubs, so the cases measure the data paths around them and run without a GPU or weights.
+
+import os
+import sys
+import json
+import time
+import cv2
+import numpy as np
+from generate_session import ROAD_COLOR
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(script_dir, '..')
+
+SYNC_DIR = os.path.join(repo_dir, 'preprocessing', 'create_synced_df')
+GEOPOSE_DIR = os.path.join(repo_dir, 'modules', 'geopose')
+CROP_DIR = os.path.join(repo_dir, 'preprocessing', 'crop_images')
+CLASSIFICATION_DIR = os.path.join(repo_dir, 'modules', 'classification')
+ROAD_DIR = os.path.join(repo_dir, 'modules', 'road_segmentation')
+
+sys.path.append(os.path.join(repo_dir, 'common'))
+import metrics
+from metrics import peak_rss_bytes
+
+# Distinct frames the mask encoding cases take their masks from
+MASK_SAMPLES = 64
+
+class StubClassifier:
+    # Stands in for the road surface classifier, one cheap reduction per image
+    def predict(self, x, batch_size=32, verbose=None):
+        from classifier_utils import CLASS_LABELS
+
+        x = np.asarray(x)
+        logits = np.zeros((len(x), len(CLASS_LABELS)), dtype=np.float32)
+        logits[:, 0] = x.reshape(len(x), -1).mean(axis=1)
+        return logits
+
+class StubMaskingModel:
+    # Stands in for SAM2Model, the road of the synthetic frames is found by its asphalt color
+    def segment_road(self, image, input_points, input_labels):
+        return road_mask(image), 1.0, 'single-pass'
+
+    def segment_road_batch(self, images, input_points_batch, input_labels):
+        return [self.segment_road(image, None, None) for image in images]
+
+    def set_image_batch(self, images):
+        self.images = images
+
+    def decode_road(self, img_idx, input_points, input_labels, mask_prior=None):
+        # Records the refinement paths like SAM2Model, the logits only have to be carried to the next frame
+        path = 'propagated' if mask_prior is not None else 'refined'
+        metrics.increment(f'sam2.path.{path}')
+        return road_mask(self.images[img_idx]), 1.0, path, np.zeros((1, 256, 256), dtype=np.float32)
+
+def road_mask(image):
+    # Works on RGB and BGR frames alike since the asphalt is grey
+    lower = np.array(ROAD_COLOR) - 20
+    upper = np.array(ROAD_COLOR) + 20
+    mask = cv2.inRange(image, lower, upper)
+    return cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8)) > 0
+
+def load_sync_config():
+    with open(os.path.join(SYNC_DIR, 'config.json'), 'r') as f:
+        return json.load(f)
+
+def camera_frames(session_dir):
+    camera_dir = os.path.join(session_dir, 'Camera')
+    return camera_dir, sorted(f for f in os.listdir(camera_dir) if f.endswith('.jpg'))
+
+def case_sync(session_dir, work_dir):
+    sys.path.append(SYNC_DIR)
+    import pandas as pd
+    from create_synchronized_df import build_image_index, synchronize
+    from synced_df_io import SyncedDfWriter, get_synced_df_path
+
+    config = load_sync_config()
+    camera_dir, _ = camera_frames(session_dir)
+
+    def run():
+        # Same steps as create_synchronized_df.main
+        image_df = build_image_index(os.listdir(camera_dir))
+        location_df = pd.read_csv(os.path.join(session_dir, 'Location.csv'))
+        orientation_df = pd.read_csv(os.path.join(session_dir, 'Orientation.csv'))
+        synced_df = synchronize(location_df, orientation_df, image_df, config)
+
+        with SyncedDfWriter(get_synced_df_path(work_dir, 'csv')) as writer:
+            writer.write(synced_df)
+        return len(synced_df)
+
+    return run
+
+def case_sync_streaming(session_dir, work_dir):
+    sys.path.append(SYNC_DIR)
+    from create_synchronized_df import build_image_index, synchronize_streaming
+    from synced_df_io import get_synced_df_path
+
+    config = load_sync_config()
+    camera_dir, _ = camera_frames(session_dir)
+
+    def run():
+        image_df = build_image_index(os.listdir(camera_dir))
+        return synchronize_streaming(os.path.join(session_dir, 'Location.csv'), os.path.join(session_dir, 'Orientation.csv'),
+                                     image_df, config, get_synced_df_path(work_dir, 'csv'))
+
+    return run
+
+def case_geopose(session_dir, work_dir):
+    sys.path.append(SYNC_DIR)
+    sys.path.append(GEOPOSE_DIR)
+    import pandas as pd
+    from create_synchronized_df import build_image_index, synchronize
+    from create_geopose import write_geopose
+
+    # The synchronized dataframe is the input of the stage, it is not timed
+    camera_dir, _ = camera_frames(session_dir)
+    synced_df = synchronize(pd.read_csv(os.path.join(session_dir, 'Location.csv')),
+                            pd.read_csv(os.path.join(session_dir, 'Orientation.csv')),
+                            build_image_index(os.listdir(camera_dir)), load_sync_config())
+
+    def run():
+        write_geopose(synced_df, os.path.join(work_dir, 'geopose_file.json'))
+        return len(synced_df)
+
+    return run
+
+def case_crop(session_dir, work_dir):
+    sys.path.append(CROP_DIR)
+    from crop_images import process_directory
+
+    camera_dir, _ = camera_frames(session_dir)
+
+    def run():
+        outcomes = process_directory(camera_dir, os.path.join(work_dir, 'crops'), workers=None, decode='roi')
+        return sum(ok for _, ok in outcomes)
+
+    return run
+
+def case_crop_and_classify(session_dir, work_dir):
+    sys.path.append(CLASSIFICATION_DIR)
+    import classify_images
+    from crop_and_classify import crop_and_classify
+
+    classify_images.loaded_model = StubClassifier()
+    camera_dir, _ = camera_frames(session_dir)
+
+    def run():
+        return len(crop_and_classify(camera_dir))
+
+    return run
+
+def mask_case(mask_format):
+    def case(session_dir, work_dir):
+        sys.path.append(ROAD_DIR)
+        from mask_encoding import encode_mask
+
+        camera_dir, frames = camera_frames(session_dir)
+        masks = [road_mask(cv2.imread(os.path.join(camera_dir, frame))).astype(np.uint8) for frame in frames[:MASK_SAMPLES]]
+
+        def run():
+            for i in range(len(frames)):
+                encode_mask(masks[i % len(masks)], mask_format)
+            return len(frames)
+
+        return run
+
+    return case
+
+def case_mask_polygon(session_dir, work_dir):
+    # The 'polygon' format of the road stage, the longest contour only
+    sys.path.append(ROAD_DIR)
+    from segment_road import convert_mask_to_polygon
+
+    camera_dir, frames = camera_frames(session_dir)
+    masks = [road_mask(cv2.imread(os.path.join(camera_dir, frame))) for frame in frames[:MASK_SAMPLES]]
+
+    def run():
+        for i in range(len(frames)):
+            convert_mask_to_polygon(masks[i % len(masks)])
+        return len(frames)
+
+    return run
+
+def case_road(session_dir, work_dir):
+    # segment_road only imports sam2_model in its main, so the stub model runs without torch
+    sys.path.append(ROAD_DIR)
+    from segment_road import process_batches
+
+    camera_dir, frames = camera_frames(session_dir)
+    items = [{'image': frame, 'predicted_class': 'dry-asphalt-good'} for frame in frames]
+
+    def run():
+        return len(process_batches(items, camera_dir, StubMaskingModel(), batch_size=4, mask_format='polygon'))
+
+    return run
+
+def case_road_sequence(session_dir, work_dir):
+    sys.path.append(ROAD_DIR)
+    from segment_road import process_sequence
+
+    camera_dir, frames = camera_frames(session_dir)
+    items = [{'image': frame, 'predicted_class': 'dry-asphalt-good'} for frame in frames]
+
+    def run():
+        results = process_sequence(items, camera_dir, StubMaskingModel(), batch_size=4, mask_format='polygon')
+
+        # The synthetic camera runs at 1 fps like Sensor Logger, if no mask is carried over every frame was re-anchored
+        if not metrics.registry.counters.get('sam2.path.propagated'):
+            raise RuntimeError('Sequence mode propagated no road mask between consecutive frames')
+        return len(results)
+
+    return run
+
+CASES = {
+    'sync': case_sync,
+    'sync_streaming': case_sync_streaming,
+    'geopose': case_geopose,
+    'crop': case_crop,
+    'crop_and_classify': case_crop_and_classify,
+    'mask_polygon': case_mask_polygon,
+    'mask_polygons': mask_case('polygons'),
+    'mask_rle': mask_case('rle'),
+    'road': case_road,
+    'road_sequence': case_road_sequence,
+}
+
+def peak_rss_mb():
+    peak = peak_rss_bytes()
+    return peak / 1024 ** 2 if peak is not None else None
+
+def run_case(name, session_dir, work_dir):
+    """
+    Prepare and time one case in this process.
+
+    Returns:
+        Dictionary with the number of items processed, seconds and memory high-water marks
+    """
+    os.makedirs(work_dir, exist_ok=True)
+
+    run = CASES[name](session_dir, work_dir)
+    setup_rss_mb = peak_rss_mb()
+
+    start = time.perf_counter()
+    items = run()
+    seconds = time.perf_counter() - start
+
+    return {'items': int(items), 'seconds': seconds, 'setup_rss_mb': setup_rss_mb, 'peak_rss_mb': peak_rss_mb()}
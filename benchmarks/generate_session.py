@@ -0,0 +1,234 @@
+# Generates synthetic Sensor Logger sessions of any length for benchmarking:
+# Location.csv and Orientation.csv with epoch nanosecond timestamps and a Camera/ folder of
+# epoch millisecond named JPEGs, laid out like a real recording.
+#
+# python benchmarks/generate_session.py <output_dir> --frames 10000
+
+import os
+import json
+import argparse
+import cv2
+import numpy as np
+import pandas as pd
+
+# Start of every synthetic drive, near UCF in Orlando, FL
+START_LATITUDE = 28.6008
+START_LONGITUDE = -81.2000
+START_ALTITUDE = 30.0
+START_TIME_NS = 1_738_856_794_000_000_000
+
+NS_PER_SECOND = 1_000_000_000
+NS_PER_MS = 1_000_000
+
+# Meters per degree of latitude, longitude degrees are scaled by cos(latitude)
+METERS_PER_DEGREE = 111_320.0
+
+LOCATION_COLUMNS = ['time', 'seconds_elapsed', 'bearingAccuracy', 'speedAccuracy', 'verticalAccuracy', 'horizontalAccuracy',
+                    'speed', 'bearing', 'altitude', 'longitude', 'latitude']
+ORIENTATION_COLUMNS = ['time', 'seconds_elapsed', 'qz', 'qy', 'qx', 'qw', 'roll', 'pitch', 'yaw']
+
+# Asphalt color of the rendered road (BGR), used by the stub road model of the benchmarks
+ROAD_COLOR = (92, 92, 92)
+
+# Written next to the data, a session is only regenerated when these parameters change
+SESSION_FILE = 'session.json'
+
+def generate_trajectory(duration_s, seed=0):
+    """
+    Drive with smoothly varying speed and heading, sampled every 100 ms.
+
+    Returns:
+        Tuple of (seconds, latitude, longitude, altitude, speed, heading in degrees) arrays
+    """
+    rng = np.random.default_rng(seed)
+    seconds = np.arange(0, duration_s + 1, 0.1)
+
+    # Random walks, smoothed so the car accelerates and turns gradually
+    kernel = np.ones(50) / 50
+    speed = np.clip(14 + np.cumsum(np.convolve(rng.normal(0, 0.15, len(seconds)), kernel, 'same')), 3, 25)
+    turn_rate = np.convolve(rng.normal(0, 2.0, len(seconds)), kernel, 'same')
+    heading = (45 + np.cumsum(turn_rate * 0.1)) % 360
+
+    step = speed * 0.1
+    north = np.cumsum(step * np.cos(np.radians(heading)))
+    east = np.cumsum(step * np.sin(np.radians(heading)))
+
+    latitude = START_LATITUDE + north / METERS_PER_DEGREE
+    longitude = START_LONGITUDE + east / (METERS_PER_DEGREE * np.cos(np.radians(START_LATITUDE)))
+    altitude = START_ALTITUDE + 2 * np.sin(seconds / 60) + rng.normal(0, 0.3, len(seconds))
+
+    return seconds, latitude, longitude, altitude, speed, heading
+
+def sample(seconds, trajectory_seconds, values):
+    return np.interp(seconds, trajectory_seconds, values)
+
+def euler_to_quaternion(roll, pitch, yaw):
+    # ZYX rotation, angles in radians
+    cr, sr = np.cos(roll / 2), np.sin(roll / 2)
+    cp, sp = np.cos(pitch / 2), np.sin(pitch / 2)
+    cy, sy = np.cos(yaw / 2), np.sin(yaw / 2)
+
+    qw = cr * cp * cy + sr * sp * sy
+    qx = sr * cp * cy - cr * sp * sy
+    qy = cr * sp * cy + sr * cp * sy
+    qz = cr * cp * sy - sr * sp * cy
+    return qx, qy, qz, qw
+
+def sensor_times(duration_s, rate_hz, jitter_ms, rng):
+    # Sensor timestamps at rate_hz with timing jitter, never decreasing, in epoch nanoseconds
+    count = int(duration_s * rate_hz)
+    times = np.arange(count) * (NS_PER_SECOND / rate_hz) + rng.normal(0, jitter_ms * NS_PER_MS, count)
+    return START_TIME_NS + np.maximum.accumulate(times.astype(np.int64))
+
+def render_frame(width, height, variant, seed=0):
+    """
+    Render a forward-facing dashcam-like frame: sky, roadside and a textured road with lane markings.
+
+    Args:
+        variant: Index of the frame variant, which shifts the road and the markings
+
+    Returns:
+        BGR image as numpy array
+    """
+    rng = np.random.default_rng(seed * 1000 + variant)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+
+    horizon = int(height * 0.45)
+    frame[:horizon] = np.linspace((235, 200, 150), (200, 170, 130), horizon).astype(np.uint8)[:, None, :]
+    frame[horizon:] = (60, 110, 70)
+
+    # Road trapezoid, its vanishing point moves as the car turns
+    vanishing_x = width // 2 + int(rng.normal(0, width * 0.05))
+    road = np.array([[vanishing_x - width // 40, horizon], [vanishing_x + width // 40, horizon],
+                     [int(width * 0.95), height], [int(width * 0.05), height]], dtype=np.int32)
+    cv2.fillPoly(frame, [road], ROAD_COLOR)
+
+    # Dashed center line, phase shifted per variant so frames are not identical
+    def center_line(t):
+        # Point of the center line, t runs from the horizon (0) to the bottom edge (1) with perspective
+        t = t ** 2
+        return int(vanishing_x + (width // 2 - vanishing_x) * t), int(horizon + (height - horizon) * t)
+
+    for i in range(12):
+        t0 = ((i + variant * 0.3) % 12) / 12
+        cv2.line(frame, center_line(t0), center_line(min(1.0, t0 + 0.04)), (220, 220, 220), max(1, int(8 * t0 * width / 1280)))
+
+    # Sensor noise, so frames do not compress unrealistically well
+    noise = rng.normal(0, 3, frame.shape)
+    return np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+def generate_session(output_dir, frames, width=960, height=540, camera_fps=1.0, location_hz=1.0, orientation_hz=10.0,
+                     unique_frames=64, jpeg_quality=90, seed=0):
+    """
+    Write a synthetic session, reusing it when one with the same parameters already exists.
+
+    Only unique_frames distinct images are rendered and encoded, the other frames are copies of
+    their bytes, so large sessions are generated quickly while every frame still has to be decoded.
+
+    Args:
+        output_dir: Session directory, Location.csv, Orientation.csv and Camera/ are written there
+        frames: Number of camera frames
+        width: Frame width in pixels
+        height: Frame height in pixels
+        camera_fps: Camera frames per second
+        location_hz: Location rows per second
+        orientation_hz: Orientation rows per second
+        unique_frames: Number of distinct frame images
+        jpeg_quality: JPEG quality of the frames
+        seed: Seed of the trajectory and the frame variants
+
+    Returns:
+        Session parameters written to session.json
+    """
+    params = {'frames': frames, 'width': width, 'height': height, 'camera_fps': camera_fps, 'location_hz': location_hz,
+              'orientation_hz': orientation_hz, 'unique_frames': unique_frames, 'jpeg_quality': jpeg_quality, 'seed': seed}
+
+    session_file = os.path.join(output_dir, SESSION_FILE)
+    if os.path.exists(session_file):
+        with open(session_file, 'r') as f:
+            if json.load(f) == params:
+                return params
+
+    rng = np.random.default_rng(seed)
+    duration_s = frames / camera_fps
+    trajectory = generate_trajectory(duration_s + 1, seed)
+    trajectory_seconds = trajectory[0]
+
+    # Location.csv
+    location_times = sensor_times(duration_s, location_hz, 15, rng)
+    location_seconds = (location_times - START_TIME_NS) / NS_PER_SECOND
+    latitude, longitude, altitude, speed, heading = (sample(location_seconds, trajectory_seconds, values) for values in trajectory[1:])
+    location_count = len(location_times)
+
+    location_df = pd.DataFrame({
+        'time': location_times,
+        'seconds_elapsed': location_seconds,
+        'bearingAccuracy': rng.uniform(5, 20, location_count),
+        'speedAccuracy': rng.uniform(0.3, 1.5, location_count),
+        'verticalAccuracy': rng.uniform(2, 8, location_count),
+        'horizontalAccuracy': rng.uniform(3, 10, location_count),
+        'speed': speed,
+        'bearing': heading,
+        'altitude': altitude,
+        'longitude': longitude,
+        'latitude': latitude,
+    }, columns=LOCATION_COLUMNS)
+
+    # Orientation.csv, the phone is mounted facing forward so its yaw follows the heading
+    orientation_times = sensor_times(duration_s, orientation_hz, 2, rng)
+    orientation_seconds = (orientation_times - START_TIME_NS) / NS_PER_SECOND
+    orientation_count = len(orientation_times)
+
+    yaw = np.radians(sample(orientation_seconds, trajectory_seconds, trajectory[5]))
+    pitch = np.radians(-80 + rng.normal(0, 0.5, orientation_count))
+    roll = np.radians(rng.normal(0, 0.8, orientation_count))
+    qx, qy, qz, qw = euler_to_quaternion(roll, pitch, yaw)
+
+    orientation_df = pd.DataFrame({'time': orientation_times, 'seconds_elapsed': orientation_seconds, 'qz': qz, 'qy': qy,
+                                   'qx': qx, 'qw': qw, 'roll': roll, 'pitch': pitch, 'yaw': yaw}, columns=ORIENTATION_COLUMNS)
+
+    os.makedirs(output_dir, exist_ok=True)
+    location_df.to_csv(os.path.join(output_dir, 'Location.csv'), index=False)
+    orientation_df.to_csv(os.path.join(output_dir, 'Orientation.csv'), index=False)
+
+    # Camera/, frames are named by their capture time in epoch milliseconds
+    camera_dir = os.path.join(output_dir, 'Camera')
+    os.makedirs(camera_dir, exist_ok=True)
+    for name in os.listdir(camera_dir):
+        os.remove(os.path.join(camera_dir, name))
+
+    encoded = []
+    for variant in range(min(unique_frames, frames)):
+        ok, buffer = cv2.imencode('.jpg', render_frame(width, height, variant, seed), [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        encoded.append(buffer.tobytes())
+
+    frame_times = sensor_times(duration_s, camera_fps, 30, rng) // NS_PER_MS
+    for i, frame_time in enumerate(frame_times):
+        with open(os.path.join(camera_dir, f'{frame_time}.jpg'), 'wb') as f:
+            f.write(encoded[i % len(encoded)])
+
+    with open(session_file, 'w') as f:
+        json.dump(params, f, indent=2)
+
+    return params
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Sensor Logger session')
+    parser.add_argument('output_dir')
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--width', type=int, default=960)
+    parser.add_argument('--height', type=int, default=540)
+    parser.add_argument('--camera-fps', type=float, default=1.0)
+    parser.add_argument('--location-hz', type=float, default=1.0)
+    parser.add_argument('--orientation-hz', type=float, default=10.0)
+    parser.add_argument('--unique-frames', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_session(args.output_dir, args.frames, args.width, args.height, args.camera_fps, args.location_hz,
+                     args.orientation_hz, args.unique_frames, seed=args.seed)
+
+    print(f'Synthetic session with {args.frames} frames saved to {args.output_dir}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# End-to-end benchmarks of the processing stages on synthetic sessions.
+#
+# Every (case, scale) pair runs in a fresh Python process, which reports its throughput and peak
+# memory. Results are saved to benchmarks/results/<timestamp>.json and compared with the previous
+# results file, so regressions show up between runs.
+#
+# python benchmarks/run_benchmarks.py --frames 1000,10000 --cases sync,geopose,crop
+
+import os
+import sys
+import json
+import glob
+import shutil
+import datetime
+import platform
+import argparse
+import subprocess
+from generate_session import generate_session
+from benchmark_cases import CASES, run_case
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+SCALES = (1_000, 10_000, 100_000)
+
+DEFAULT_DATA_DIR = os.path.join(script_dir, 'data')
+DEFAULT_RESULTS_DIR = os.path.join(script_dir, 'results')
+
+# Relative change in throughput or peak memory reported as a regression
+DEFAULT_THRESHOLD = 0.10
+
+def run_in_process(case, session_dir, work_dir):
+    """
+    Run a case in a new process.
+
+    Returns:
+        Result dictionary of the case, with status 'ok', 'skipped' (missing dependency) or 'failed'
+    """
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', case, '--session', session_dir,
+                                '--work-dir', work_dir], capture_output=True, text=True)
+
+    # The case result is the last line, stage output comes before it
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode == 0 and lines:
+        return dict(json.loads(lines[-1]), status='ok')
+
+    error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f'exit code {completed.returncode}'
+    status = 'skipped' if 'ModuleNotFoundError' in error or 'ImportError' in error else 'failed'
+    return {'status': status, 'error': error}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=script_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def latest_results(results_dir):
+    paths = sorted(glob.glob(os.path.join(results_dir, '*.json')))
+    return paths[-1] if paths else None
+
+def compare(results, previous, threshold=DEFAULT_THRESHOLD):
+    """
+    Print the change of every case against previous results.
+
+    Returns:
+        List of (case, frames, reason) regressions
+    """
+    previous_results = {(result['case'], result['frames']): result for result in previous['results'] if result['status'] == 'ok'}
+    regressions = []
+
+    print(f"\nCompared with {previous.get('commit') or 'unknown commit'} ({previous['created']})")
+    print(f"{'Case':<20} {'Frames':>8} {'Items/s':>10} {'Before':>10} {'Change':>8} {'Peak MB':>9} {'Before':>9} {'Change':>8}")
+
+    for result in results['results']:
+        before = previous_results.get((result['case'], result['frames']))
+        if result['status'] != 'ok' or before is None:
+            continue
+
+        speed_change = result['items_per_second'] / before['items_per_second'] - 1
+        line = (f"{result['case']:<20} {result['frames']:>8} {result['items_per_second']:>10.1f} "
+                f"{before['items_per_second']:>10.1f} {speed_change:>+8.1%}")
+
+        if speed_change < -threshold:
+            regressions.append((result['case'], result['frames'], f'throughput {speed_change:+.1%}'))
+
+        if result['peak_rss_mb'] and before['peak_rss_mb']:
+            memory_change = result['peak_rss_mb'] / before['peak_rss_mb'] - 1
+            line += f" {result['peak_rss_mb']:>9.0f} {before['peak_rss_mb']:>9.0f} {memory_change:>+8.1%}"
+
+            if memory_change > threshold:
+                regressions.append((result['case'], result['frames'], f'peak memory {memory_change:+.1%}'))
+
+        print(line)
+
+    for case, frames, reason in regressions:
+        print(f'Regression: {case} at {frames} frames, {reason}')
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the processing stages on synthetic Sensor Logger sessions')
+    parser.add_argument('--frames', default=','.join(str(scale) for scale in SCALES), help='Comma separated session sizes')
+    parser.add_argument('--cases', default=','.join(CASES), help=f'Comma separated cases, from {",".join(CASES)}')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Where the synthetic sessions are generated and kept')
+    parser.add_argument('--results-dir', default=DEFAULT_RESULTS_DIR)
+    parser.add_argument('--compare', help='Results file to compare with, defaults to the latest one in --results-dir')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Relative change reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 when a regression is found')
+
+    # Used by the benchmark itself to run a single case in a child process
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--session', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.session, args.work_dir)))
+        return
+
+    scales = [int(frames) for frames in args.frames.split(',')]
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        parser.error(f'Unknown cases {unknown}, expected any of {list(CASES)}')
+
+    results = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': [],
+    }
+
+    print(f"{'Case':<20} {'Frames':>8} {'Items':>8} {'Seconds':>9} {'Items/s':>10} {'Peak MB':>9}")
+
+    for frames in scales:
+        session_dir = os.path.join(args.data_dir, f'session_{frames}')
+        print(f'Preparing synthetic session with {frames} frames in {session_dir}')
+        generate_session(session_dir, frames)
+
+        for case in cases:
+            work_dir = os.path.join(args.data_dir, 'work', f'{case}_{frames}')
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+            result = dict(case=case, frames=frames, **run_in_process(case, session_dir, work_dir))
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+            if result['status'] != 'ok':
+                print(f"{case:<20} {frames:>8} {result['status']}: {result['error']}")
+            else:
+                result['items_per_second'] = result['items'] / result['seconds']
+                peak = f"{result['peak_rss_mb']:>9.0f}" if result['peak_rss_mb'] is not None else f"{'n/a':>9}"
+                print(f"{case:<20} {frames:>8} {result['items']:>8} {result['seconds']:>9.2f} {result['items_per_second']:>10.1f} {peak}")
+
+            results['results'].append(result)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    results_path = os.path.join(args.results_dir, datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+
+    previous_path = args.compare or latest_results(args.results_dir)
+
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults saved to {results_path}')
+
+    if previous_path:
+        with open(previous_path, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+# Decoded camera frame cache shared by the pipeline stages, so each JPEG is decoded once per run.
+#
+# Frames are decoded with cv2.imread (BGR, EXIF orientation applied) and kept in a bounded LRU.
+# With shared=True decoded frames are placed in named shared memory blocks, which other processes
+# using the same namespace (e.g. multiprocessing workers or a second inference worker) attach to
+# instead of decoding the frame again.
+
+import os
+import sys
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+import metrics
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+# Header of a shared block: ready flag, height, width, channels
+HEADER = struct.Struct('4i')
+
+COLOR_MODES = ('bgr', 'rgb')
+
+class FrameCache:
+    """
+    Args:
+        max_bytes: Upper bound of the decoded frames kept by this process
+        shared: Back the cache with named shared memory visible to other processes
+        namespace: Processes only share frames within the same namespace
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, shared=False, namespace='frames'):
+        if shared and shared_memory is None:
+            raise ValueError('Shared frame caches need multiprocessing.shared_memory (Python 3.8+)')
+
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.namespace = namespace
+
+        if shared:
+            # Worker processes forked later inherit this resource tracker instead of starting their own,
+            # which would unlink the frames they published as soon as the pool exits
+            resource_tracker.ensure_running()
+
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()
+        self.total_bytes = 0
+
+        # Shared blocks opened by this process, and the ones it created and has to unlink
+        self.blocks = {}
+        self.owned = set()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __reduce__(self):
+        # Worker processes get one empty cache per process with the same settings, shared frames stay reachable
+        return process_cache, (self.max_bytes, self.shared, self.namespace)
+
+    def make_key(self, path):
+        # A rewritten file gets a new key, so stale frames are never returned
+        stat = os.stat(path)
+        identity = f'{self.namespace}:{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+        return 'fc_' + hashlib.sha1(identity.encode()).hexdigest()[:24]
+
+    def get(self, path, color='bgr'):
+        """
+        Return the decoded frame, decoding it only if no process has done so yet.
+
+        Args:
+            path: Path of the image file
+            color: 'bgr' (as cv2.imread) or 'rgb' (as PIL)
+
+        Returns:
+            Read-only uint8 array of shape (height, width, 3), or None if the image could not be read.
+            'rgb' frames are contiguous copies.
+        """
+        if color not in COLOR_MODES:
+            raise ValueError(f"Unknown color mode '{color}', expected one of {COLOR_MODES}")
+
+        key = self.make_key(path)
+
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+                self.hits += 1
+                metrics.increment('frame_cache.hits')
+
+        if frame is None and self.shared:
+            frame = self._attach(key)
+            if frame is not None:
+                with self.lock:
+                    self.hits += 1
+                metrics.increment('frame_cache.shared_hits')
+                self._remember(key, frame)
+
+        if frame is None:
+            with self.lock:
+                self.misses += 1
+            metrics.increment('frame_cache.misses')
+            with metrics.timer('frame.decode'):
+                frame = cv2.imread(path)
+            if frame is None:
+                return None
+
+            if self.shared:
+                frame = self._publish(key, frame)
+            frame.setflags(write=False)
+            self._remember(key, frame)
+
+        if color == 'rgb':
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame
+
+    def _remember(self, key, frame):
+        with self.lock:
+            if key in self.frames:
+                return
+            self.frames[key] = frame
+            self.total_bytes += frame.nbytes
+
+            while self.total_bytes > self.max_bytes and len(self.frames) > 1:
+                evicted_key, evicted = self.frames.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                self._release(evicted_key)
+
+    def _attach(self, key):
+        try:
+            block = attach_untracked(key)
+        except FileNotFoundError:
+            return None
+
+        ready, height, width, channels = HEADER.unpack_from(block.buf)
+        if not ready:
+            # Still being written by another process
+            block.close()
+            return None
+
+        with self.lock:
+            # Another thread may have attached the same frame meanwhile, its mapping is reused
+            if key in self.blocks:
+                block.close()
+                block = self.blocks[key]
+            else:
+                self.blocks[key] = block
+        frame = np.ndarray((height, width, channels), dtype=np.uint8, buffer=block.buf, offset=HEADER.size)
+        frame.setflags(write=False)
+        return frame
+
+    def _publish(self, key, frame):
+        frame = np.ascontiguousarray(frame)
+
+        try:
+            block = shared_memory.SharedMemory(name=key, create=True, size=HEADER.size + frame.nbytes)
+        except FileExistsError:
+            # Another process decoded the same frame at the same time, keep the private copy
+            return frame
+
+        shared_frame = np.ndarray(frame.shape, dtype=np.uint8, buffer=block.buf, offset=HEADER.size)
+        shared_frame[:] = frame
+
+        # The ready flag is written last so readers never see a partial frame
+        HEADER.pack_into(block.buf, 0, 0, *frame.shape)
+        HEADER.pack_into(block.buf, 0, 1, *frame.shape)
+
+        with self.lock:
+            self.blocks[key] = block
+            self.owned.add(key)
+        return shared_frame
+
+    def _release(self, key):
+        # Called with the lock held
+        block = self.blocks.pop(key, None)
+        if block is None:
+            return
+
+        try:
+            block.close()
+        except BufferError:
+            # A caller still holds a view of the frame, the mapping goes away with it
+            pass
+
+        if key in self.owned:
+            self.owned.discard(key)
+            block.unlink()
+
+    def stats(self):
+        with self.lock:
+            return {'frames': len(self.frames), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        # Drop every frame and unlink the shared blocks this process created
+        with self.lock:
+            keys = list(self.blocks)
+            self.frames.clear()
+            self.total_bytes = 0
+
+            for key in keys:
+                self._release(key)
+
+    def unlink_frames(self, paths):
+        """
+        Close the cache and remove the shared blocks of the given frames, whichever process of the
+        namespace published them.
+
+        Blocks published by pool workers outlive the workers so later stages can attach to them. The
+        process which started the pool removes them with this once it is done with the frames,
+        otherwise its resource tracker reclaims them at exit and warns about leaked shared memory.
+
+        Args:
+            paths: Paths of the image files
+        """
+        self.close()
+        if not self.shared:
+            return
+
+        for path in paths:
+            try:
+                block = attach_untracked(self.make_key(path))
+            except FileNotFoundError:
+                # Never published, or the image itself is gone
+                continue
+
+            block.close()
+            block.unlink()
+
+            # Python 3.13 does not unregister untracked blocks on unlink, the worker registered this one
+            if sys.version_info >= (3, 13):
+                resource_tracker.unregister(block._name, 'shared_memory')
+
+# Caches of worker processes, keyed by their settings
+_process_caches = {}
+
+def process_cache(max_bytes, shared, namespace):
+    """
+    Return the cache of this process for the given settings, used when a FrameCache is sent to a
+    worker process. Shared blocks created by workers are removed by the resource tracker of the
+    main process when it exits, so they stay available to the later stages.
+    """
+    key = (max_bytes, shared, namespace)
+    if key not in _process_caches:
+        _process_caches[key] = FrameCache(max_bytes, shared, namespace)
+    return _process_caches[key]
+
+# Serializes the resource tracker workaround in attach_untracked
+_attach_lock = threading.Lock()
+
+def attach_untracked(name):
+    """
+    Attach to an existing shared memory block without registering it with the resource tracker.
+    Before Python 3.13 attaching registers the block, and the tracker then unlinks it when this
+    process exits even though another process created it and still uses it.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+def read_frame(path, frame_cache=None, color='bgr'):
+    """
+    Read a frame through the cache when one is given, otherwise decode it directly.
+
+    Returns:
+        uint8 array of shape (height, width, 3), or None if the image could not be read
+    """
+    if frame_cache is not None:
+        return frame_cache.get(path, color)
+
+    with metrics.timer('frame.decode'):
+        frame = cv2.imread(path)
+    if frame is None or color == 'bgr':
+        return frame
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -0,0 +1,347 @@
+# Lightweight instrumentation shared by the pipeline modules: timers, counters and memory high-water marks.
+#
+# Timers and counters are always aggregated in memory, which costs about a microsecond per timed block.
+# When a trace file is configured every timed block is also written to it as one JSON line, and
+# write_prometheus saves the aggregates in the Prometheus text format. Set DT_METRICS_DIR to enable
+# both for any script without changing it:
+#
+#   DT_METRICS_DIR=metrics python modules/road_segmentation/segment_road.py
+#
+# writes metrics/trace_<timestamp>_<pid>.jsonl while running and metrics/metrics_<timestamp>_<pid>.prom on exit.
+
+import os
+import sys
+import json
+import time
+import atexit
+import datetime
+import functools
+import threading
+
+# Environment variable which enables the trace and the Prometheus snapshot for a whole run
+METRICS_DIR_ENV = 'DT_METRICS_DIR'
+
+# Prefix of the exported Prometheus metric names
+PROMETHEUS_PREFIX = 'dt'
+
+# Memory is sampled at most this often, at the end of timed blocks
+MEMORY_SAMPLE_SECONDS = 1.0
+
+def peak_rss_bytes():
+    """
+    Returns:
+        Largest resident set size of this process and its finished child processes, in bytes,
+        or None where it can not be measured
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+
+    # Bytes on macOS, kilobytes on Linux
+    unit = 1 if sys.platform == 'darwin' else 1024
+    own_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+
+    # On Linux ru_maxrss survives exec, so it can be the peak of the process which started this one.
+    # VmHWM belongs to the current process image only.
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    own_peak = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return max(own_peak, children_peak)
+
+class Metrics:
+    """
+    Registry of the timers and counters of one process.
+
+    Args:
+        trace_path: Optional JSONL file every timed block is appended to
+    """
+    def __init__(self, trace_path=None):
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.peak_rss = None
+        self.last_memory_sample = 0.0
+        self.trace_file = None
+
+        if trace_path is not None:
+            self.open_trace(trace_path)
+
+    def open_trace(self, trace_path):
+        os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+
+        # Appending keeps the lines of forked worker processes writing to the same file intact
+        self.trace_file = open(trace_path, 'a', buffering=1)
+
+    def timer(self, name, **fields):
+        """
+        Time a block or a function.
+
+            with metrics.timer('sam2.set_image', items=len(images)):
+                ...
+
+            @metrics.timer('crop.read_crop')
+            def read_crop(...):
+
+        Args:
+            name: Timer name, dotted by module, e.g. 'sync.merge_image'
+            fields: Extra values written to the trace, 'items' is also summed per timer
+        """
+        return Timer(self, name, fields)
+
+    def record(self, name, seconds, fields=None):
+        items = fields.get('items', 1) if fields else 1
+
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'items': 0, 'peak_rss_bytes': None}
+
+            timer['count'] += 1
+            timer['seconds'] += seconds
+            timer['items'] += items
+            timer['max_seconds'] = max(timer['max_seconds'], seconds)
+
+        now = time.monotonic()
+        if now - self.last_memory_sample >= MEMORY_SAMPLE_SECONDS:
+            self.last_memory_sample = now
+            peak = self.sample_memory()
+            if peak is not None:
+                with self.lock:
+                    timer['peak_rss_bytes'] = max(timer['peak_rss_bytes'] or 0, peak)
+
+        if self.trace_file is not None:
+            self.trace({'event': 'timer', 'name': name, 'seconds': round(seconds, 6), **(fields or {})})
+
+    def increment(self, name, value=1):
+        # Add to a counter, e.g. metrics.increment('road.refinement.single-pass')
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def sample_memory(self):
+        peak = peak_rss_bytes()
+        if peak is None:
+            return None
+
+        with self.lock:
+            new_peak = self.peak_rss is None or peak > self.peak_rss
+            if new_peak:
+                self.peak_rss = peak
+
+        if new_peak and self.trace_file is not None:
+            self.trace({'event': 'memory', 'peak_rss_bytes': peak})
+        return peak
+
+    def trace(self, event):
+        line = json.dumps(dict(event, time=round(time.time(), 6), pid=os.getpid()), separators=(',', ':'))
+
+        # One write per line, so lines of concurrent threads and processes do not interleave
+        with self.lock:
+            self.trace_file.write(line + '\n')
+
+    def snapshot(self):
+        """
+        Returns:
+            Dictionary with a copy of the timers, counters and the memory high-water mark
+        """
+        self.sample_memory()
+        with self.lock:
+            return {
+                'timers': {name: dict(timer) for name, timer in self.timers.items()},
+                'counters': dict(self.counters),
+                'peak_rss_bytes': self.peak_rss,
+            }
+
+    def reset(self):
+        # Forget the timers and counters, e.g. the ones a forked worker process inherited from its parent
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def drain(self):
+        """
+        Take the timers and counters collected so far and start over, so a worker process can
+        hand its share of the work to the parent after every task.
+
+        Returns:
+            Dictionary in the format of snapshot, to be passed to merge
+        """
+        self.sample_memory()
+        with self.lock:
+            snapshot = {'timers': self.timers, 'counters': self.counters, 'peak_rss_bytes': self.peak_rss}
+            self.timers = {}
+            self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add the timers and counters of another registry, e.g. one drained in a worker process.
+        Its memory high-water mark is kept per timer, the process one already covers finished children.
+        """
+        with self.lock:
+            for name, other in snapshot['timers'].items():
+                timer = self.timers.get(name)
+                if timer is None:
+                    self.timers[name] = dict(other)
+                    continue
+
+                timer['count'] += other['count']
+                timer['seconds'] += other['seconds']
+                timer['items'] += other['items']
+                timer['max_seconds'] = max(timer['max_seconds'], other['max_seconds'])
+                if other['peak_rss_bytes'] is not None:
+                    timer['peak_rss_bytes'] = max(timer['peak_rss_bytes'] or 0, other['peak_rss_bytes'])
+
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def prometheus_text(self):
+        """
+        Returns:
+            Snapshot in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{PROMETHEUS_PREFIX}_{name}{labels} {value}')
+
+        timers = sorted(snapshot['timers'].items())
+        timer_label = lambda name: '{timer="%s"}' % name
+
+        lines.append(f'# HELP {PROMETHEUS_PREFIX}_timer_seconds Time spent in each timed block.')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_timer_seconds summary')
+        for name, timer in timers:
+            lines.append(f'{PROMETHEUS_PREFIX}_timer_seconds_sum{timer_label(name)} {timer["seconds"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_timer_seconds_count{timer_label(name)} {timer["count"]}')
+
+        family('timer_max_seconds', 'gauge', 'Longest single run of each timed block.',
+               [(timer_label(name), timer['max_seconds']) for name, timer in timers])
+        family('timer_items_total', 'counter', 'Items processed by each timed block.',
+               [(timer_label(name), timer['items']) for name, timer in timers])
+
+        family('events_total', 'counter', 'Counters incremented by the pipeline modules.',
+               [('{counter="%s"}' % name, value) for name, value in sorted(snapshot['counters'].items())])
+
+        family('timer_peak_rss_bytes', 'gauge', 'Resident memory high-water mark sampled at the end of each timed block.',
+               [(timer_label(name), timer['peak_rss_bytes']) for name, timer in timers if timer['peak_rss_bytes'] is not None])
+
+        if snapshot['peak_rss_bytes'] is not None:
+            family('process_peak_rss_bytes', 'gauge', 'Resident memory high-water mark of the process.',
+                   [('', snapshot['peak_rss_bytes'])])
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Save a snapshot in the Prometheus text exposition format, e.g. for the node exporter textfile collector.
+        """
+        text = self.prometheus_text()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(text)
+
+        # Collectors never read a half written file
+        os.replace(temp_path, path)
+
+    def report(self):
+        # Timers sorted by total time, printed at the end of a run
+        snapshot = self.snapshot()
+
+        print(f"{'Timer':<32} {'Calls':>8} {'Total (s)':>10} {'Mean (ms)':>10} {'Max (ms)':>10} {'Items/s':>10}")
+        for name, timer in sorted(snapshot['timers'].items(), key=lambda entry: -entry[1]['seconds']):
+            items_per_second = timer['items'] / timer['seconds'] if timer['seconds'] else 0.0
+            print(f"{name:<32} {timer['count']:>8} {timer['seconds']:>10.2f} {1000 * timer['seconds'] / timer['count']:>10.2f} "
+                  f"{1000 * timer['max_seconds']:>10.2f} {items_per_second:>10.1f}")
+
+        for name, value in sorted(snapshot['counters'].items()):
+            print(f'{name:<32} {value:>8}')
+
+        if snapshot['peak_rss_bytes'] is not None:
+            print(f"Peak memory: {snapshot['peak_rss_bytes'] / 1024 ** 2:.0f} MB")
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+class Timer:
+    # Context manager and decorator created by Metrics.timer
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fields = self.fields
+        if exc_type is not None:
+            fields = dict(fields, error=exc_type.__name__)
+        self.metrics.record(self.name, time.perf_counter() - self.start, fields)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Timer(self.metrics, self.name, self.fields):
+                return function(*args, **kwargs)
+        return wrapper
+
+# Registry of this process, used through the module level functions below
+registry = Metrics()
+
+def timer(name, **fields):
+    return registry.timer(name, **fields)
+
+def increment(name, value=1):
+    registry.increment(name, value)
+
+def configure(output_dir, run_name=None):
+    """
+    Write the trace of this process to output_dir, and the Prometheus snapshot when it exits.
+
+    Args:
+        output_dir: Directory of the trace and snapshot files
+        run_name: Prefix of the file names, defaults to the start time
+
+    Returns:
+        Tuple of (trace path, Prometheus snapshot path)
+    """
+    run_name = run_name or datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    trace_path = os.path.join(output_dir, f'trace_{run_name}_{os.getpid()}.jsonl')
+    prometheus_path = os.path.join(output_dir, f'metrics_{run_name}_{os.getpid()}.prom')
+
+    registry.close()
+    registry.open_trace(trace_path)
+    configuring_pid = os.getpid()
+
+    def finish():
+        # Forked worker processes inherit this handler but only the configuring process writes the snapshot
+        if os.getpid() == configuring_pid:
+            registry.write_prometheus(prometheus_path)
+        registry.close()
+
+    atexit.register(finish)
+    return trace_path, prometheus_path
+
+if os.environ.get(METRICS_DIR_ENV):
+    configure(os.environ[METRICS_DIR_ENV])
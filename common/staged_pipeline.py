@@ -0,0 +1,218 @@
+# Staged execution engine which overlaps reading, inference and post-processing.
+#
+# Every stage has its own workers (threads, or a process pool) and reads from a bounded queue filled
+# by the stage before it. A full queue blocks the stage feeding it, and the number of items inside the
+# pipeline is capped, so memory stays bounded no matter how fast the input is read. Results come out
+# in input order.
+
+import time
+import heapq
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Seconds between checks of the stop flag while blocked on a queue
+POLL_SECONDS = 0.1
+
+# Marks the end of the input on a queue
+_DONE = object()
+
+class Stage:
+    """
+    Args:
+        name: Stage name used in errors and stats
+        function: Called with the output of the previous stage (or an input item), returns the input of the next stage
+        workers: Number of items processed concurrently
+        prefetch: Items which may wait in front of this stage, defaults to 2 per worker
+        processes: Run function in a process pool instead of threads, function and items must be picklable
+        ordered: Call function in input order, e.g. for stateful stages, needs workers=1
+    """
+    def __init__(self, name, function, workers=1, prefetch=None, processes=False, ordered=False):
+        if workers < 1:
+            raise ValueError(f"Stage '{name}' needs at least one worker")
+        if ordered and workers != 1:
+            raise ValueError(f"Ordered stage '{name}' must have a single worker")
+
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.prefetch = prefetch or 2 * workers
+        self.processes = processes
+        self.ordered = ordered
+
+class StageError(Exception):
+    # Raised by StagedPipeline.run when a stage fails, the original exception is the __cause__
+    def __init__(self, stage, error):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+
+class _Stopped(Exception):
+    pass
+
+class StagedPipeline:
+    """
+    Args:
+        stages: List of Stage, in processing order
+        max_in_flight: Upper bound of items inside the pipeline, defaults to what the queues and workers can hold
+    """
+    def __init__(self, stages, max_in_flight=None):
+        if not stages:
+            raise ValueError('A pipeline needs at least one stage')
+
+        self.stages = stages
+        self.max_in_flight = max_in_flight or sum(stage.prefetch + stage.workers for stage in stages)
+        self.stats = {}
+
+    def run(self, items):
+        """
+        Feed items through the stages.
+
+        Args:
+            items: Iterable of inputs of the first stage, read lazily
+
+        Yields:
+            Output of the last stage for every item, in input order
+        """
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+        self.in_flight = threading.Semaphore(self.max_in_flight)
+        self.stats = {stage.name: {'items': 0, 'busy_seconds': 0.0, 'idle_seconds': 0.0} for stage in self.stages}
+
+        queues = [queue.Queue(maxsize=stage.prefetch) for stage in self.stages]
+        # The consumer reorders the results, so the last queue only needs to absorb bursts
+        queues.append(queue.Queue(maxsize=self.stages[-1].workers))
+
+        pools = [ProcessPoolExecutor(max_workers=stage.workers) if stage.processes else None for stage in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(stage, pools[i], queues[i], queues[i + 1], remaining),
+                                                daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            yield from self._collect(queues[-1])
+        finally:
+            # Also reached when the caller stops iterating early
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            for pool in pools:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+
+    def _put(self, target, value):
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                target.put(value, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, source):
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                return source.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+    def _fail(self, stage, error):
+        with self.lock:
+            if self.error is None:
+                self.error = StageError(stage, error)
+                self.error.__cause__ = error
+        self.stop.set()
+
+    def _feed(self, items, target):
+        try:
+            for index, item in enumerate(items):
+                # Backpressure: wait until an earlier item has left the pipeline
+                while not self.in_flight.acquire(timeout=POLL_SECONDS):
+                    if self.stop.is_set():
+                        return
+                self._put(target, (index, item))
+            self._put(target, _DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            self._fail('input', e)
+
+    def _work(self, stage, pool, source, target, remaining):
+        stats = self.stats[stage.name]
+        pending = []
+        next_index = 0
+
+        try:
+            while True:
+                start = time.perf_counter()
+                entry = self._get(source)
+                with self.lock:
+                    stats['idle_seconds'] += time.perf_counter() - start
+
+                if entry is _DONE:
+                    # Let the other workers of this stage see the end too, the last one passes it on
+                    self._put(source, _DONE)
+                    with self.lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last:
+                        self._put(target, _DONE)
+                    return
+
+                if not stage.ordered:
+                    self._process(stage, pool, entry, target)
+                    continue
+
+                heapq.heappush(pending, entry)
+                while pending and pending[0][0] == next_index:
+                    self._process(stage, pool, heapq.heappop(pending), target)
+                    next_index += 1
+        except _Stopped:
+            pass
+        except Exception as e:
+            self._fail(stage.name, e)
+
+    def _process(self, stage, pool, entry, target):
+        index, item = entry
+        start = time.perf_counter()
+
+        if pool is not None:
+            result = pool.submit(stage.function, item).result()
+        else:
+            result = stage.function(item)
+
+        with self.lock:
+            stats = self.stats[stage.name]
+            stats['busy_seconds'] += time.perf_counter() - start
+            stats['items'] += 1
+
+        self._put(target, (index, result))
+
+    def _collect(self, source):
+        pending = []
+        next_index = 0
+
+        while True:
+            try:
+                entry = self._get(source)
+            except _Stopped:
+                raise self.error
+
+            if entry is _DONE:
+                return
+
+            heapq.heappush(pending, entry)
+            while pending and pending[0][0] == next_index:
+                _, result = heapq.heappop(pending)
+                next_index += 1
+                self.in_flight.release()
+                yield result
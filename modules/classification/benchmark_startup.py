@@ -0,0 +1,81 @@
+# Startup benchmark of the classification scripts: import time, model load time and
+# first-prediction latency of each backend. Every measurement runs in a fresh Python
+# process so nothing is already imported or loaded.
+
+import os
+import sys
+import json
+import subprocess
+
+# Get the directory of the script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# (backend, quantization) pairs to measure
+BACKEND_CONFIGS = [
+    ('keras', None),
+    ('savedmodel', None),
+    ('tflite', 'float16'),
+]
+
+# Fresh processes per configuration, the median of the runs is reported
+RUNS = 3
+
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import numpy as np
+import classify_images
+import_seconds = time.perf_counter() - start
+tensorflow_imported = 'tensorflow' in sys.modules
+
+start = time.perf_counter()
+model = classify_images.get_model(sys.argv[1], None if sys.argv[2] == 'None' else sys.argv[2])
+load_seconds = time.perf_counter() - start
+
+batch = np.zeros((1, 224, 224, 3), dtype=np.float32)
+start = time.perf_counter()
+model.predict(batch)
+first_predict_seconds = time.perf_counter() - start
+
+start = time.perf_counter()
+model.predict(batch)
+second_predict_seconds = time.perf_counter() - start
+
+print(json.dumps({'import': import_seconds, 'tensorflow_imported': tensorflow_imported, 'load': load_seconds,
+                  'first_predict': first_predict_seconds, 'second_predict': second_predict_seconds}))
+"""
+
+def measure(backend, quantization):
+    """
+    Returns:
+        Dictionary of timings in seconds, measured in a new process
+    """
+    output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, backend, str(quantization)],
+                            cwd=script_dir, capture_output=True, text=True, check=True).stdout
+
+    # Model loading prints progress, the timings are on the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+if __name__ == '__main__':
+    print(f"{'Backend':<20} {'Import (s)':>11} {'TF at import':>13} {'Load (s)':>9} {'1st pred (s)':>13} {'2nd pred (s)':>13} {'Total (s)':>10}")
+
+    for backend, quantization in BACKEND_CONFIGS:
+        name = f"{backend}-{quantization or 'float32'}"
+
+        try:
+            # First run converts the model if needed, so it is not counted
+            measure(backend, quantization)
+            runs = [measure(backend, quantization) for _ in range(RUNS)]
+        except subprocess.CalledProcessError as e:
+            print(f'Skipping {name}\n{e.stderr}')
+            continue
+
+        timings = {key: median([run[key] for run in runs]) for key in ('import', 'load', 'first_predict', 'second_predict')}
+        total = timings['import'] + timings['load'] + timings['first_predict']
+
+        print(f"{name:<20} {timings['import']:>11.3f} {str(runs[0]['tensorflow_imported']):>13} {timings['load']:>9.3f} "
+              f"{timings['first_predict']:>13.3f} {timings['second_predict']:>13.4f} {total:>10.3f}")
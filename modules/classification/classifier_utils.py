@@ -0,0 +1,60 @@
+import os
+from PIL import Image
+import numpy as np
+
+# ResNet input size
+IMAGE_SIZE = (224, 224)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+CLASS_LABELS = ["dry-asphalt-bad",
+    "dry-asphalt-good",
+    "dry-asphalt-intermediate",
+    "dry-paved-bad",
+    "dry-paved-good",
+    "dry-paved-intermediate",
+    "unpaved",
+    "water-asphalt",
+    "water-paved",
+    "water-unpaved",
+    "wet-asphalt-bad",
+    "wet-asphalt-good",
+    "wet-asphalt-intermediate",
+    "wet-paved-bad",
+    "wet-paved-good",
+    "wet-paved-intermediate"]
+
+def load_image_array(image_path):
+    """
+    Load an image and convert it to the classifier's input array.
+
+    Args:
+        image_path: Path to the image file
+
+    Returns:
+        float32 numpy array of shape (224, 224, channels)
+    """
+    img = Image.open(image_path)
+    img = img.resize(IMAGE_SIZE)
+
+    # Same conversion as keras.preprocessing.image.img_to_array
+    img_array = np.asarray(img, dtype=np.float32)
+    if img_array.ndim == 2:
+        img_array = img_array[:, :, np.newaxis]
+
+    return img_array
+
+def softmax(logits, axis=-1):
+    # Numerically stable softmax, matches tf.nn.softmax without importing Tensorflow
+    logits = np.asarray(logits, dtype=np.float32)
+    exp = np.exp(logits - logits.max(axis=axis, keepdims=True))
+    return exp / exp.sum(axis=axis, keepdims=True)
+
+def list_images(images_dir):
+    # Keep os.listdir ordering so reports line up with previous runs
+    return [f for f in os.listdir(images_dir) if f.endswith(IMAGE_EXTENSIONS)]
+
+def get_ground_truth(filename):
+    # Extract ground truth label from filename
+    # Remove the timestamp and .jpg extension
+    return filename.split('-', 1)[1].rsplit('.', 1)[0]
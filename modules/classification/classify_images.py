@@ -1,72 +1,193 @@
-import tensorflow as tf
-from tensorflow import keras
-from PIL import Image
 import numpy as np
 import os
+import sys
 import json
 from model_loader import ModelLoader
+from classifier_utils import CLASS_LABELS, load_image_array, list_images, softmax
 import datetime
 
 # Get the directory of the script
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Initialize model loader and load model
-model_loader = ModelLoader()
-loaded_model = model_loader.load_model()
+sys.path.append(os.path.join(script_dir, '..', '..', 'common'))
+from staged_pipeline import Stage, StagedPipeline
+import metrics
+
+# Number of images fed to the model per predict step
+DEFAULT_BATCH_SIZE = 32
+
+# Batches decoded ahead of the model by the staged pipeline
+DEFAULT_PREFETCH = 2
+
+# Model loader and model, created on first use so importing this module stays cheap
+model_loader = None
+loaded_model = None
+
+def get_model(backend='auto', quantization='float16'):
+    """
+    Load the classifier on first use and return it. Later calls return the same model.
+
+    Args:
+        backend: Backend passed to ModelLoader on the first call
+        quantization: Quantization mode passed to ModelLoader on the first call
+    """
+    global model_loader, loaded_model
+
+    if loaded_model is None:
+        with metrics.timer('classify.load_model'):
+            model_loader = ModelLoader(backend=backend, quantization=quantization)
+            loaded_model = model_loader.load_model()
+
+    return loaded_model
+
+def resolve_backend(backend='auto', quantization='float16'):
+    """
+    Find the backend and quantization the classifier would run with, without loading it.
+
+    Returns:
+        Tuple of (backend, quantization), quantization is None for backends which do not use it
+    """
+    backend = ModelLoader(backend=backend, quantization=quantization).resolve_backend()
+    return backend, quantization if backend == 'tflite' else None
 
 def classify_image(image_path):
     # Generate single prediction based on image
-    img = Image.open(image_path)
-    img = img.resize((224, 224)) # ResNet input size
-    img_array = keras.preprocessing.image.img_to_array(img)
+    with metrics.timer('classify.decode'):
+        img_array = load_image_array(image_path)
     img_array = np.expand_dims(img_array, 0)  # Create a batch
 
-    predictions = loaded_model.predict(img_array)
-    score = tf.nn.softmax(predictions[0])
+    model = get_model()
+    with metrics.timer('classify.predict'):
+        predictions = model.predict(img_array)
+    score = softmax(predictions[0])
 
     return predictions, score
 
-if __name__ == '__main__':
-    class_labels = ["dry-asphalt-bad",
-        "dry-asphalt-good",
-        "dry-asphalt-intermediate",
-        "dry-paved-bad",
-        "dry-paved-good",
-        "dry-paved-intermediate",
-        "unpaved",
-        "water-asphalt",
-        "water-paved",
-        "water-unpaved",
-        "wet-asphalt-bad",
-        "wet-asphalt-good",
-        "wet-asphalt-intermediate",
-        "wet-paved-bad",
-        "wet-paved-good",
-        "wet-paved-intermediate"]
+def classify_arrays(image_arrays, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Classify images which are already decoded and resized in memory.
 
-    # Some images pulled from the training dataset
-    test_images_dir = os.path.join(script_dir, 'test_images')
-    
-    total_images = 0
+    Args:
+        image_arrays: RGB arrays of shape (N, 224, 224, 3)
+        batch_size: Number of images per batch
+
+    Returns:
+        Tuple of (predictions, scores) arrays of shape (N, num_classes)
+    """
+    if len(image_arrays) == 0:
+        empty = np.zeros((0, len(CLASS_LABELS)), dtype=np.float32)
+        return empty, empty
+
+    image_arrays = np.asarray(image_arrays, dtype=np.float32)
+
+    model = get_model()
+    with metrics.timer('classify.predict', items=len(image_arrays)):
+        predictions = model.predict(image_arrays, batch_size=batch_size)
+    scores = softmax(predictions, axis=-1)
+
+    return predictions, scores
+
+def classify_stream(image_paths, batch_size=DEFAULT_BATCH_SIZE, num_workers=None, prefetch=DEFAULT_PREFETCH):
+    """
+    Classify images with decoding overlapped with the model. Whole batches are decoded by
+    num_workers threads while the model runs, with at most prefetch batches waiting for it,
+    so memory stays bounded for any number of images. Decoding runs in Python threads, so
+    the TFLite backend does not need Tensorflow.
+
+    Args:
+        image_paths: List of image file paths
+        batch_size: Number of images per batch
+        num_workers: Decode threads, defaults to the number of CPUs
+        prefetch: Batches decoded ahead of the model
+
+    Yields:
+        Tuple of (predictions, scores) arrays of every batch, in input order
+    """
+    def decode(batch_paths):
+        with metrics.timer('classify.decode', items=len(batch_paths)):
+            return np.stack([load_image_array(path) for path in batch_paths])
+
+    pipeline = StagedPipeline([
+        Stage('decode', decode, workers=num_workers or os.cpu_count(), prefetch=prefetch),
+        Stage('classify', lambda batch: classify_arrays(batch, batch_size), prefetch=prefetch),
+    ])
 
+    batches = (image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size))
+    yield from pipeline.run(batches)
+
+def format_classifications(image_names, predictions, scores):
+    """
+    Convert model outputs into the records written to image_classifications_<ts>.json.
+
+    Args:
+        image_names: Image file names, in the same order as predictions
+        predictions: Model output array of shape (N, num_classes)
+        scores: Softmax scores of shape (N, num_classes)
+
+    Returns:
+        List of classification dictionaries
+    """
+    json_output_array = []
+
+    for image_file, prediction, score in zip(image_names, predictions, scores):
+        predicted_class_index = np.argmax(prediction)
+
+        json_output_array.append({
+            "image": image_file,
+            "predicted_class": CLASS_LABELS[predicted_class_index],
+            "confidence_score": round(score[predicted_class_index].item(), 4)
+        })
+
+    return json_output_array
+
+def classify_paths(image_paths, image_names, batch_size=DEFAULT_BATCH_SIZE, num_workers=None, prefetch=DEFAULT_PREFETCH):
+    """
+    Classify images with classify_stream and format the results.
+
+    Args:
+        image_paths: List of image file paths
+        image_names: Names written to the records, in the same order as image_paths
+
+    Returns:
+        List of classification dictionaries
+    """
     json_output_array = []
 
-    for image_file in os.listdir(test_images_dir):
-        if image_file.endswith(('.jpg', '.jpeg', '.png')):
-            image_path = os.path.join(test_images_dir, image_file)
-            
-            predictions, scores = classify_image(image_path)
-            predicted_class_index = np.argmax(predictions)
-            predicted_class_label = class_labels[predicted_class_index]
-            confidence_score = scores[predicted_class_index]
+    for start, (predictions, scores) in zip(range(0, len(image_paths), batch_size),
+                                           classify_stream(image_paths, batch_size, num_workers, prefetch)):
+        json_output_array.extend(format_classifications(image_names[start:start + batch_size], predictions, scores))
 
-            total_images += 1
+    return json_output_array
 
-            json_output_array.append({
-                "image": image_file,
-                "predicted_class": predicted_class_label,
-                "confidence_score": round(confidence_score.numpy().item(), 4)
-            })
+def classify_directory(images_dir, batch_size=DEFAULT_BATCH_SIZE, num_workers=None, prefetch=DEFAULT_PREFETCH, selection=None):
+    """
+    Classify every image in a directory in batches.
+
+    Args:
+        images_dir: Directory containing images
+        batch_size: Number of images per batch
+        num_workers: Decode threads, defaults to the number of CPUs
+        prefetch: Batches decoded ahead of the model
+        selection: Optional image names, e.g. from spatial_index.py, other images are skipped
+
+    Returns:
+        List of classification dictionaries in os.listdir order
+    """
+    image_files = list_images(images_dir)
+
+    if selection is not None:
+        selection = set(selection)
+        image_files = [f for f in image_files if f in selection]
+    image_paths = [os.path.join(images_dir, image_file) for image_file in image_files]
+
+    return classify_paths(image_paths, image_files, batch_size, num_workers, prefetch)
+
+if __name__ == '__main__':
+    # Some images pulled from the training dataset
+    test_images_dir = os.path.join(script_dir, 'test_images')
+
+    json_output_array = classify_directory(test_images_dir, batch_size=DEFAULT_BATCH_SIZE)
+    total_images = len(json_output_array)
 
     # Create output directory if it doesn't exist
     output_dir = os.path.join(script_dir, 'output')
@@ -78,5 +199,5 @@ if __name__ == '__main__':
 
     with open(output_file_path, 'w') as output_file:
         json.dump(json_output_array, output_file, indent=2)
-    
+
     print(f"Classified {total_images} images and saved predictions to: {output_file_path}")
@@ -0,0 +1,94 @@
+# Accuracy-parity check between the Keras model and the CPU (TFLite) engine.
+# Like test_classify_image.py, this script assumes "test_images" come from the original dataset
+# so ground truth labels can be read from the file names.
+
+import os
+import time
+import datetime
+import numpy as np
+from model_loader import ModelLoader
+from classifier_utils import CLASS_LABELS, load_image_array, list_images, get_ground_truth
+
+# Get the directory of the script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# (backend, quantization) pairs to compare, the first entry is the reference
+BACKEND_CONFIGS = [
+    ('keras', None),
+    ('tflite', None),
+    ('tflite', 'float16'),
+    ('tflite', 'int8'),
+]
+
+BATCH_SIZE = 32
+
+def run_backend(backend, quantization, image_arrays):
+    """
+    Load a backend and time predictions over all images.
+
+    Args:
+        backend: Backend name passed to ModelLoader
+        quantization: Quantization mode passed to ModelLoader
+        image_arrays: float32 array of shape (N, 224, 224, 3)
+
+    Returns:
+        Tuple of (predictions, load_seconds, predict_seconds)
+    """
+    start = time.perf_counter()
+    model = ModelLoader(backend=backend, quantization=quantization).load_model()
+    load_seconds = time.perf_counter() - start
+
+    # Warm up so one-time graph/allocation costs are not counted as inference time
+    model.predict(image_arrays[:1])
+
+    start = time.perf_counter()
+    predictions = model.predict(image_arrays, batch_size=BATCH_SIZE)
+    predict_seconds = time.perf_counter() - start
+
+    return predictions, load_seconds, predict_seconds
+
+if __name__ == '__main__':
+    test_images_dir = os.path.join(script_dir, 'test_images')
+    image_files = list_images(test_images_dir)
+
+    if not image_files:
+        raise Exception(f"No images found in {test_images_dir}")
+
+    ground_truth = [get_ground_truth(image_file) for image_file in image_files]
+    image_arrays = np.stack([load_image_array(os.path.join(test_images_dir, f)) for f in image_files])
+
+    reference_labels = None
+
+    # Create output directory if it doesn't exist
+    output_dir = os.path.join(script_dir, 'output')
+    os.makedirs(output_dir, exist_ok=True)
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_filename = os.path.join(output_dir, f"backend_comparison_{timestamp}.txt")
+
+    with open(report_filename, 'w') as report_file:
+        report_file.write(f"Backend comparison over {len(image_files)} images\n")
+        report_file.write("-" * 80 + "\n")
+        report_file.write(f"{'Backend':<20} {'Load (s)':>10} {'ms/image':>10} {'Accuracy':>10} {'Agreement':>10}\n")
+        report_file.write("-" * 80 + "\n")
+
+        for backend, quantization in BACKEND_CONFIGS:
+            name = f"{backend}-{quantization or 'float32'}"
+
+            predictions, load_seconds, predict_seconds = run_backend(backend, quantization, image_arrays)
+            predicted_labels = [CLASS_LABELS[i] for i in np.argmax(predictions, axis=-1)]
+
+            correct_predictions = sum(p == g for p, g in zip(predicted_labels, ground_truth))
+            accuracy = correct_predictions / len(image_files)
+
+            # Top-1 agreement with the Keras reference model
+            if reference_labels is None:
+                reference_labels = predicted_labels
+            agreement = sum(p == r for p, r in zip(predicted_labels, reference_labels)) / len(image_files)
+
+            ms_per_image = predict_seconds * 1000 / len(image_files)
+
+            report_file.write(f"{name:<20} {load_seconds:>10.2f} {ms_per_image:>10.2f} {accuracy:>10.2%} {agreement:>10.2%}\n")
+            print(f"{name}: {ms_per_image:.2f} ms/image, accuracy {accuracy:.2%}, agreement {agreement:.2%}")
+
+    print(f"Backend comparison report has been saved to: {report_filename}")
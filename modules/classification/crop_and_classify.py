@@ -0,0 +1,122 @@
+# Fused crop -> classify stage which feeds road crops straight into the classifier.
+# Crops stay in memory, so camera frames no longer go through a JPEG round-trip in
+# preprocessing/crop_images/output and a manual copy into test_images.
+
+import os
+import sys
+import json
+import datetime
+import cv2
+import numpy as np
+from classify_images import DEFAULT_BATCH_SIZE, DEFAULT_PREFETCH, classify_arrays, format_classifications
+
+# Get the directory of the script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Reuse the crop geometry from the preprocessing step
+sys.path.append(os.path.join(script_dir, '..', '..', 'preprocessing', 'crop_images'))
+from crop_images import read_crop
+
+sys.path.append(os.path.join(script_dir, '..', '..', 'common'))
+from staged_pipeline import Stage, StagedPipeline
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp']
+
+def crop_frame(image_path, crop_size=(224, 224), save_crops_dir=None, decode='roi', frame_cache=None):
+    """
+    Decode a camera frame and return the RGB road crop.
+
+    Args:
+        image_path: Path to the camera frame
+        crop_size: Size of the crop (width, height)
+        save_crops_dir: Optional directory to also write the crop as an image file
+        decode: Decode strategy passed to crop_images.read_crop
+        frame_cache: Optional FrameCache keeping the decoded frame for the segmentation stages
+
+    Returns:
+        RGB crop as uint8 numpy array, or None if the frame could not be read
+    """
+    cropped_image = read_crop(image_path, crop_size, decode, frame_cache)
+
+    if cropped_image is None:
+        print(f"Failed to read image: {image_path}")
+        return None
+
+    if save_crops_dir is not None:
+        cv2.imwrite(os.path.join(save_crops_dir, os.path.basename(image_path)), cropped_image)
+
+    # OpenCV decodes to BGR, the classifier was trained on RGB
+    return cv2.cvtColor(cropped_image, cv2.COLOR_BGR2RGB)
+
+def crop_and_classify(input_dir, batch_size=DEFAULT_BATCH_SIZE, crop_size=(224, 224), save_crops_dir=None, num_workers=None,
+                      frame_cache=None, prefetch=DEFAULT_PREFETCH, selection=None):
+    """
+    Crop and classify every camera frame in a directory without writing intermediate files.
+
+    Frames are decoded and cropped by a pool of threads while the model runs, with at most
+    prefetch batches waiting for it.
+
+    Args:
+        input_dir: Directory containing camera frames
+        batch_size: Number of crops per model batch
+        crop_size: Size of the crop (width, height)
+        save_crops_dir: Optional directory to also write the crops to
+        num_workers: Number of decode threads, defaults to the number of CPUs
+        frame_cache: Optional FrameCache, see crop_frame
+        prefetch: Batches cropped ahead of the model
+        selection: Optional image names, e.g. from spatial_index.py, other images are skipped
+
+    Returns:
+        List of classification dictionaries, keyed by the camera frame file name
+    """
+    image_files = [f for f in os.listdir(input_dir) if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS]
+
+    if selection is not None:
+        selection = set(selection)
+        image_files = [f for f in image_files if f in selection]
+
+    if save_crops_dir is not None:
+        os.makedirs(save_crops_dir, exist_ok=True)
+
+    def crop_batch(batch):
+        crops = [crop_frame(os.path.join(input_dir, f), crop_size, save_crops_dir, frame_cache=frame_cache) for f in batch]
+        return [f for f, crop in zip(batch, crops) if crop is not None], [crop for crop in crops if crop is not None]
+
+    def classify(batch):
+        image_names, crops = batch
+        predictions, scores = classify_arrays(np.stack(crops) if crops else [], batch_size)
+        return format_classifications(image_names, predictions, scores)
+
+    pipeline = StagedPipeline([
+        Stage('crop', crop_batch, workers=num_workers or os.cpu_count(), prefetch=prefetch),
+        Stage('classify', classify, prefetch=prefetch),
+    ])
+
+    batches = (image_files[i:i + batch_size] for i in range(0, len(image_files), batch_size))
+
+    results = []
+    for classifications in pipeline.run(batches):
+        results.extend(classifications)
+
+    return results
+
+if __name__ == '__main__':
+    input_dir = os.path.join(script_dir, '..', '..', 'preprocessing', 'create_synced_df', 'sample_raw_data', 'Camera')
+
+    # Set to a directory path to keep the crops, e.g. for manual inspection
+    save_crops_dir = None
+
+    json_output_array = crop_and_classify(input_dir, save_crops_dir=save_crops_dir)
+
+    # Create output directory if it doesn't exist
+    output_dir = os.path.join(script_dir, 'output')
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Create a timestamp for the prediction file
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file_path = os.path.join(output_dir, f"image_classifications_{timestamp}.json")
+
+    with open(output_file_path, 'w') as output_file:
+        json.dump(json_output_array, output_file, indent=2)
+
+    print(f"Classified {len(json_output_array)} images and saved predictions to: {output_file_path}")
@@ -1,32 +1,228 @@
 import os
-import tensorflow as tf
-from tensorflow import keras
+import numpy as np
+from classifier_utils import load_image_array, list_images
+
+# Tensorflow is only imported once a model is loaded or converted, importing this module is cheap
+
+# 'auto' uses the SavedModel when a GPU is available and the TFLite CPU engine otherwise
+BACKENDS = ('auto', 'keras', 'savedmodel', 'tflite')
+QUANTIZATION_MODES = (None, 'float16', 'int8')
+
+def get_tflite_interpreter():
+    # The standalone tflite_runtime interpreter starts much faster than a full Tensorflow import
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+def iter_batches(x, batch_size):
+    # Accept numpy arrays or a batched tf.data.Dataset, like keras.Model.predict
+    if hasattr(x, 'as_numpy_iterator'):
+        return x.as_numpy_iterator()
+    return (x[i:i + batch_size] for i in range(0, len(x), batch_size))
+
+# Number of representative images used to calibrate int8 quantization
+NUM_CALIBRATION_IMAGES = 100
+
+class TFLiteModel:
+    """
+    Runs a converted TFLite classifier on the CPU behind the same predict()
+    interface as the Keras model, so callers do not need to know which backend is loaded.
+    """
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        self.interpreter = get_tflite_interpreter()(model_path=model_path, num_threads=num_threads or os.cpu_count())
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    def _resize_input(self, batch_size):
+        # Interpreter tensors are fixed size, only reallocate when the batch size changes
+        if batch_size == self.batch_size:
+            return
+
+        input_shape = self.interpreter.get_input_details()[0]['shape']
+        self.interpreter.resize_tensor_input(self.input_index, [batch_size, *input_shape[1:]])
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
+    def predict_on_batch(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        self._resize_input(batch.shape[0])
+
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+    def predict(self, x, batch_size=32, verbose=None):
+        outputs = [self.predict_on_batch(batch) for batch in iter_batches(x, batch_size)]
+        if not outputs:
+            return np.zeros((0, self.interpreter.get_output_details()[0]['shape'][-1]), dtype=np.float32)
+
+        return np.concatenate(outputs, axis=0)
+
+class SavedModel:
+    """
+    Runs the classifier exported as a TF SavedModel through its serving signature. Loading the
+    serialized graph skips rebuilding the Keras layers from HDF5, which dominates Keras load time.
+    """
+    def __init__(self, model_path):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        # Keep the loaded object alive, the signature only references its variables
+        self.loaded = tf.saved_model.load(model_path)
+        self.serving_fn = self.loaded.signatures['serving_default']
+
+        # Signature functions only take keyword arguments
+        self.input_key = list(self.serving_fn.structured_input_signature[1])[0]
+        self.output_key = list(self.serving_fn.structured_outputs)[0]
+
+    def predict_on_batch(self, batch):
+        import tensorflow as tf
+
+        outputs = self.serving_fn(**{self.input_key: tf.constant(np.asarray(batch, dtype=np.float32))})
+        return outputs[self.output_key].numpy()
+
+    def predict(self, x, batch_size=32, verbose=None):
+        outputs = [self.predict_on_batch(batch) for batch in iter_batches(x, batch_size)]
+        if not outputs:
+            return np.zeros((0, self.serving_fn.structured_outputs[self.output_key].shape[-1]), dtype=np.float32)
+
+        return np.concatenate(outputs, axis=0)
 
 class ModelLoader:
-    def __init__(self):
+    def __init__(self, backend='auto', quantization='float16', representative_dir=None):
         # Get the directory of the script
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.model = None
-        
+
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATION_MODES}")
+
+        self.backend = backend
+        self.quantization = quantization
+
+        # Images used to calibrate int8 quantization
+        self.representative_dir = representative_dir or os.path.join(self.script_dir, 'test_images')
+
     def check_gpu(self):
+        import tensorflow as tf
+
         if len(tf.config.list_physical_devices('GPU')) > 0:
             print("GPU is Available!")
             return True
         return False
-        
+
+    def resolve_backend(self):
+        # Backend load_model uses, 'auto' picks the SavedModel on a GPU and TFLite otherwise
+        if self.backend == 'auto':
+            return 'savedmodel' if self.check_gpu() else 'tflite'
+        return self.backend
+
+    def get_tflite_path(self, model_name):
+        model_stem = os.path.splitext(model_name)[0]
+        return os.path.join(self.script_dir, 'model', f"{model_stem}_{self.quantization or 'float32'}.tflite")
+
+    def convert_to_tflite(self, model_name='road_surface_classifier_152V2_92.h5'):
+        """
+        Convert the Keras model into a TFLite artifact using post-training quantization.
+
+        The conversion only has to run once, the artifact is stored next to the .h5 file.
+
+        Args:
+            model_name: File name of the Keras model in the model directory
+
+        Returns:
+            Path to the .tflite file
+        """
+        import tensorflow as tf
+        from tensorflow import keras
+
+        model_path = os.path.join(self.script_dir, 'model', model_name)
+        tflite_path = self.get_tflite_path(model_name)
+
+        keras_model = keras.models.load_model(model_path)
+        converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+
+        if self.quantization is not None:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        if self.quantization == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        elif self.quantization == 'int8':
+            if not os.path.isdir(self.representative_dir):
+                raise Exception(f"int8 quantization requires representative images in {self.representative_dir}")
+
+            calibration_files = list_images(self.representative_dir)[:NUM_CALIBRATION_IMAGES]
+
+            def representative_dataset():
+                for image_file in calibration_files:
+                    img_array = load_image_array(os.path.join(self.representative_dir, image_file))
+                    yield [np.expand_dims(img_array, 0)]
+
+            converter.representative_dataset = representative_dataset
+
+        tflite_model = converter.convert()
+
+        with open(tflite_path, 'wb') as tflite_file:
+            tflite_file.write(tflite_model)
+
+        print(f'Model converted to {tflite_path}')
+        return tflite_path
+
+    def get_savedmodel_path(self, model_name):
+        return os.path.join(self.script_dir, 'model', f"{os.path.splitext(model_name)[0]}_savedmodel")
+
+    def convert_to_savedmodel(self, model_name='road_surface_classifier_152V2_92.h5'):
+        """
+        Export the Keras model as a SavedModel directory next to the .h5 file. Only has to run once.
+
+        Returns:
+            Path to the SavedModel directory
+        """
+        from tensorflow import keras
+
+        savedmodel_path = self.get_savedmodel_path(model_name)
+
+        keras_model = keras.models.load_model(os.path.join(self.script_dir, 'model', model_name))
+        keras_model.save(savedmodel_path, save_format='tf', include_optimizer=False)
+
+        print(f'Model exported to {savedmodel_path}')
+        return savedmodel_path
+
     # Model currently not shared but can be accessed personally at https://ucf-my.sharepoint.com/:u:/r/personal/ky455244_ucf_edu/Documents/auto-seg-system-files/road_surface_classifier_152V2_92.h5?csf=1&web=1&e=LmufH3
     def load_model(self, model_name='road_surface_classifier_152V2_92.h5'):
         # Get the absolute path of the model
         model_path = os.path.join(self.script_dir, 'model', model_name)
-        
+
         try:
-            if not self.check_gpu():
-                raise Exception("No GPU available")
-                
-            self.model = keras.models.load_model(model_path)
-            print('Model loaded successfully!')
+            backend = self.resolve_backend()
+
+            if backend == 'keras':
+                from tensorflow import keras
+                self.model = keras.models.load_model(model_path)
+            elif backend == 'savedmodel':
+                savedmodel_path = self.get_savedmodel_path(model_name)
+                if not os.path.exists(savedmodel_path):
+                    savedmodel_path = self.convert_to_savedmodel(model_name)
+
+                self.model = SavedModel(savedmodel_path)
+            else:
+                tflite_path = self.get_tflite_path(model_name)
+                if not os.path.exists(tflite_path):
+                    tflite_path = self.convert_to_tflite(model_name)
+
+                self.model = TFLiteModel(tflite_path)
+
+            print(f'Model loaded successfully! (backend: {backend})')
             return self.model
-            
+
         except Exception as e:
             print(f'Model failed to load\n{e}')
-            raise
\ No newline at end of file
+            raise
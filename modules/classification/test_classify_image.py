@@ -1,36 +1,15 @@
 # This script assumes "test_images" are coming from the original dataset in order to compare the model's predictions with the ground truth labels.
 
-import tensorflow as tf
-from tensorflow import keras
-from PIL import Image
 import numpy as np
 import os
-from model_loader import ModelLoader
+from classify_images import classify_image
+from classifier_utils import get_ground_truth
 import datetime
 
 # Get the directory of the script
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Initialize model loader and load model
-model_loader = ModelLoader()
-loaded_model = model_loader.load_model()
-
-def classify_image(image_path):
-    # Generate single prediction based on image
-    img = Image.open(image_path)
-    img = img.resize((224, 224)) # ResNet input size
-    img_array = keras.preprocessing.image.img_to_array(img)
-    img_array = np.expand_dims(img_array, 0)  # Create a batch
-
-    predictions = loaded_model.predict(img_array)
-    score = tf.nn.softmax(predictions[0])
-
-    return predictions, score
-
-def get_ground_truth(filename):
-    # Extract ground truth label from filename
-    # Remove the timestamp and .jpg extension
-    return filename.split('-', 1)[1].rsplit('.', 1)[0]
+# The model is loaded by classify_images on the first prediction
 
 if __name__ == '__main__':
     class_labels = ["dry-asphalt-bad",
@@ -0,0 +1,58 @@
+# Benchmark of the vectorized geodetic -> ENU conversion against a per-row reference implementation
+
+import math
+import time
+import numpy as np
+from geodetic import WGS84_A, WGS84_E2, geodetic_to_enu
+
+# Number of poses converted in each run
+POSE_COUNTS = [1_000, 10_000, 100_000, 1_000_000]
+
+def geodetic_to_enu_reference(lat, lon, alt, lat_ref, lon_ref, alt_ref):
+    # Straightforward scalar implementation, one pose at a time
+    def to_ecef(lat, lon, alt):
+        lat, lon = math.radians(lat), math.radians(lon)
+        N = WGS84_A / math.sqrt(1 - WGS84_E2 * math.sin(lat) ** 2)
+        return ((N + alt) * math.cos(lat) * math.cos(lon),
+                (N + alt) * math.cos(lat) * math.sin(lon),
+                (N * (1 - WGS84_E2) + alt) * math.sin(lat))
+
+    x_ref, y_ref, z_ref = to_ecef(lat_ref, lon_ref, alt_ref)
+    x, y, z = to_ecef(lat, lon, alt)
+    dx, dy, dz = x - x_ref, y - y_ref, z - z_ref
+
+    phi, lam = math.radians(lat_ref), math.radians(lon_ref)
+    east = -math.sin(lam) * dx + math.cos(lam) * dy
+    north = -math.sin(phi) * math.cos(lam) * dx - math.sin(phi) * math.sin(lam) * dy + math.cos(phi) * dz
+    up = math.cos(phi) * math.cos(lam) * dx + math.cos(phi) * math.sin(lam) * dy + math.sin(phi) * dz
+
+    return east, north, up
+
+def generate_track(pose_count, seed=0):
+    # Poses scattered within ~10 km of a reference point in Orlando, FL
+    rng = np.random.default_rng(seed)
+    lat = 28.6024 + rng.uniform(-0.1, 0.1, pose_count)
+    lon = -81.2001 + rng.uniform(-0.1, 0.1, pose_count)
+    alt = 30 + rng.uniform(-5, 5, pose_count)
+    return lat, lon, alt
+
+if __name__ == '__main__':
+    print(f"{'Poses':>10} {'Per-row (s)':>12} {'Vectorized (s)':>15} {'Speedup':>8} {'Max diff (m)':>13}")
+
+    for pose_count in POSE_COUNTS:
+        lat, lon, alt = generate_track(pose_count)
+        reference = (lat[0], lon[0], alt[0])
+
+        start = time.perf_counter()
+        expected = np.array([geodetic_to_enu_reference(la, lo, al, *reference)
+                             for la, lo, al in zip(lat.tolist(), lon.tolist(), alt.tolist())])
+        per_row_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = np.column_stack(geodetic_to_enu(lat, lon, alt, *reference))
+        vectorized_seconds = time.perf_counter() - start
+
+        max_diff = np.abs(actual - expected).max()
+
+        print(f"{pose_count:>10} {per_row_seconds:>12.3f} {vectorized_seconds:>15.4f} "
+              f"{per_row_seconds / vectorized_seconds:>7.0f}x {max_diff:>13.2e}")
@@ -1,88 +1,204 @@
-import pandas as pd
 import numpy as np
 import os
+import sys
+import shutil
+import tempfile
 import hashlib
 import json
-
-# Load synchronized dataframe file created from preprocessing
-synced_df = pd.read_csv(os.path.join(os.path.dirname(__file__), 'synchronized_df.csv'))
-
-# Define the reference point (first entry in the dataset)
-lat_ref = synced_df.iloc[0]['latitude']
-lon_ref = synced_df.iloc[0]['longitude']
-alt_ref = synced_df.iloc[0]['altitude']
-
-# Calculate inter-pose duration (assuming regular interval based on GPS time difference)
-# NOTE: total_samples = ((last_timestamp - initial_timestamp)/consecutive_timestamp_diff) + 1
-timestamps = synced_df['gps_time'].values
-inter_pose_duration = int(np.median(np.diff(timestamps)))  # Use median to find the regular interval
-
-# Extract the start and stop instants
-start_instant = int(str(timestamps[0])[:10])
-stop_instant = int(str(timestamps[-1])[:10])
-
-# Count the number of poses
-pose_count = len(timestamps)
-
-# Generate a SHA256 integrity check based on the pose data
-pose_data_str = "".join([f"{row['latitude']}{row['longitude']}{row['altitude']}"
-                          f"{row['qx']}{row['qy']}{row['qz']}{row['qw']}" for index, row in synced_df.iterrows()])
-
-integrity_check = hashlib.sha256(pose_data_str.encode()).hexdigest()
-
-# Define the outer frame using the reference LTP (Latitude, Longitude, Altitude)
-outer_frame = {
-    "authority": "/geopose/1.0",
-    "id": "LTP-ENU",
-    "parameters": f"longitude={lon_ref}&latitude={lat_ref}&height={alt_ref}"
-}
-
-# Define the inner frame series (translation and rotation for each pose)
-inner_frame_series = []
-for i, row in synced_df.iterrows():
-    # E, N, U = enu_coordinates[i]
-    E, N, U = row['latitude'], row['longitude'], row['altitude']
-    inner_frame_series.append({
-        "authority": "/geopose/1.0",
-        "id": "RotateTranslate",
-        "parameters": f"translation=[{E}, {N}, {U}]&rotation=[{row['qx']}, {row['qy']}, {row['qz']}, {row['qw']}]"
-      })
-
-# Create the Series Header
-series_header = {
-    "poseCount": pose_count,
-    "integrityCheck": f"{{\"SHA256\": \"{integrity_check}\"}}",
-    "startInstant": start_instant,
-    "stopInstant": stop_instant,
-    "transitionModel": {
+from itertools import chain
+
+# Readers for the synchronized dataframe live next to the script which writes it
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'preprocessing', 'create_synced_df'))
+from synced_df_io import find_synced_df, read_synced_df
+from geodetic import geodetic_to_enu
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+import metrics
+
+# Columns of the synchronized dataframe used to build the GeoPose series
+GEOPOSE_COLUMNS = ['gps_time', 'latitude', 'longitude', 'altitude', 'qx', 'qy', 'qz', 'qw']
+
+# Number of poses formatted, hashed and written at a time
+CHUNK_SIZE = 100_000
+
+# Stands in for innerFrameSeries when the rest of the document is serialized
+INNER_FRAME_SERIES_PLACEHOLDER = '__INNER_FRAME_SERIES__'
+
+# One innerFrameSeries entry as json.dump(..., indent=4) lays it out
+INNER_FRAME_TEMPLATE = ('        {\n'
+                        '            "authority": "/geopose/1.0",\n'
+                        '            "id": "RotateTranslate",\n'
+                        '            "parameters": "translation=[%s, %s, %s]&rotation=[%s, %s, %s, %s]"\n'
+                        '        }')
+
+def format_values(values):
+    """
+    Format an array of values exactly as an f-string formats each element.
+
+    Args:
+        values: 1D numpy array
+
+    Returns:
+        List of strings
+    """
+    # f-strings format numpy floats of any width through a Python float, whose repr
+    # is the shortest round-trip string (and much cheaper than ndarray.astype(str))
+    if values.dtype.kind == 'f':
+        return list(map(repr, values.astype(np.float64).tolist()))
+    if values.dtype.kind in 'iu':
+        return list(map(str, values.tolist()))
+    return [f"{value}" for value in values]
+
+def format_chunk(chunk):
+    """
+    Format the pose columns of a chunk of the synchronized dataframe.
+
+    Rows are converted to the frame's common dtype first, the same way iterrows() does.
+
+    Args:
+        chunk: Slice of the synchronized dataframe
+
+    Returns:
+        Dictionary mapping column name to a list of formatted strings
+    """
+    values = chunk.to_numpy()
+    columns = list(chunk.columns)
+
+    return {column: format_values(values[:, columns.index(column)]) for column in GEOPOSE_COLUMNS[1:]}
+
+def iter_chunks(synced_df, chunk_size=CHUNK_SIZE):
+    for start in range(0, len(synced_df), chunk_size):
+        yield synced_df.iloc[start:start + chunk_size]
+
+def write_inner_frames(synced_df, series_file, reference, chunk_size=CHUNK_SIZE):
+    """
+    Write the serialized innerFrameSeries entries (translation and rotation for each pose)
+    chunk by chunk and generate a SHA256 integrity check based on the pose data.
+
+    Args:
+        synced_df: Synchronized dataframe created from preprocessing
+        series_file: Text file object the entries are written to
+        reference: (lat_ref, lon_ref, alt_ref) origin of the LTP-ENU outer frame
+        chunk_size: Number of poses processed at a time
+
+    Returns:
+        Hex digest of the concatenated latitude, longitude, altitude and quaternion of every pose
+    """
+    sha256 = hashlib.sha256()
+
+    for i, chunk in enumerate(iter_chunks(synced_df, chunk_size)):
+        with metrics.timer('geopose.format', items=len(chunk)):
+            f = format_chunk(chunk)
+
+            pose_columns = (f['latitude'], f['longitude'], f['altitude'], f['qx'], f['qy'], f['qz'], f['qw'])
+            sha256.update("".join(chain.from_iterable(zip(*pose_columns))).encode())
+
+            # Translation of each pose in meters relative to the outer frame origin
+            E, N, U = geodetic_to_enu(chunk['latitude'].to_numpy(), chunk['longitude'].to_numpy(),
+                                      chunk['altitude'].to_numpy(), *reference)
+            frame_columns = (format_values(E), format_values(N), format_values(U), f['qx'], f['qy'], f['qz'], f['qw'])
+
+        with metrics.timer('geopose.write', items=len(chunk)):
+            if i > 0:
+                series_file.write(",\n")
+            series_file.write(",\n".join(INNER_FRAME_TEMPLATE % row for row in zip(*frame_columns)))
+
+    return sha256.hexdigest()
+
+def write_geopose(synced_df, geopose_path, chunk_size=CHUNK_SIZE):
+    """
+    Create a GeoPose series file from the synchronized dataframe.
+
+    Poses are formatted and hashed once, chunk by chunk, and the innerFrameSeries is
+    streamed to disk. The output is identical to serializing the whole structure with
+    json.dump(..., indent=4).
+
+    Args:
+        synced_df: Synchronized dataframe created from preprocessing
+        geopose_path: Path of the GeoPose JSON file to write
+        chunk_size: Number of poses processed at a time
+    """
+    # Define the reference point (first entry in the dataset)
+    lat_ref = synced_df.iloc[0]['latitude']
+    lon_ref = synced_df.iloc[0]['longitude']
+    alt_ref = synced_df.iloc[0]['altitude']
+
+    # Calculate inter-pose duration (assuming regular interval based on GPS time difference)
+    # NOTE: total_samples = ((last_timestamp - initial_timestamp)/consecutive_timestamp_diff) + 1
+    timestamps = synced_df['gps_time'].values
+    inter_pose_duration = int(np.median(np.diff(timestamps)))  # Use median to find the regular interval
+
+    # Extract the start and stop instants
+    start_instant = int(str(timestamps[0])[:10])
+    stop_instant = int(str(timestamps[-1])[:10])
+
+    # Count the number of poses
+    pose_count = len(timestamps)
+
+    # The header needs the integrity check, so the inner frames are staged in a temporary file
+    series_file = tempfile.TemporaryFile('w+', dir=os.path.dirname(os.path.abspath(geopose_path)))
+    integrity_check = write_inner_frames(synced_df, series_file, (lat_ref, lon_ref, alt_ref), chunk_size)
+
+    # Define the outer frame using the reference LTP (Latitude, Longitude, Altitude)
+    outer_frame = {
         "authority": "/geopose/1.0",
-        "id": "none",
-        "parameters": ""
+        "id": "LTP-ENU",
+        "parameters": f"longitude={lon_ref}&latitude={lat_ref}&height={alt_ref}"
+    }
+
+    # Create the Series Header
+    series_header = {
+        "poseCount": pose_count,
+        "integrityCheck": f"{{\"SHA256\": \"{integrity_check}\"}}",
+        "startInstant": start_instant,
+        "stopInstant": stop_instant,
+        "transitionModel": {
+            "authority": "/geopose/1.0",
+            "id": "none",
+            "parameters": ""
+        }
+    }
+
+    # Create the Series Trailer
+    series_trailer = {
+        "poseCount": pose_count,
+        "integrityCheck": f"{{\"SHA256\": \"{integrity_check}\"}}"
     }
-}
 
-# Create the Series Trailer
-series_trailer = {
-    "poseCount": pose_count,
-    "integrityCheck": f"{{\"SHA256\": \"{integrity_check}\"}}"
-}
+    # Assemble the GeoPose JSON structure, the inner frame series is written separately
+    geopose_series = {
+        "header": series_header,
+        "interPoseDuration": inter_pose_duration,
+        "outerFrame": outer_frame,
+        "innerFrameSeries": INNER_FRAME_SERIES_PLACEHOLDER,
+        "trailer": series_trailer
+    }
+
+    document_start, document_end = json.dumps(geopose_series, indent=4).split(f'"{INNER_FRAME_SERIES_PLACEHOLDER}"')
+
+    with series_file, open(geopose_path, 'w') as json_file:
+        json_file.write(document_start)
+        json_file.write("[\n")
+
+        series_file.seek(0)
+        shutil.copyfileobj(series_file, json_file)
+
+        json_file.write("\n    ]")
+        json_file.write(document_end)
+
+def main():
+    # Load synchronized dataframe file created from preprocessing (.parquet, .arrow or .csv)
+    synced_df = read_synced_df(find_synced_df(os.path.dirname(os.path.abspath(__file__))), columns=GEOPOSE_COLUMNS)
 
-# Assemble the GeoPose JSON structure
-geopose_series = {
-    "header": series_header,
-    "interPoseDuration": inter_pose_duration,
-    "outerFrame": outer_frame,
-    "innerFrameSeries": inner_frame_series,
-    "trailer": series_trailer
-}
+    output_dir = os.path.join(os.path.dirname(__file__), 'output')
+    os.makedirs(output_dir, exist_ok=True)
 
-output_dir = os.path.join(os.path.dirname(__file__), 'output')
-os.makedirs(output_dir, exist_ok=True)
+    geopose_path = os.path.join(output_dir, 'geopose_file.json')
+    write_geopose(synced_df, geopose_path)
 
-geopose_path = os.path.join(output_dir, 'geopose_file.json')
-with open(geopose_path, 'w') as json_file:
-    json.dump(geopose_series, json_file, indent=4)
+    print(f'Geopose file saved to {geopose_path}')
 
-print(f'Geopose file saved to {geopose_path}')
+if __name__ == '__main__':
+    main()
 
-# Original script author: Kalp Devangbhai Thakkar 
+# Original script author: Kalp Devangbhai Thakkar
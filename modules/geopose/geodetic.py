@@ -0,0 +1,80 @@
+# Vectorized WGS84 geodetic -> ECEF -> local ENU (East, North, Up) conversions.
+# All functions accept scalars or numpy arrays, angles are in degrees and distances in meters.
+
+import numpy as np
+
+# WGS84 ellipsoid parameters
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+def geodetic_to_ecef(lat, lon, alt):
+    """
+    Convert geodetic coordinates to Earth-Centered, Earth-Fixed coordinates.
+
+    Args:
+        lat: Latitude in degrees
+        lon: Longitude in degrees
+        alt: Height above the WGS84 ellipsoid in meters
+
+    Returns:
+        Tuple of (x, y, z) in meters
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    alt = np.asarray(alt, dtype=np.float64)
+
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+
+    # Prime vertical radius of curvature
+    N = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_lat ** 2)
+
+    x = (N + alt) * cos_lat * np.cos(lon)
+    y = (N + alt) * cos_lat * np.sin(lon)
+    z = (N * (1 - WGS84_E2) + alt) * sin_lat
+
+    return x, y, z
+
+def ecef_to_enu(x, y, z, lat_ref, lon_ref, alt_ref):
+    """
+    Convert ECEF coordinates to a local East, North, Up frame.
+
+    Args:
+        x, y, z: ECEF coordinates in meters
+        lat_ref, lon_ref, alt_ref: Geodetic origin of the local tangent plane
+
+    Returns:
+        Tuple of (east, north, up) in meters
+    """
+    x_ref, y_ref, z_ref = geodetic_to_ecef(lat_ref, lon_ref, alt_ref)
+
+    dx = np.asarray(x, dtype=np.float64) - x_ref
+    dy = np.asarray(y, dtype=np.float64) - y_ref
+    dz = np.asarray(z, dtype=np.float64) - z_ref
+
+    sin_lat = np.sin(np.radians(lat_ref))
+    cos_lat = np.cos(np.radians(lat_ref))
+    sin_lon = np.sin(np.radians(lon_ref))
+    cos_lon = np.cos(np.radians(lon_ref))
+
+    east = -sin_lon * dx + cos_lon * dy
+    north = -sin_lat * cos_lon * dx - sin_lat * sin_lon * dy + cos_lat * dz
+    up = cos_lat * cos_lon * dx + cos_lat * sin_lon * dy + sin_lat * dz
+
+    return east, north, up
+
+def geodetic_to_enu(lat, lon, alt, lat_ref, lon_ref, alt_ref):
+    """
+    Convert geodetic coordinates to a local East, North, Up frame.
+
+    Args:
+        lat, lon, alt: Geodetic coordinates (degrees, degrees, meters)
+        lat_ref, lon_ref, alt_ref: Geodetic origin of the local tangent plane
+
+    Returns:
+        Tuple of (east, north, up) in meters
+    """
+    x, y, z = geodetic_to_ecef(lat, lon, alt)
+
+    return ecef_to_enu(x, y, z, lat_ref, lon_ref, alt_ref)
@@ -0,0 +1,235 @@
+# Spatial index over the camera frames of a synchronized dataframe, for processing part of a session.
+#
+# Frames are placed in square cells of a local East, North plane (geodetic.py) and a bounding box,
+# radius or corridor query only tests the frames of the cells it overlaps.
+#
+# python modules/geopose/spatial_index.py <synchronized_df> --radius 28.6012,-81.1995,50
+
+import os
+import sys
+import argparse
+import numpy as np
+from geodetic import geodetic_to_enu
+
+# Readers of the synchronized dataframe, imported when an index is loaded since they need pandas,
+# which the SAM2 and Detectron2 environments of run_pipeline.py do not have
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'preprocessing', 'create_synced_df'))
+
+# Columns of the synchronized dataframe the index is built from
+INDEX_COLUMNS = ['image', 'latitude', 'longitude', 'altitude']
+
+# Edge of a grid cell in meters, about the distance driven in a few seconds
+DEFAULT_CELL_SIZE = 50.0
+
+# Half width of a corridor query in meters, about a road with its shoulders
+DEFAULT_CORRIDOR_METERS = 15.0
+
+# Cell coordinates are packed into one sortable int64 key
+CELL_OFFSET = 2 ** 30
+CELL_STRIDE = 2 ** 31
+
+class SpatialIndex:
+    """
+    Grid index of the frame positions on the local East, North plane.
+
+    Args:
+        images: Image name of every frame
+        latitudes: Latitude of every frame in degrees
+        longitudes: Longitude of every frame in degrees
+        altitudes: Optional altitude of every frame in meters
+        cell_size: Edge of a grid cell in meters
+        reference: Optional (latitude, longitude, altitude) origin of the plane, defaults to the first frame
+    """
+    def __init__(self, images, latitudes, longitudes, altitudes=None, cell_size=DEFAULT_CELL_SIZE, reference=None):
+        if cell_size <= 0:
+            raise ValueError('cell_size must be positive')
+
+        self.images = np.asarray(images, dtype=object)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        altitudes = np.zeros(len(self.images)) if altitudes is None else np.asarray(altitudes, dtype=np.float64)
+        self.cell_size = cell_size
+
+        if reference is None:
+            reference = (self.latitudes[0], self.longitudes[0], altitudes[0]) if len(self.images) else (0.0, 0.0, 0.0)
+        self.reference = tuple(float(value) for value in reference)
+
+        self.east, self.north, _ = geodetic_to_enu(self.latitudes, self.longitudes, altitudes, *self.reference)
+
+        # Frames sorted by cell, the frames of a run of cells in one column are then contiguous
+        keys = self.cell_keys(self.cell(self.east), self.cell(self.north))
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    @classmethod
+    def from_synced_df(cls, synced_df, cell_size=DEFAULT_CELL_SIZE):
+        """
+        Index the frames of a synchronized dataframe, rows without an image are left out.
+        """
+        frames = synced_df.dropna(subset=INDEX_COLUMNS).drop_duplicates(subset=['image'])
+
+        return cls(frames['image'].to_numpy(), frames['latitude'].to_numpy(), frames['longitude'].to_numpy(),
+                   frames['altitude'].to_numpy(), cell_size)
+
+    @classmethod
+    def load(cls, synced_df_path, cell_size=DEFAULT_CELL_SIZE):
+        from synced_df_io import read_synced_df
+
+        return cls.from_synced_df(read_synced_df(synced_df_path, columns=INDEX_COLUMNS), cell_size)
+
+    def __len__(self):
+        return len(self.images)
+
+    def cell(self, meters):
+        return np.floor(np.asarray(meters) / self.cell_size).astype(np.int64)
+
+    @staticmethod
+    def cell_keys(cell_east, cell_north):
+        return (cell_east + CELL_OFFSET) * CELL_STRIDE + (cell_north + CELL_OFFSET)
+
+    def to_enu(self, latitudes, longitudes):
+        # Query points are placed at the altitude of the origin, which moves them by millimeters at most
+        east, north, _ = geodetic_to_enu(latitudes, longitudes, self.reference[2], *self.reference)
+        return east, north
+
+    def candidates(self, min_east, min_north, max_east, max_north):
+        """
+        Returns:
+            Indices of the frames in the cells overlapping the rectangle
+        """
+        east_cells = np.arange(self.cell(min_east), self.cell(max_east) + 1)
+
+        # A query larger than the session is cheaper to test frame by frame
+        if len(east_cells) > len(self.keys):
+            return np.arange(len(self.images))
+
+        starts = np.searchsorted(self.keys, self.cell_keys(east_cells, self.cell(min_north)), 'left')
+        ends = np.searchsorted(self.keys, self.cell_keys(east_cells, self.cell(max_north)), 'right')
+
+        if not len(east_cells) or not (ends > starts).any():
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([self.order[start:end] for start, end in zip(starts, ends) if end > start])
+
+    def images_at(self, indices):
+        # Image names in session order
+        return self.images[np.unique(indices)].tolist()
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Returns:
+            Images inside the latitude/longitude box, in session order
+        """
+        # Lines of constant latitude curve on the plane, so the edge midpoints are included in the envelope
+        lats = np.array([min_lat, min_lat, max_lat, max_lat, min_lat, max_lat])
+        lons = np.array([min_lon, max_lon, min_lon, max_lon, (min_lon + max_lon) / 2, (min_lon + max_lon) / 2])
+        east, north = self.to_enu(lats, lons)
+
+        margin = self.cell_size
+        indices = self.candidates(east.min() - margin, north.min() - margin, east.max() + margin, north.max() + margin)
+
+        inside = ((self.latitudes[indices] >= min_lat) & (self.latitudes[indices] <= max_lat) &
+                  (self.longitudes[indices] >= min_lon) & (self.longitudes[indices] <= max_lon))
+        return self.images_at(indices[inside])
+
+    def radius(self, lat, lon, meters):
+        """
+        Returns:
+            Images within meters of the point, in session order
+        """
+        east, north = self.to_enu(lat, lon)
+        indices = self.candidates(east - meters, north - meters, east + meters, north + meters)
+
+        inside = (self.east[indices] - east) ** 2 + (self.north[indices] - north) ** 2 <= meters ** 2
+        return self.images_at(indices[inside])
+
+    def corridor(self, path, meters=DEFAULT_CORRIDOR_METERS):
+        """
+        Args:
+            path: Polyline as a list of (latitude, longitude) points, e.g. a road segment
+            meters: Distance from the polyline a frame may have
+
+        Returns:
+            Images within meters of the polyline, in session order
+        """
+        path = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+        if len(path) == 0:
+            return []
+        if len(path) == 1:
+            return self.radius(path[0, 0], path[0, 1], meters)
+
+        path_east, path_north = self.to_enu(path[:, 0], path[:, 1])
+
+        selected = []
+        for (start_east, end_east), (start_north, end_north) in zip(zip(path_east[:-1], path_east[1:]), zip(path_north[:-1], path_north[1:])):
+            indices = self.candidates(min(start_east, end_east) - meters, min(start_north, end_north) - meters,
+                                      max(start_east, end_east) + meters, max(start_north, end_north) + meters)
+
+            # Distance to the closest point of the segment
+            segment_east, segment_north = end_east - start_east, end_north - start_north
+            length_squared = segment_east ** 2 + segment_north ** 2
+            offset_east, offset_north = self.east[indices] - start_east, self.north[indices] - start_north
+
+            t = 0.0 if length_squared == 0 else np.clip((offset_east * segment_east + offset_north * segment_north) / length_squared, 0, 1)
+            distance_squared = (offset_east - t * segment_east) ** 2 + (offset_north - t * segment_north) ** 2
+
+            selected.append(indices[distance_squared <= meters ** 2])
+
+        return self.images_at(np.concatenate(selected))
+
+def parse_numbers(text, count=None):
+    values = [float(value) for value in text.replace(' ', ',').split(',') if value]
+    if count is not None and len(values) != count:
+        raise argparse.ArgumentTypeError(f"Expected {count} comma separated numbers, got '{text}'")
+    return values
+
+def add_selection_arguments(parser):
+    # Location filters shared by this script and pipeline/run_pipeline.py
+    parser.add_argument('--bbox', type=lambda text: parse_numbers(text, 4), metavar='MIN_LAT,MIN_LON,MAX_LAT,MAX_LON',
+                        help='Only frames inside the box')
+    parser.add_argument('--radius', type=lambda text: parse_numbers(text, 3), metavar='LAT,LON,METERS',
+                        help='Only frames within METERS of the point')
+    parser.add_argument('--corridor', type=parse_numbers, metavar='LAT,LON,LAT,LON,...',
+                        help='Only frames along the polyline, within --corridor-meters of it')
+    parser.add_argument('--corridor-meters', type=float, default=DEFAULT_CORRIDOR_METERS)
+
+def select_images(index, args):
+    """
+    Apply the location filters of add_selection_arguments.
+
+    Returns:
+        Images matching any of the filters in session order, or None when no filter was given
+    """
+    if args.corridor is not None and len(args.corridor) % 2:
+        raise ValueError('--corridor needs latitude, longitude pairs')
+
+    selections = []
+    if args.bbox is not None:
+        selections.append(index.bbox(*args.bbox))
+    if args.radius is not None:
+        selections.append(index.radius(*args.radius))
+    if args.corridor is not None:
+        selections.append(index.corridor(np.reshape(args.corridor, (-1, 2)), args.corridor_meters))
+
+    if not selections:
+        return None
+
+    selected = set().union(*selections)
+    return [image for image in index.images if image in selected]
+
+def main():
+    parser = argparse.ArgumentParser(description='List the frames of a synchronized dataframe inside an area')
+    parser.add_argument('synced_df', help='Synchronized dataframe (.csv, .parquet or .arrow)')
+    parser.add_argument('--cell-size', type=float, default=DEFAULT_CELL_SIZE, help='Grid cell edge in meters')
+    add_selection_arguments(parser)
+    args = parser.parse_args()
+
+    index = SpatialIndex.load(args.synced_df, args.cell_size)
+    images = select_images(index, args)
+    if images is None:
+        parser.error('Give at least one of --bbox, --radius and --corridor')
+
+    for image in images:
+        print(image)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import os
+import sys
+import shutil
+import torch
+from detectron2 import model_zoo
+from detectron2.config import get_cfg
+from detectron2.modeling import build_model
+from detectron2.checkpoint import DetectionCheckpointer
+from detectron2.data import MetadataCatalog
+from detectron2.data import transforms as T
+from detectron2.utils.file_io import PathManager
+from detectron2.utils.visualizer import Visualizer
+
+# Mask encodings are shared with the road segmentation module
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'road_segmentation'))
+from mask_encoding import DEFAULT_TOLERANCE, encode_mask
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+import metrics
+
+DEFAULT_CONFIG = 'COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml'
+
+class ObjectSegmenter:
+    """
+    Headless Detectron2 instance segmentation. Images are resized and batched by hand
+    and run through the model directly rather than one image per DefaultPredictor call.
+    """
+    def __init__(self, config_name=DEFAULT_CONFIG, score_threshold=0.5, min_size=800, max_size=1333, device=None, weights_dir=None):
+        """
+        Args:
+            config_name: Model zoo configuration of the model
+            score_threshold: Instances scoring lower are dropped
+            min_size: Length the shortest image edge is resized to before inference
+            max_size: Upper bound of the longest image edge after resizing
+            device: Torch device, defaults to CUDA when available and CPU otherwise
+            weights_dir: Directory of the local weight cache, defaults to model/ next to this file
+        """
+        self.script_dir = os.path.dirname(os.path.abspath(__file__))
+        self.weights_dir = weights_dir or os.path.join(self.script_dir, 'model')
+
+        self.cfg = get_cfg()
+        self.cfg.merge_from_file(model_zoo.get_config_file(config_name))
+        self.cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = score_threshold
+        self.cfg.MODEL.DEVICE = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.cfg.MODEL.WEIGHTS = self.get_weights(config_name)
+        self.cfg.freeze()
+
+        self.model = self.load_model()
+        self.resize = T.ResizeShortestEdge([min_size, min_size], max_size)
+        self.metadata = MetadataCatalog.get(self.cfg.DATASETS.TRAIN[0])
+        self.class_names = self.metadata.get('thing_classes', None)
+
+    def get_weights(self, config_name):
+        """
+        Return the local path of the model weights, downloading them into the weight cache on first use
+        so later runs work offline.
+        """
+        url = model_zoo.get_checkpoint_url(config_name)
+        weights_path = os.path.join(self.weights_dir, os.path.splitext(config_name)[0].replace('/', '_') + '_' + os.path.basename(url))
+
+        if not os.path.exists(weights_path):
+            print(f'Downloading weights for {config_name}')
+            os.makedirs(self.weights_dir, exist_ok=True)
+
+            # Copy to a temporary name first so an interrupted download is never used
+            shutil.copyfile(PathManager.get_local_path(url), weights_path + '.tmp')
+            os.replace(weights_path + '.tmp', weights_path)
+
+        return weights_path
+
+    def load_model(self):
+        try:
+            model = build_model(self.cfg)
+            model.eval()
+            DetectionCheckpointer(model).load(self.cfg.MODEL.WEIGHTS)
+
+            return model
+        except Exception as e:
+            print(f'Model failed to load\n{e}')
+            raise(e)
+
+    def prepare_input(self, image):
+        # Same preprocessing as DefaultPredictor, for a BGR image
+        height, width = image.shape[:2]
+        resized = self.resize.get_transform(image).apply_image(image)
+        tensor = torch.as_tensor(resized.astype('float32').transpose(2, 0, 1))
+
+        return {'image': tensor, 'height': height, 'width': width}
+
+    def predict_batch(self, images):
+        """
+        Args:
+            images: List of BGR images as numpy arrays (as read by cv2.imread)
+
+        Returns:
+            List of detectron2 Instances on the CPU, one per image, in original image coordinates
+        """
+        inputs = [self.prepare_input(image) for image in images]
+
+        with metrics.timer('objects.predict', items=len(images)), torch.inference_mode():
+            outputs = self.model(inputs)
+
+        return [output['instances'].to('cpu') for output in outputs]
+
+    @metrics.timer('objects.encode_masks')
+    def format_instances(self, instances, mask_format='rle', tolerance=DEFAULT_TOLERANCE):
+        """
+        Args:
+            instances: Detectron2 Instances of one image
+            mask_format: 'rle' or 'polygons', see mask_encoding
+            tolerance: Polygon simplification tolerance in pixels
+
+        Returns:
+            List of dictionaries with the class, score, box and encoded mask of each instance
+        """
+        masks = instances.pred_masks.numpy()
+        classes = instances.pred_classes.tolist()
+        scores = instances.scores.tolist()
+        boxes = instances.pred_boxes.tensor.tolist()
+
+        return [{
+            'class': self.class_names[class_id] if self.class_names else class_id,
+            'class_id': class_id,
+            'score': score,
+            'box': [round(value, 1) for value in box],
+            'segmentation': encode_mask(mask, mask_format, tolerance)
+        } for mask, class_id, score, box in zip(masks, classes, scores, boxes)]
+
+    def draw(self, image, instances, scale=1.0):
+        """
+        Draw the instances over a BGR image.
+
+        Returns:
+            BGR image with the instance masks, boxes and labels drawn
+        """
+        visualizer = Visualizer(image[:, :, ::-1], self.metadata, scale=scale)
+        out = visualizer.draw_instance_predictions(instances)
+
+        return out.get_image()[:, :, ::-1]
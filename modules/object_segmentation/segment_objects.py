@@ -1,42 +1,147 @@
-import detectron2
-from detectron2.utils.logger import setup_logger
-setup_logger()
-from detectron2 import model_zoo
-from detectron2.engine import DefaultPredictor
-from detectron2.config import get_cfg
-from detectron2.utils.visualizer import Visualizer
-from detectron2.data import MetadataCatalog
-import cv2
 import os
+import sys
+import json
+import argparse
+import cv2
+from detectron2.utils.logger import setup_logger
+from object_segmenter import ObjectSegmenter
+
+# Decoded frames are shared with the other stages through the frame cache, reading runs on the staged pipeline
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from frame_cache import read_frame
+from staged_pipeline import Stage, StagedPipeline
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+DEFAULT_BATCH_SIZE = 4
+
+# Sample frame segmented when no input directory is given
+SAMPLE_IMAGE = '2115979251_8281e3fe36_b.jpg'
+
+def read_images(image_paths, num_workers=4, frame_cache=None):
+    # Decode images in background threads, in order, while the model runs. At most 2 * num_workers
+    # decoded frames wait for the model, so memory does not grow with the number of images.
+    pipeline = StagedPipeline([Stage('read', lambda path: (path, read_frame(path, frame_cache)), workers=num_workers,
+                                     prefetch=num_workers)], max_in_flight=2 * num_workers)
+    yield from pipeline.run(image_paths)
+
+def read_video(video_path):
+    # Frames of a video file or camera stream, named by their index
+    capture = cv2.VideoCapture(video_path)
+    try:
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+def predict_batch(segmenter, batch):
+    names, images = zip(*batch)
+    return zip(names, images, segmenter.predict_batch(list(images)))
+
+def segment_stream(segmenter, frames, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Segment a stream of frames batch_size at a time.
+
+    Args:
+        segmenter: Initialized ObjectSegmenter
+        frames: Iterable of (name, BGR image) pairs, e.g. read_images or read_video
+        batch_size: Number of images per model call
+
+    Yields:
+        (name, image, instances) for every frame, in input order
+    """
+    batch = []
+
+    for name, image in frames:
+        if image is None:
+            print(f'Warning: Could not read {name}, skipping...')
+            continue
+
+        batch.append((name, image))
+        if len(batch) == batch_size:
+            yield from predict_batch(segmenter, batch)
+            batch = []
+
+    if batch:
+        yield from predict_batch(segmenter, batch)
+
+def segment_directory(segmenter, input_dir, batch_size=DEFAULT_BATCH_SIZE, mask_format='rle', visualize_dir=None, selection=None):
+    """
+    Segment every image of a directory.
+
+    Args:
+        segmenter: Initialized ObjectSegmenter
+        input_dir: Directory containing the images
+        batch_size: Number of images per model call
+        mask_format: 'rle' or 'polygons', see mask_encoding
+        visualize_dir: When given, images with the instances drawn are saved there
+        selection: Optional image names, e.g. from spatial_index.py, other images are skipped
+
+    Returns:
+        List of result dictionaries, one per image
+    """
+    image_files = [f for f in sorted(os.listdir(input_dir)) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+    if selection is not None:
+        selection = set(selection)
+        image_files = [f for f in image_files if f in selection]
+
+    image_paths = [os.path.join(input_dir, f) for f in image_files]
+
+    if visualize_dir is not None:
+        os.makedirs(visualize_dir, exist_ok=True)
+
+    results = []
+
+    for image_path, image, instances in segment_stream(segmenter, read_images(image_paths), batch_size):
+        image_name = os.path.basename(image_path)
+
+        results.append({
+            'image': image_name,
+            'size': list(image.shape[:2]),
+            'instances': segmenter.format_instances(instances, mask_format)
+        })
+
+        if visualize_dir is not None:
+            cv2.imwrite(os.path.join(visualize_dir, image_name), segmenter.draw(image, instances))
+
+        print(f'Processed {image_name} ({len(instances)} instances)')
+
+    return results
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Load configuration
-cfg = get_cfg()
-cfg.merge_from_file(model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"))
-cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-predictor = DefaultPredictor(cfg)
+    parser = argparse.ArgumentParser(description='Segment the objects in a directory of images with Detectron2')
+    parser.add_argument('input_dir', nargs='?', help='Directory of images, defaults to the sample frame of this module')
+    parser.add_argument('--visualize', action='store_true', help='Save the images with the instances drawn to output/visualized')
+    args = parser.parse_args()
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-img_path = os.path.join(script_dir, "2115979251_8281e3fe36_b.jpg") # Replace with your image path
+    setup_logger()
 
-# Load image
-im = cv2.imread(img_path)
+    segmenter = ObjectSegmenter(score_threshold=0.5, min_size=800)
 
-# Run prediction
-outputs = predictor(im)
+    output_dir = os.path.join(script_dir, 'output')
+    os.makedirs(output_dir, exist_ok=True)
+    visualize_dir = os.path.join(output_dir, 'visualized') if args.visualize else None
 
-# Access segmentation masks
-masks = outputs["instances"].pred_masks.cpu().numpy()
-classes = outputs["instances"].pred_classes.cpu().numpy()
+    # Without an input directory only the sample frame is segmented, not the earlier output next to it
+    input_dir = args.input_dir or script_dir
+    selection = None if args.input_dir else [SAMPLE_IMAGE]
 
-# Process and visualize masks (example)
-v = Visualizer(im[:, :, ::-1], MetadataCatalog.get(cfg.DATASETS.TRAIN[0]), scale=1.2)
-out = v.draw_instance_predictions(outputs["instances"].to("cpu"))
-cv2.imshow("Segmentation", out.get_image()[:, :, ::-1])
+    results = segment_directory(segmenter, input_dir, batch_size=DEFAULT_BATCH_SIZE, mask_format='rle',
+                                visualize_dir=visualize_dir, selection=selection)
 
-# Save segmented image
-segmented_img_path = os.path.join(script_dir, "segmented_image.jpg")
-cv2.imwrite(segmented_img_path, out.get_image()[:, :, ::-1])
+    output_path = os.path.join(output_dir, 'object_segmentations.json')
+    with open(output_path, 'w') as f:
+        json.dump(results, f, separators=(',', ':'))
 
-cv2.waitKey(0)
-cv2.destroyAllWindows()
+    print(f'Object segmentations saved to {output_path}')
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Benchmark of SAM2 execution modes (model size, precision, int8 quantization, torch.compile,
+# refinement policy) reporting per-image latency and mask IoU against the large model in float32
+
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+from sam2_model import SAM2Model, REFINED, mask_iou
+from segment_road import calculate_input_points
+
+# (model_size, precision, quantize, compile, refine) of each configuration
+CONFIGURATIONS = [
+    ('large', 'float32', False, False, 'always'),
+    ('large', 'float32', False, False, 'adaptive'),
+    ('large', 'float32', False, False, 'never'),
+    ('large', 'auto', False, False, 'always'),
+    ('base-plus', 'auto', False, False, 'always'),
+    ('small', 'auto', False, False, 'always'),
+    ('tiny', 'auto', False, False, 'always'),
+    ('tiny', 'auto', False, False, 'adaptive'),
+    ('tiny', 'float32', True, False, 'always'),
+    ('tiny', 'auto', False, True, 'always'),
+]
+
+# Images used for the benchmark, taken from the start of the images directory
+MAX_IMAGES = 20
+
+# Configuration every other one is compared against, its masks are the reference of the IoU columns
+REFERENCE_CONFIGURATION = ('large', 'float32', False, False, 'always')
+
+# Runs excluded from the timings, compilation and allocator warm-up happen here
+WARMUP_RUNS = 2
+
+def run_configuration(image_paths, model_size, precision, quantize, compiled, refine, device=None):
+    """
+    Segment every image with one configuration.
+
+    Returns:
+        Tuple of (masks, per-image latencies in seconds, refinement paths, resolved precision)
+    """
+    masking_model = SAM2Model(model_size=model_size, device=device, precision=precision, quantize=quantize,
+                              compile=compiled, refine=refine)
+
+    for image_path in image_paths[:WARMUP_RUNS]:
+        image = np.array(Image.open(image_path).convert('RGB'))
+        masking_model.segment_road(image_path, calculate_input_points(image), [1, 0])
+
+    masks = []
+    latencies = []
+    paths = []
+
+    for image_path in image_paths:
+        image = np.array(Image.open(image_path).convert('RGB'))
+        input_points = calculate_input_points(image)
+
+        start = time.perf_counter()
+        mask, _, path = masking_model.segment_road(image_path, input_points, [1, 0])
+        latencies.append(time.perf_counter() - start)
+
+        masks.append(mask)
+        paths.append(path)
+
+    return masks, latencies, paths, masking_model.precision
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    images_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(script_dir, 'input', 'test_images')
+    device = sys.argv[2] if len(sys.argv) > 2 else 'cpu'
+
+    image_names = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    image_paths = [os.path.join(images_dir, name) for name in image_names[:MAX_IMAGES]]
+
+    print(f'Benchmarking {len(image_paths)} images on {device}')
+    print(f"{'Model':>10} {'Precision':>10} {'Int8':>5} {'Compile':>8} {'Refine':>9} {'Refined':>8} "
+          f"{'Mean (s)':>9} {'P95 (s)':>8} {'Mean IoU':>9} {'Min IoU':>8}")
+
+    reference_masks = None
+
+    for configuration in CONFIGURATIONS:
+        model_size, precision, quantize, compiled, refine = configuration
+        if quantize and device != 'cpu':
+            continue
+
+        try:
+            masks, latencies, paths, resolved_precision = run_configuration(image_paths, model_size, precision, quantize,
+                                                                            compiled, refine, device)
+        except Exception as e:
+            print(f'Skipping {model_size} ({precision}, int8={quantize}, compile={compiled}, refine={refine})\n{e}')
+            continue
+
+        # Only the always-refined float32 large model is a reference, if it failed there is nothing to compare with
+        if configuration == REFERENCE_CONFIGURATION:
+            reference_masks = masks
+
+        if reference_masks is None:
+            mean_iou, min_iou = f"{'n/a':>9}", f"{'n/a':>8}"
+        else:
+            ious = [mask_iou(mask, reference) for mask, reference in zip(masks, reference_masks)]
+            mean_iou, min_iou = f'{np.mean(ious):>9.3f}', f'{np.min(ious):>8.3f}'
+
+        refined = paths.count(REFINED) / len(paths)
+
+        print(f"{model_size:>10} {resolved_precision:>10} {str(quantize):>5} {str(compiled):>8} {refine:>9} {refined:>8.0%} "
+              f"{np.mean(latencies):>9.3f} {np.percentile(latencies, 95):>8.3f} {mean_iou} {min_iou}")
+
+if __name__ == '__main__':
+    main()
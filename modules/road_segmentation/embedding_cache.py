@@ -0,0 +1,130 @@
+import os
+import shutil
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+class EmbeddingCache:
+    """
+    Cache of SAM2 image embeddings keyed by image content and model checkpoint.
+
+    Recently used embeddings are kept in an in-memory LRU. Every embedding is also
+    written to disk as .npy files which are memory-mapped when loaded again, and the
+    least recently used entries are evicted once the disk tier grows past max_disk_bytes.
+
+    An entry is a dictionary with 'image_embed' (array), 'high_res_feats' (list of
+    arrays) and 'orig_hw' (array of the original image height and width).
+    """
+    def __init__(self, cache_dir=None, max_memory_entries=8, max_disk_bytes=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+
+        # Size of every entry on disk, used for eviction without rescanning the directory
+        self.disk_sizes = {}
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            for key in os.listdir(cache_dir):
+                entry_dir = os.path.join(cache_dir, key)
+                if key.endswith('.tmp'):
+                    # Left over from an interrupted write
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                elif os.path.isdir(entry_dir):
+                    self.disk_sizes[key] = sum(f.stat().st_size for f in os.scandir(entry_dir))
+
+    @staticmethod
+    def make_key(image, model_name):
+        """
+        Args:
+            image: RGB image as numpy array
+            model_name: Name of the SAM2 checkpoint which produced the embedding
+
+        Returns:
+            Hex digest identifying the (image, checkpoint) pair
+        """
+        digest = hashlib.sha256()
+        digest.update(model_name.encode())
+        digest.update(str(image.shape).encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+
+        if key not in self.disk_sizes:
+            return None
+
+        entry = self._load(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+
+        if self.cache_dir is not None and key not in self.disk_sizes:
+            self._save(key, entry)
+            self._evict_disk()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def _save(self, key, entry):
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = entry_dir + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        np.save(os.path.join(tmp_dir, 'image_embed.npy'), entry['image_embed'])
+        np.save(os.path.join(tmp_dir, 'orig_hw.npy'), np.asarray(entry['orig_hw']))
+        for i, feat in enumerate(entry['high_res_feats']):
+            np.save(os.path.join(tmp_dir, f'high_res_feats_{i}.npy'), feat)
+
+        # Rename once complete so readers never see a partially written entry
+        os.replace(tmp_dir, entry_dir)
+        self.disk_sizes[key] = sum(f.stat().st_size for f in os.scandir(entry_dir))
+
+    def _load(self, key):
+        entry_dir = os.path.join(self.cache_dir, key)
+
+        try:
+            num_feats = sum(1 for f in os.listdir(entry_dir) if f.startswith('high_res_feats_'))
+            entry = {
+                'image_embed': np.load(os.path.join(entry_dir, 'image_embed.npy'), mmap_mode='r'),
+                'high_res_feats': [np.load(os.path.join(entry_dir, f'high_res_feats_{i}.npy'), mmap_mode='r')
+                                   for i in range(num_feats)],
+                'orig_hw': np.load(os.path.join(entry_dir, 'orig_hw.npy')),
+            }
+        except (OSError, ValueError) as e:
+            print(f'Discarding unreadable cache entry {key}\n{e}')
+            self._remove(key)
+            return None
+
+        # Mark as recently used for disk eviction
+        os.utime(entry_dir)
+        return entry
+
+    def _remove(self, key):
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+        self.disk_sizes.pop(key, None)
+
+    def _evict_disk(self):
+        total_bytes = sum(self.disk_sizes.values())
+        if total_bytes <= self.max_disk_bytes:
+            return
+
+        # Oldest access time first
+        keys = sorted(self.disk_sizes, key=lambda k: os.path.getmtime(os.path.join(self.cache_dir, k)))
+
+        for key in keys:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            total_bytes -= self.disk_sizes[key]
+            self._remove(key)
@@ -0,0 +1,211 @@
+# Compact encodings of binary segmentation masks: COCO compressed RLE and simplified multi-polygons.
+# The RLE strings are compatible with pycocotools (mask.encode / mask.decode).
+
+import json
+import cv2
+import numpy as np
+
+# 'polygon' is the original single, longest contour, kept for existing consumers
+MASK_FORMATS = ('polygon', 'polygons', 'rle')
+
+# Default simplification tolerance of 'polygons' in pixels
+DEFAULT_TOLERANCE = 2.0
+
+def mask_iou(mask, reference):
+    # Intersection over union of two binary masks, 1.0 when both are empty
+    mask = mask > 0
+    reference = reference > 0
+
+    union = np.logical_or(mask, reference).sum()
+    if union == 0:
+        return 1.0
+    return np.logical_and(mask, reference).sum() / union
+
+def rle_counts(mask):
+    """
+    Args:
+        mask: 2D binary mask
+
+    Returns:
+        Run lengths of the column-major flattened mask, starting with a (possibly empty) run of zeros
+    """
+    pixels = np.asarray(mask, dtype=bool).ravel(order='F')
+
+    # Positions where the value changes, plus both ends
+    changes = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+    boundaries = np.concatenate(([0], changes, [pixels.size]))
+    counts = np.diff(boundaries)
+
+    if pixels.size and pixels[0]:
+        counts = np.concatenate(([0], counts))
+
+    return counts.tolist()
+
+def counts_to_string(counts):
+    # Same variable-length, delta coded ASCII encoding as pycocotools' rleToString
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+def string_to_counts(string):
+    # Inverse of counts_to_string, as pycocotools' rleFrString
+    counts = []
+    p = 0
+    while p < len(string):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(string[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+def encode_rle(mask):
+    """
+    Encode a binary mask as COCO compressed RLE.
+
+    Args:
+        mask: 2D binary mask
+
+    Returns:
+        Dictionary with 'size' ([height, width]) and 'counts' (string)
+    """
+    height, width = mask.shape[:2]
+    return {'size': [height, width], 'counts': counts_to_string(rle_counts(mask))}
+
+def decode_rle(rle):
+    """
+    Args:
+        rle: Dictionary with 'size' and 'counts', counts either a compressed string or a list of run lengths
+
+    Returns:
+        2D uint8 mask
+    """
+    height, width = rle['size']
+    counts = rle['counts']
+    if isinstance(counts, str):
+        counts = string_to_counts(counts)
+
+    # Runs alternate between 0 and 1, starting with 0
+    values = np.arange(len(counts)) % 2
+    pixels = np.repeat(values.astype(np.uint8), counts)
+
+    return pixels.reshape((height, width), order='F')
+
+def mask_to_polygons(mask, tolerance=DEFAULT_TOLERANCE, min_area=0):
+    """
+    Convert a binary mask to the simplified outlines of all its regions.
+
+    Args:
+        mask: 2D binary mask
+        tolerance: Maximum distance in pixels between a simplified outline and the original contour
+        min_area: Regions with a smaller area in pixels are dropped
+
+    Returns:
+        List of flat [x1, y1, x2, y2, ...] polygons, largest region first
+    """
+    contours, _ = cv2.findContours(np.asarray(mask, dtype=np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    contours = [contour for contour in contours if cv2.contourArea(contour) >= min_area]
+    contours.sort(key=cv2.contourArea, reverse=True)
+
+    polygons = []
+    for contour in contours:
+        if tolerance > 0:
+            contour = cv2.approxPolyDP(contour, epsilon=tolerance, closed=True)
+
+        # A polygon needs at least 3 points
+        if len(contour) < 3:
+            continue
+        polygons.append(contour.reshape(-1).tolist())
+
+    return polygons
+
+def polygons_to_mask(polygons, size):
+    """
+    Args:
+        polygons: List of flat [x1, y1, x2, y2, ...] polygons, or a single flat polygon
+        size: [height, width] of the mask
+
+    Returns:
+        2D uint8 mask
+    """
+    height, width = size
+    mask = np.zeros((height, width), dtype=np.uint8)
+
+    if polygons and not isinstance(polygons[0], (list, tuple)):
+        polygons = [polygons]
+
+    points = [np.asarray(polygon, dtype=np.int32).reshape(-1, 2) for polygon in polygons]
+    cv2.fillPoly(mask, points, 1)
+
+    return mask
+
+def encode_mask(mask, mask_format='rle', tolerance=DEFAULT_TOLERANCE):
+    """
+    Args:
+        mask: 2D binary mask
+        mask_format: 'rle' or 'polygons'
+        tolerance: Polygon simplification tolerance in pixels
+
+    Returns:
+        JSON serializable segmentation
+    """
+    if mask_format == 'rle':
+        return encode_rle(mask)
+    if mask_format == 'polygons':
+        return mask_to_polygons(mask, tolerance)
+    raise ValueError(f"Unknown mask format '{mask_format}', expected 'rle' or 'polygons'")
+
+def decode_mask(segmentation, size=None):
+    """
+    Decode a segmentation written in any of MASK_FORMATS.
+
+    Args:
+        segmentation: RLE dictionary, list of polygons or a single flat polygon
+        size: [height, width] of the mask, required for polygons
+
+    Returns:
+        2D uint8 mask
+    """
+    if isinstance(segmentation, dict):
+        return decode_rle(segmentation)
+    if size is None:
+        raise ValueError('The mask size is required to decode polygons')
+    return polygons_to_mask(segmentation, size)
+
+def load_segmentations(path):
+    """
+    Load a segmentation results file and decode every segmentation to a mask.
+
+    Args:
+        path: Path of a JSON file written by segment_road.py
+
+    Returns:
+        List of result dictionaries with an added 'mask' entry
+    """
+    with open(path, 'r') as f:
+        results = json.load(f)
+
+    for result in results:
+        result['mask'] = decode_mask(result['segmentation'], result.get('size'))
+
+    return results
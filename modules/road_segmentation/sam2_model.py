@@ -1,47 +1,358 @@
+import os
+import sys
+import contextlib
 import torch
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 from PIL import Image
 import numpy as np
+from embedding_cache import EmbeddingCache
+from mask_encoding import mask_iou
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+import metrics
+
+# Hugging Face checkpoints of the Hiera variants, from fastest to most accurate
+MODEL_NAMES = {
+    'tiny': 'facebook/sam2-hiera-tiny',
+    'small': 'facebook/sam2-hiera-small',
+    'base-plus': 'facebook/sam2-hiera-base-plus',
+    'large': 'facebook/sam2-hiera-large',
+}
+
+PRECISIONS = ('auto', 'bfloat16', 'float32')
+
+# 'always' runs the second, logits-seeded pass on every frame, 'never' keeps the best
+# multimask candidate and 'adaptive' refines only when the candidates leave doubt
+REFINE_POLICIES = ('always', 'never', 'adaptive')
+
+# Refinement path recorded for each frame
+REFINED = 'refined'
+SINGLE_PASS = 'single_pass'
+SINGLE_PASS_SCORE = 'single_pass_score'
+SINGLE_PASS_AGREEMENT = 'single_pass_agreement'
+PROPAGATED = 'propagated'
+
+def cpu_supports_bfloat16():
+    # Native bfloat16 needs AVX512-BF16 or AMX, otherwise CPU autocast is slower than float32
+    checks = [getattr(torch.cpu, name, None) for name in ('_is_avx512_bf16_supported', '_is_amx_tile_supported')]
+    return any(check is not None and check() for check in checks)
 
 class SAM2Model:
-    def __init__(self):
-        self.model = self.load_model()
-       
+    def __init__(self, cache=None, model_size='large', device=None, precision='auto', quantize=False, compile=False,
+                 refine='always', score_threshold=0.9, agreement_iou=0.9):
+        """
+        Args:
+            cache: Optional EmbeddingCache, re-prompting a cached image skips the image encoder
+            model_size: Hiera variant, one of MODEL_NAMES
+            device: Torch device, defaults to CUDA when available and CPU otherwise
+            precision: 'bfloat16' or 'float32' autocast, 'auto' picks bfloat16 on CUDA and on
+                CPUs with native bfloat16 support
+            quantize: Apply dynamic int8 quantization to the Linear layers (CPU only, runs in float32)
+            compile: Compile the image encoder with torch.compile
+            refine: Refinement policy, one of REFINE_POLICIES
+            score_threshold: 'adaptive' skips the second pass when the best multimask score reaches it
+            agreement_iou: 'adaptive' skips the second pass when the best candidate overlaps every
+                other candidate by at least this IoU
+        """
+        if model_size not in MODEL_NAMES:
+            raise ValueError(f"Unknown model size '{model_size}', expected one of {list(MODEL_NAMES)}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+        if refine not in REFINE_POLICIES:
+            raise ValueError(f"Unknown refinement policy '{refine}', expected one of {REFINE_POLICIES}")
+
+        self.refine = refine
+        self.score_threshold = score_threshold
+        self.agreement_iou = agreement_iou
+
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+
+        if quantize and self.device.type != 'cpu':
+            raise ValueError("Dynamic int8 quantization is only supported on the CPU")
+
+        if precision == 'auto':
+            use_bfloat16 = self.device.type == 'cuda' or cpu_supports_bfloat16()
+            precision = 'bfloat16' if use_bfloat16 and not quantize else 'float32'
+        self.precision = precision
+        self.quantize = quantize
+
+        self.cache = cache
+        self.model = self.load_model(MODEL_NAMES[model_size])
+
+        if quantize:
+            self.model.model = torch.ao.quantization.quantize_dynamic(self.model.model, {torch.nn.Linear}, dtype=torch.qint8)
+        if compile:
+            self.model.model.image_encoder = torch.compile(self.model.model.image_encoder)
+
+        # Embeddings depend on the checkpoint and on how it is executed
+        self.cache_id = f"{self.model_name}:{self.precision}{':int8' if quantize else ''}"
+
     def load_model(self, model_name='facebook/sam2-hiera-large'):
         try:
-            predictor = SAM2ImagePredictor.from_pretrained(model_name)
+            predictor = SAM2ImagePredictor.from_pretrained(model_name, device=self.device)
+            self.model_name = model_name
 
             return predictor
         except Exception as e:
             print(f'Model failed to load\n{e}')
             raise(e)
-    
-    def segment_road(self, image_path, input_points, input_labels):
+
+    def autocast(self):
+        if self.precision == 'float32':
+            return contextlib.nullcontext()
+        return torch.autocast(self.device.type, dtype=torch.bfloat16)
+
+    def export_features(self, index=0):
+        # Copy one image's embedding from the predictor to host memory
+        features = self.model._features
+        return {
+            'image_embed': features['image_embed'][index:index + 1].float().cpu().numpy(),
+            'high_res_feats': [feat[index:index + 1].float().cpu().numpy() for feat in features['high_res_feats']],
+            'orig_hw': np.asarray(self.model._orig_hw[index]),
+        }
+
+    def restore_features(self, entries, is_batch=False):
+        # Load cached embeddings into the predictor, equivalent to calling set_image(_batch) on the original images
+        device = self.model.device
+
+        self.model.reset_predictor()
+        self.model._features = {
+            'image_embed': torch.cat([torch.tensor(entry['image_embed'], device=device) for entry in entries]),
+            'high_res_feats': [torch.cat([torch.tensor(entry['high_res_feats'][level], device=device) for entry in entries])
+                               for level in range(len(entries[0]['high_res_feats']))],
+        }
+        self.model._orig_hw = [tuple(int(x) for x in entry['orig_hw']) for entry in entries]
+        self.model._is_image_set = True
+        self.model._is_batch = is_batch
+
+    def set_image(self, image):
+        """
+        Compute the image embedding, or restore it from the cache when this image was seen before.
+
+        Args:
+            image: RGB image as numpy array
+        """
+        # On CUDA the encoder runs asynchronously, its time then partly shows up in the first sam2.predict
+        if self.cache is None:
+            with metrics.timer('sam2.set_image'), self.autocast():
+                self.model.set_image(image)
+            return
+
+        key = EmbeddingCache.make_key(image, self.cache_id)
+        entry = self.cache.get(key)
+
+        if entry is not None:
+            metrics.increment('sam2.embedding_cache.hits')
+            self.restore_features([entry])
+        else:
+            metrics.increment('sam2.embedding_cache.misses')
+            with metrics.timer('sam2.set_image'), self.autocast():
+                self.model.set_image(image)
+            self.cache.put(key, self.export_features())
+
+    def set_image_batch(self, images):
+        """
+        Compute the embeddings of several images with one pass of the image encoder.
+        Images found in the cache are not encoded again.
+
+        Args:
+            images: List of RGB images as numpy arrays
+        """
+        if self.cache is None:
+            with metrics.timer('sam2.set_image', items=len(images)), self.autocast():
+                self.model.set_image_batch(images)
+            return
+
+        keys = [EmbeddingCache.make_key(image, self.cache_id) for image in images]
+        entries = [self.cache.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        metrics.increment('sam2.embedding_cache.hits', len(images) - len(missing))
+        metrics.increment('sam2.embedding_cache.misses', len(missing))
+
+        if missing:
+            with metrics.timer('sam2.set_image', items=len(missing)), self.autocast():
+                self.model.set_image_batch([images[i] for i in missing])
+
+            for batch_index, i in enumerate(missing):
+                entries[i] = self.export_features(batch_index)
+                self.cache.put(keys[i], entries[i])
+
+            # Nothing was cached, the predictor already holds the whole batch
+            if len(missing) == len(images):
+                return
+
+        self.restore_features(entries, is_batch=True)
+
+    def refinement_path(self, masks, scores):
+        """
+        Decide whether the multimask candidates of a frame need the second, logits-seeded pass.
+
+        Args:
+            masks: Multimask candidates of one frame
+            scores: Predicted IoU of each candidate
+
+        Returns:
+            REFINED when the second pass should run, otherwise the single pass path taken
+        """
+        path = self.choose_refinement_path(masks, scores)
+        metrics.increment(f'sam2.path.{path}')
+        return path
+
+    def choose_refinement_path(self, masks, scores):
+        if self.refine == 'always':
+            return REFINED
+        if self.refine == 'never':
+            return SINGLE_PASS
+
+        best = np.argmax(scores)
+        if scores[best] >= self.score_threshold:
+            return SINGLE_PASS_SCORE
+
+        # Candidates which (nearly) coincide leave nothing for the refinement to resolve
+        if all(mask_iou(masks[best], mask) >= self.agreement_iou for i, mask in enumerate(masks) if i != best):
+            return SINGLE_PASS_AGREEMENT
+
+        return REFINED
+
+    @metrics.timer('sam2.predict')
+    def predict_image(self, img_idx, point_coords, point_labels, mask_input=None, multimask_output=False):
+        # Decode the prompts of one image of the encoded batch, as predict_batch does for each image
+        mask_input, unnorm_coords, labels, unnorm_box = self.model._prep_prompts(
+            np.asarray(point_coords), np.asarray(point_labels), None, mask_input, True, img_idx=img_idx)
+        masks, iou_predictions, low_res_masks = self.model._predict(
+            unnorm_coords, labels, unnorm_box, mask_input, multimask_output, img_idx=img_idx)
+
+        return (masks.squeeze(0).float().detach().cpu().numpy(),
+                iou_predictions.squeeze(0).float().detach().cpu().numpy(),
+                low_res_masks.squeeze(0).float().detach().cpu().numpy())
+
+    def decode_road(self, img_idx, input_points, input_labels, mask_prior=None):
+        """
+        Segment the road in an image which has already been encoded with set_image(_batch).
+
+        Without a mask prior the image is fully prompted, with the multimask pass and the
+        refinement policy of segment_road. With a prior (low resolution logits of the road
+        mask in the previous frame) a single decoder pass seeded with it is run.
+
+        Args:
+            img_idx: Index of the image in the encoded batch, 0 after set_image
+            input_points: Input points of the image
+            input_labels: Labels of the input points
+            mask_prior: Optional 1x256x256 mask logits carried over from the previous frame
+
+        Returns:
+            Tuple of (mask, score, refinement path, 1x256x256 logits of the mask)
+        """
+        with torch.inference_mode(), self.autocast():
+            if mask_prior is not None:
+                masks, scores, logits = self.predict_image(img_idx, input_points, input_labels, mask_input=mask_prior)
+                metrics.increment(f'sam2.path.{PROPAGATED}')
+                return masks[0], scores[0], PROPAGATED, logits[0:1]
+
+            masks, scores, logits = self.predict_image(img_idx, input_points, input_labels, multimask_output=True)
+
+            best = np.argmax(scores)
+            path = self.refinement_path(masks, scores)
+            if path != REFINED:
+                return masks[best], scores[best], path, logits[best:best + 1]
+
+            masks, scores, logits = self.predict_image(img_idx, input_points, input_labels, mask_input=logits[best:best + 1])
+
+            return masks[0], scores[0], path, logits[0:1]
+
+    def segment_road(self, image, input_points, input_labels):
+        """
+        Args:
+            image: Path of the image, or an already decoded RGB image as numpy array
+
+        Returns:
+            Tuple of (mask, score, refinement path)
+        """
         try:
-            image = Image.open(image_path)
-            image = np.array(image.convert('RGB'))
+            if isinstance(image, str):
+                with metrics.timer('frame.decode'):
+                    image = np.array(Image.open(image).convert('RGB'))
 
-            self.model.set_image(image)
+            self.set_image(image)
 
-            with torch.inference_mode(), torch.autocast("cuda", dtype=torch.bfloat16):
+            with torch.inference_mode(), self.autocast():
                 # Generate single prediction based on image
-                masks, scores, logits = self.model.predict(point_coords=input_points, point_labels=input_labels, multimask_output=True)
+                with metrics.timer('sam2.predict'):
+                    masks, scores, logits = self.model.predict(point_coords=input_points, point_labels=input_labels, multimask_output=True)
 
                 sorted_ind = np.argsort(scores)[::-1]
                 masks = masks[sorted_ind]
                 scores = scores[sorted_ind]
                 logits = logits[sorted_ind]
 
+                path = self.refinement_path(masks, scores)
+                if path != REFINED:
+                    return masks[0], scores[0], path
+
                 # Get the model's best mask
                 mask_input = logits[np.argmax(scores), :, :]
 
-                masks, scores, _ = self.model.predict(point_coords=input_points, point_labels=input_labels, mask_input=mask_input[None, :, :], multimask_output=False)
+                with metrics.timer('sam2.predict'):
+                    masks, scores, _ = self.model.predict(point_coords=input_points, point_labels=input_labels, mask_input=mask_input[None, :, :], multimask_output=False)
 
                 sorted_ind = np.argsort(scores)[::-1]
                 masks = masks[sorted_ind]
                 scores = scores[sorted_ind]
 
-            return masks[0], scores[0]
+            return masks[0], scores[0], path
         except Exception as e:
             print(f'Error segmenting road\n{e}')
-            raise(e)
\ No newline at end of file
+            raise(e)
+
+    def segment_road_batch(self, images, input_points_batch, input_labels):
+        """
+        Segment the road in several images, encoding them together and decoding
+        the prompts of all images in one call per refinement pass. Only the images
+        selected by the refinement policy go through the second pass.
+
+        Args:
+            images: List of RGB images as numpy arrays
+            input_points_batch: List of input points, one entry per image
+            input_labels: Labels of the input points, shared by all images
+
+        Returns:
+            List of (mask, score, refinement path) tuples, one per image
+        """
+        try:
+            self.set_image_batch(images)
+
+            input_labels_batch = [input_labels] * len(images)
+
+            with torch.inference_mode(), self.autocast():
+                # Generate predictions for every image
+                with metrics.timer('sam2.predict', items=len(images)):
+                    masks_batch, scores_batch, logits_batch = self.model.predict_batch(point_coords_batch=input_points_batch, point_labels_batch=input_labels_batch, multimask_output=True)
+
+                results = []
+                refine_indices = []
+                for i, (masks, scores) in enumerate(zip(masks_batch, scores_batch)):
+                    best = np.argmax(scores)
+                    path = self.refinement_path(masks, scores)
+                    results.append((masks[best], scores[best], path))
+                    if path == REFINED:
+                        refine_indices.append(i)
+
+                # Second pass seeded with the best mask of each image which needs it
+                mask_input_batch = [logits_batch[i][np.argmax(scores_batch[i])][None, :, :] for i in refine_indices]
+
+                if len(refine_indices) == len(images):
+                    with metrics.timer('sam2.predict', items=len(images)):
+                        refined_batch = self.model.predict_batch(point_coords_batch=input_points_batch, point_labels_batch=input_labels_batch, mask_input_batch=mask_input_batch, multimask_output=False)
+                    refined = zip(*refined_batch[:2])
+                else:
+                    # predict_batch decodes every image of the batch, so the subset is decoded one image at a time
+                    refined = (self.predict_image(i, input_points_batch[i], input_labels, mask_input=mask_input)[:2]
+                               for i, mask_input in zip(refine_indices, mask_input_batch))
+
+                for i, (masks, scores) in zip(refine_indices, refined):
+                    results[i] = (masks[np.argmax(scores)], scores[np.argmax(scores)], REFINED)
+
+            return results
+        except Exception as e:
+            print(f'Error segmenting road batch\n{e}')
+            raise(e)
@@ -1,9 +1,23 @@
 import os
+import sys
 import cv2
 import json
+import argparse
 import numpy as np
-from sam2_model import SAM2Model
+from embedding_cache import EmbeddingCache
+from mask_encoding import DEFAULT_TOLERANCE, MASK_FORMATS, encode_mask, mask_iou
 
+# Decoded frames are shared with the other stages through the frame cache, batches go through the staged pipeline
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from frame_cache import FrameCache, read_frame
+from staged_pipeline import Stage, StagedPipeline
+import metrics
+
+# Largest gap in milliseconds between two frames of one sequence when it can not be measured,
+# above the one second interval of the Sensor Logger camera
+DEFAULT_MAX_GAP_MS = 1500
+
+@metrics.timer('road.mask_to_polygon')
 def convert_mask_to_polygon(binary_mask):
     # Ensure the mask is uint8
     binary_mask = binary_mask.astype(np.uint8)
@@ -55,63 +69,262 @@ def calculate_input_points(image):
 
     return [[road_point_x, road_point_y], [negative_point_x, negative_point_y]]
 
-def process_images(classifications_file, masking_model):
+def get_timestamp(image_name):
+    """
+    Args:
+        image_name: Image file name, frames are named by epoch milliseconds (e.g. 1738856794439.jpg)
+
+    Returns:
+        Timestamp in milliseconds, or None when the name is not a timestamp
+    """
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return int(stem) if stem.isdigit() else None
+
+def process_images(classifications_file, masking_model, batch_size=1, images_dir=None, sequence=False,
+                   mask_format='polygon', tolerance=DEFAULT_TOLERANCE, frame_cache=None, num_workers=2, prefetch=2, selection=None,
+                   **sequence_options):
     """
     Process multiple images based on classifications file
     
     Args:
         classifications_file: Path to JSON file containing image classifications
         masking_model: Initialized SAM2Model instance
+        batch_size: Number of images encoded and decoded together by SAM2
+        images_dir: Directory containing the images, defaults to input/test_images
+        sequence: Treat the images as consecutive frames of a drive and carry the road
+            mask from frame to frame, which saves mask decoder passes but no encoding, see process_sequence
+        mask_format: Segmentation output, one of MASK_FORMATS ('polygon' is the longest contour only,
+            'polygons' every region simplified with tolerance, 'rle' COCO compressed RLE)
+        tolerance: Polygon simplification tolerance in pixels for 'polygons'
+        frame_cache: Optional FrameCache, frames decoded by an earlier stage are not decoded again
+        num_workers: Threads reading frames and encoding masks while SAM2 runs
+        prefetch: Batches read ahead of SAM2, bounds the decoded frames held in memory
+        selection: Optional image names, e.g. from spatial_index.py, other images are skipped
+        sequence_options: Keyword arguments of process_sequence
     """
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask format '{mask_format}', expected one of {MASK_FORMATS}")
+
     # Read classifications file
     with open(classifications_file, 'r') as f:
         classifications = json.load(f)
 
     # Get directory paths
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    images_dir = os.path.join(script_dir, 'input', 'test_images')
-    
-    results = []
+    if images_dir is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        images_dir = os.path.join(script_dir, 'input', 'test_images')
     
+    if selection is not None:
+        selection = set(selection)
+        classifications = [item for item in classifications if item['image'] in selection]
+
+    # Skip classified images which are missing from the images directory
+    items = []
     for item in classifications:
-        image_path = os.path.join(images_dir, item['image'])
-        if not os.path.exists(image_path):
+        if not os.path.exists(os.path.join(images_dir, item['image'])):
             print(f"Warning: Image {item['image']} not found, skipping...")
             continue
+        items.append(item)
+
+    if sequence:
+        return process_sequence(items, images_dir, masking_model, batch_size, mask_format=mask_format, tolerance=tolerance,
+                                frame_cache=frame_cache, num_workers=num_workers, prefetch=prefetch, **sequence_options)
+
+    return process_batches(items, images_dir, masking_model, batch_size, mask_format, tolerance, frame_cache, num_workers, prefetch)
+
+def run_stages(items, images_dir, batch_size, segment, mask_format, tolerance, frame_cache, num_workers, prefetch, ordered=False):
+    """
+    Run the read -> SAM2 -> encode stages over the items, batch_size items at a time.
+    Frames are read and masks encoded by num_workers threads while SAM2 runs, with at most
+    prefetch batches waiting in front of the model.
+
+    Args:
+        segment: Called with (items, images, input_points) of a batch, returns the
+            (mask, score, refinement) of every item
+        ordered: segment is called on the batches in order
+
+    Returns:
+        List of results in item order
+    """
+    def read(batch_items):
+        images = [read_frame(os.path.join(images_dir, item['image']), frame_cache, 'rgb') for item in batch_items]
+        return batch_items, images, [calculate_input_points(image) for image in images]
+
+    def encode(batch):
+        batch_items, segmentations = batch
+        return [create_result(item, mask, confidence_score, refinement, mask_format, tolerance)
+                for item, (mask, confidence_score, refinement) in zip(batch_items, segmentations)]
+
+    pipeline = StagedPipeline([
+        Stage('read', read, workers=num_workers, prefetch=prefetch),
+        # The model is not thread-safe, it always has a single worker
+        Stage('segment', lambda batch: (batch[0], segment(*batch)), prefetch=prefetch, ordered=ordered),
+        Stage('encode', encode, workers=num_workers),
+    ])
+
+    batches = (items[start:start + batch_size] for start in range(0, len(items), batch_size))
+
+    results = []
+    for batch_results in pipeline.run(batches):
+        for result in batch_results:
+            results.append(result)
+            print(f"Processed {result['image']} ({result['refinement']})")
 
-        # Process image
-        image = cv2.imread(image_path)
-        input_points = calculate_input_points(image)
-        mask, confidence_score = masking_model.segment_road(
-            image_path, 
-            input_points=input_points, 
-            input_labels=([1, 0])
-        )
-        
-        segmentation_poly = convert_mask_to_polygon(mask)
-        
-        # Create result object
-        result = {
-            'image': item['image'],
-            'class': item['predicted_class'],
-            'confidence_score': float(confidence_score),
-            'segmentation': segmentation_poly
-        }
-        results.append(result)
-        print(f"Processed {item['image']}")
-    
     return results
 
+def process_batches(items, images_dir, masking_model, batch_size, mask_format='polygon', tolerance=DEFAULT_TOLERANCE, frame_cache=None,
+                    num_workers=2, prefetch=2):
+    """
+    Segment classified images batch_size at a time with SAM2Model.segment_road_batch
+
+    Args:
+        items: Classification entries whose images exist in images_dir
+        images_dir: Directory containing the images
+        masking_model: Initialized SAM2Model instance
+        batch_size: Number of images per batch
+        mask_format: Segmentation output, one of MASK_FORMATS
+        tolerance: Polygon simplification tolerance in pixels for 'polygons'
+        frame_cache: Optional FrameCache to read the frames through
+        num_workers: Threads reading frames and encoding masks
+        prefetch: Batches read ahead of the model
+    """
+    def segment(batch_items, images, input_points_batch):
+        if len(images) == 1:
+            return [masking_model.segment_road(images[0], input_points=input_points_batch[0], input_labels=[1, 0])]
+        return masking_model.segment_road_batch(images, input_points_batch, input_labels=[1, 0])
+
+    return run_stages(items, images_dir, batch_size, segment, mask_format, tolerance, frame_cache, num_workers, prefetch)
+
+def sequence_gap_ms(timestamps):
+    """
+    Largest gap between two frames of one sequence, twice the median frame interval so a dropped
+    frame does not break the sequence but a stop of the recording does.
+
+    Args:
+        timestamps: Frame timestamps in milliseconds, in time order
+
+    Returns:
+        Gap in milliseconds, DEFAULT_MAX_GAP_MS when there are too few frames to measure the interval
+    """
+    intervals = np.diff(np.asarray(timestamps, dtype=np.int64))
+    intervals = intervals[intervals > 0]
+    if not len(intervals):
+        return DEFAULT_MAX_GAP_MS
+    return 2 * float(np.median(intervals))
+
+def process_sequence(items, images_dir, masking_model, batch_size=1, max_gap_ms=None, min_score=0.8, min_iou=0.7, anchor_interval=30,
+                     mask_format='polygon', tolerance=DEFAULT_TOLERANCE, frame_cache=None, num_workers=2, prefetch=2):
+    """
+    Segment the frames of a drive in time order, seeding each frame's decoder with the
+    road mask logits of the previous frame so most frames need a single decoder pass.
+    Every frame is still encoded, only the mask decoder work is saved, so the gain is
+    small when the image encoder dominates the run time.
+
+    A frame is fully prompted again (re-anchored) when it starts the sequence, follows a
+    gap in the timestamps, every anchor_interval frames, and when the propagated mask has
+    a low score or differs too much from the previous mask (scene change or drift).
+
+    Args:
+        items: Classification entries whose images exist in images_dir
+        images_dir: Directory containing the images
+        masking_model: Initialized SAM2Model instance
+        batch_size: Number of frames encoded together by SAM2
+        max_gap_ms: Largest gap between consecutive timestamps which is still one sequence,
+            None derives it from the frame interval of the items, see sequence_gap_ms
+        min_score: Propagated masks scoring lower are re-anchored
+        min_iou: Propagated masks overlapping the previous mask less are re-anchored
+        anchor_interval: Maximum number of frames between two anchors
+        mask_format: Segmentation output, one of MASK_FORMATS
+        tolerance: Polygon simplification tolerance in pixels for 'polygons'
+        frame_cache: Optional FrameCache to read the frames through
+        num_workers: Threads reading frames and encoding masks
+        prefetch: Batches read ahead of the model
+    """
+    items = sorted(items, key=lambda item: (get_timestamp(item['image']) is None, get_timestamp(item['image']) or 0, item['image']))
+
+    if max_gap_ms is None:
+        timestamps = [get_timestamp(item['image']) for item in items]
+        max_gap_ms = sequence_gap_ms([timestamp for timestamp in timestamps if timestamp is not None])
+
+    # Carried from frame to frame, the segment stage sees the batches in time order
+    state = {'prior': None, 'previous_mask': None, 'previous_timestamp': None, 'frames_since_anchor': 0}
+
+    def segment(batch_items, images, input_points_batch):
+        masking_model.set_image_batch(images)
+
+        segmentations = []
+        for i, (item, input_points) in enumerate(zip(batch_items, input_points_batch)):
+            prior = state['prior']
+            timestamp = get_timestamp(item['image'])
+
+            gap = timestamp is None or state['previous_timestamp'] is None or timestamp - state['previous_timestamp'] > max_gap_ms
+            if gap or state['frames_since_anchor'] >= anchor_interval:
+                prior = None
+
+            if prior is not None:
+                mask, confidence_score, refinement, logits = masking_model.decode_road(i, input_points, [1, 0], mask_prior=prior)
+
+                if confidence_score < min_score or mask_iou(mask, state['previous_mask']) < min_iou:
+                    prior = None
+
+            if prior is None:
+                mask, confidence_score, refinement, logits = masking_model.decode_road(i, input_points, [1, 0])
+                state['frames_since_anchor'] = 0
+
+            segmentations.append((mask, confidence_score, refinement))
+
+            state['prior'] = logits
+            state['previous_mask'] = mask
+            state['previous_timestamp'] = timestamp
+            state['frames_since_anchor'] += 1
+
+        return segmentations
+
+    return run_stages(items, images_dir, batch_size, segment, mask_format, tolerance, frame_cache, num_workers, prefetch, ordered=True)
+
+def create_result(item, mask, confidence_score, refinement, mask_format='polygon', tolerance=DEFAULT_TOLERANCE):
+    if mask_format == 'polygon':
+        segmentation = convert_mask_to_polygon(mask)
+    else:
+        with metrics.timer('road.encode_mask', format=mask_format):
+            segmentation = encode_mask(mask, mask_format, tolerance)
+    
+    # Create result object, size is needed to decode polygons back to a mask
+    return {
+        'image': item['image'],
+        'class': item['predicted_class'],
+        'confidence_score': float(confidence_score),
+        'refinement': refinement,
+        'size': list(mask.shape[:2]),
+        'segmentation': segmentation
+    }
+
 if __name__ == '__main__':
-    # Load SAM2 model
-    masking_model = SAM2Model()
+    # Imported here so the segmentation helpers can be used (e.g. with a stub model) without torch and SAM2
+    from sam2_model import SAM2Model, REFINE_POLICIES
+
+    parser = argparse.ArgumentParser(description='Segment the road in the classified test images with SAM2')
+    parser.add_argument('--refine', choices=REFINE_POLICIES, default='always',
+                        help="Second decoder pass policy, 'adaptive' only refines frames whose candidates are uncertain")
+    parser.add_argument('--sequence', action='store_true',
+                        help='Treat the images as consecutive drive frames and carry the road mask from frame to frame')
+    parser.add_argument('--mask-format', choices=MASK_FORMATS, default='polygon',
+                        help="Segmentation output, 'rle' and 'polygons' are compact and decoded with mask_encoding.load_segmentations")
+    args = parser.parse_args()
 
     # Get paths
     script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    # Load SAM2 model, image embeddings are cached so re-prompting a frame skips the image encoder
+    embedding_cache = EmbeddingCache(os.path.join(script_dir, 'cache', 'embeddings'))
+    masking_model = SAM2Model(cache=embedding_cache, refine=args.refine)
+
     classifications_path = os.path.join(script_dir, 'input', 'image_classifications_20250311_105643.json')
     
-    # Process all images
-    results = process_images(classifications_path, masking_model)
+    # Process all images, several frames per SAM2 encoder call
+    frame_cache = FrameCache()
+    results = process_images(classifications_path, masking_model, batch_size=4, sequence=args.sequence, mask_format=args.mask_format,
+                             frame_cache=frame_cache)
 
     # Save results
     output_dir = os.path.join(script_dir, 'output')
@@ -121,7 +334,11 @@ if __name__ == '__main__':
     output_file = f'segmentations_{timestamp}.json'
     output_path = os.path.join(output_dir, output_file)
     
+    # The compact formats are written without whitespace, the polygons as before
     with open(output_path, 'w') as f:
-        json.dump(results, f, indent=2)
+        if args.mask_format == 'polygon':
+            json.dump(results, f, indent=2)
+        else:
+            json.dump(results, f, separators=(',', ':'))
 
     print(f"All segmentations saved to {output_path}")
\ No newline at end of file
@@ -0,0 +1,118 @@
+# Manifest of the pipeline runner: content hashes of the input files and, for every stage,
+# the fingerprint and result of each processed item. Backed by SQLite so a session with
+# tens of thousands of frames is updated row by row instead of rewriting one large file.
+
+import os
+import json
+import sqlite3
+import hashlib
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def hash_values(*values):
+    """
+    Returns:
+        SHA256 hex digest of the JSON serialization of values
+    """
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                sha256 TEXT
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                stage TEXT,
+                item TEXT,
+                fingerprint TEXT,
+                result TEXT,
+                PRIMARY KEY (stage, item)
+            );
+        """)
+
+    def file_hash(self, path):
+        """
+        Content hash of a file. Hashes are cached on (size, mtime) so unchanged files are not read again.
+
+        Args:
+            path: Path of the file
+
+        Returns:
+            SHA256 hex digest of the file content
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+
+        row = self.connection.execute('SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+
+        self.connection.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                                (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()))
+        return digest.hexdigest()
+
+    def file_hashes(self, paths):
+        hashes = {path: self.file_hash(path) for path in paths}
+        self.connection.commit()
+        return hashes
+
+    def fingerprints(self, stage):
+        # Fingerprint of every item recorded for a stage
+        return dict(self.connection.execute('SELECT item, fingerprint FROM items WHERE stage = ?', (stage,)))
+
+    def pending(self, stage, fingerprints):
+        """
+        Args:
+            stage: Stage name
+            fingerprints: Dictionary mapping each current item to its fingerprint
+
+        Returns:
+            Items which are new or whose fingerprint changed since they were processed, in input order
+        """
+        recorded = self.fingerprints(stage)
+        return [item for item, fingerprint in fingerprints.items() if recorded.get(item) != fingerprint]
+
+    def record(self, stage, records):
+        """
+        Store the results of processed items.
+
+        Args:
+            stage: Stage name
+            records: Iterable of (item, fingerprint, result) tuples, result must be JSON serializable
+        """
+        self.connection.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)',
+                                    ((stage, item, fingerprint, json.dumps(result, separators=(',', ':')))
+                                     for item, fingerprint, result in records))
+        self.connection.commit()
+
+    def results(self, stage, items):
+        """
+        Returns:
+            Recorded results of items, in the order of items, skipping items without a result
+        """
+        results = dict(self.connection.execute('SELECT item, result FROM items WHERE stage = ?', (stage,)))
+        return [json.loads(results[item]) for item in items if results.get(item) is not None]
+
+    def prune(self, stage, items):
+        # Forget items which are no longer part of the session
+        current = set(items)
+        removed = [(stage, item) for item in self.fingerprints(stage) if item not in current]
+
+        self.connection.executemany('DELETE FROM items WHERE stage = ? AND item = ?', removed)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
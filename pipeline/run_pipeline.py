@@ -0,0 +1,495 @@
+# Incremental runner for the whole process flow: sync -> geopose -> dedup -> crop -> classify -> road -> objects
+#
+# Every stage records a fingerprint (hash of the stage parameters and of the item's inputs) and the
+# result of each item in the manifest, so a rerun only processes new or changed frames. The stages
+# need different Python environments (TensorFlow, SAM2, Detectron2), so they can be run separately
+# with --stages and pick up the results recorded by earlier runs. --bbox, --radius and --corridor limit
+# the frame stages to the frames taken in an area, e.g. to rerun one road segment. Frames which dedup
+# finds to repeat an earlier frame are skipped by crop, classify and road and get copies of its results.
+
+import os
+import sys
+import json
+import argparse
+from multiprocessing import Pool
+from manifest import Manifest, hash_values
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(script_dir, '..')
+
+sys.path.append(os.path.join(repo_dir, 'common'))
+from frame_cache import FrameCache
+import metrics
+
+STAGES = ('sync', 'geopose', 'dedup', 'crop', 'classify', 'road', 'objects')
+
+# Directory of the scripts each stage uses
+STAGE_DIRS = {
+    'sync': os.path.join(repo_dir, 'preprocessing', 'create_synced_df'),
+    'geopose': os.path.join(repo_dir, 'modules', 'geopose'),
+    'dedup': os.path.join(repo_dir, 'preprocessing', 'dedup_frames'),
+    'crop': os.path.join(repo_dir, 'preprocessing', 'crop_images'),
+    'classify': os.path.join(repo_dir, 'modules', 'classification'),
+    'road': os.path.join(repo_dir, 'modules', 'road_segmentation'),
+    'objects': os.path.join(repo_dir, 'modules', 'object_segmentation'),
+}
+
+# Settings which change how fast a stage runs but not its results, left out of the fingerprints
+EXECUTION_KEYS = ('workers', 'prefetch', 'batch_size', 'chunk_size')
+
+# Synchronization settings which are paths, the runner takes them from the session directory
+SYNC_PATH_KEYS = ('synchronized_df_parentDir', 'location_file_path', 'orientation_file_path', 'image_folder_path')
+
+# Stages which decode the full camera frames and can share them through the frame cache
+FRAME_STAGES = ('crop', 'road', 'objects')
+
+# Stages which skip the duplicates found by dedup. Its hash only covers the road crop, so objects
+# (pedestrians, cross traffic) can change while it matches and the objects stage sees every frame.
+DEDUP_STAGES = ('crop', 'classify', 'road')
+
+# Item key of the stages which process the session as a whole
+SESSION_ITEM = 'session'
+
+def stage_params(config):
+    return {key: value for key, value in config.items() if key not in EXECUTION_KEYS}
+
+def chunks(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+class Session:
+    """
+    Inputs, outputs and manifest of one Sensor Logger session.
+
+    Args:
+        session_dir: Directory with Location.csv, Orientation.csv and Camera/
+        work_dir: Directory the stage outputs and the manifest are written to
+        config: Pipeline configuration, see config.json
+        stages: Stages of this run, the frame cache is only used when several of them decode the frames
+        area: Optional parsed --bbox, --radius and --corridor arguments, the frame stages then only
+            process the frames taken inside the area
+        force: Process frames again even when their results are up to date
+    """
+    def __init__(self, session_dir, work_dir, config, stages=STAGES, area=None, force=False):
+        self.session_dir = session_dir
+        self.work_dir = work_dir
+        self.config = config
+        self.area = area
+        self.force = force
+        self._selection = None
+        self._duplicates = None
+
+        self.location_file = os.path.join(session_dir, 'Location.csv')
+        self.orientation_file = os.path.join(session_dir, 'Orientation.csv')
+        self.camera_dir = os.path.join(session_dir, 'Camera')
+        self.crops_dir = os.path.join(work_dir, 'crops')
+
+        os.makedirs(work_dir, exist_ok=True)
+        self.manifest = Manifest(os.path.join(work_dir, 'manifest.sqlite'))
+
+        self.frames = sorted(f for f in os.listdir(self.camera_dir) if f.lower().endswith('.jpg'))
+        self._frame_hashes = None
+
+        # Frames decoded by the crop workers are shared with the segmentation stages of the same run.
+        # This only applies when one environment has the dependencies of several frame stages, e.g.
+        # crop and road in the SAM2 environment, and the crop stage then decodes full frames instead of ROIs.
+        cache_config = config.get('frame_cache', {})
+        frame_stages = [stage for stage in stages if stage in FRAME_STAGES]
+        if cache_config.get('enabled', True) and len(frame_stages) > 1:
+            self.frame_cache = FrameCache(cache_config.get('max_mb', 1024) * 1024 ** 2, shared=cache_config.get('shared', True))
+        else:
+            self.frame_cache = None
+
+    @property
+    def frame_hashes(self):
+        # Content hash of every camera frame, only frames whose size or mtime changed are read
+        if self._frame_hashes is None:
+            paths = [os.path.join(self.camera_dir, frame) for frame in self.frames]
+            hashes = self.manifest.file_hashes(paths)
+            self._frame_hashes = {frame: hashes[path] for frame, path in zip(self.frames, paths)}
+        return self._frame_hashes
+
+    @property
+    def selection(self):
+        # Frames inside the area, None when every frame is processed. Needs the output of the sync stage.
+        if self.area is None:
+            return None
+
+        if self._selection is None:
+            import_stage('geopose')
+            from spatial_index import SpatialIndex, select_images
+
+            synced = self.manifest.results('sync', [SESSION_ITEM])
+            if not synced:
+                raise RuntimeError('Selecting frames by location needs the output of the sync stage')
+
+            index = SpatialIndex.load(self.output_path(synced[0]['path']))
+            self._selection = set(select_images(index, self.area))
+            print(f'Selected {len(self._selection)} of {len(self.frames)} frames by location')
+
+        return self._selection
+
+    @property
+    def duplicates(self):
+        # {duplicate frame: representative frame} found by the last run of the dedup stage
+        if self._duplicates is None:
+            dedup = self.manifest.results('dedup', [SESSION_ITEM])
+            self._duplicates = {}
+            if dedup:
+                with open(self.output_path(dedup[0]['path']), 'r') as f:
+                    self._duplicates = json.load(f)['duplicates']
+        return self._duplicates
+
+    def select(self, frames, stage):
+        # Frames a frame stage processes: inside the area, if there is one, and not duplicates the stage skips
+        selection = self.selection
+        duplicates = self.duplicates if stage in DEDUP_STAGES else {}
+        return [frame for frame in frames if (selection is None or frame in selection) and frame not in duplicates]
+
+    def pending(self, stage, fingerprints):
+        # Frames of a frame stage to process, results of the other frames are kept as they are
+        pending = list(fingerprints) if self.force else self.manifest.pending(stage, fingerprints)
+        return self.select(pending, stage)
+
+    def results(self, stage, frames):
+        """
+        Returns:
+            Recorded results of the frames in frame order, duplicates get a copy of their representative's result
+        """
+        duplicates = self.duplicates if stage in DEDUP_STAGES else {}
+        sources = [duplicates.get(frame, frame) for frame in frames]
+        recorded = self.manifest.fingerprints(stage)
+        unique_sources = list(dict.fromkeys(source for source in sources if source in recorded))
+        results = dict(zip(unique_sources, self.manifest.results(stage, unique_sources)))
+
+        expanded = []
+        for frame, source in zip(frames, sources):
+            result = results.get(source)
+            if result is None:
+                continue
+            expanded.append(result if frame == source else dict(result, image=frame, representative=source))
+        return expanded
+
+    def output_path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def close(self):
+        if self.frame_cache is not None:
+            # Also removes the frames the crop workers published for the later stages
+            self.frame_cache.unlink_frames(os.path.join(self.camera_dir, frame) for frame in self.frames)
+        self.manifest.close()
+
+def import_stage(stage):
+    # Scripts import their siblings directly, so each stage directory goes on the path
+    sys.path.append(STAGE_DIRS[stage])
+
+def write_json(path, data, compact=False):
+    with open(path, 'w') as f:
+        if compact:
+            json.dump(data, f, separators=(',', ':'))
+        else:
+            json.dump(data, f, indent=2)
+
+def run_sync(session):
+    import_stage('sync')
+    import pandas as pd
+    from create_synchronized_df import build_image_index, synchronize, synchronize_streaming
+    from synced_df_io import SyncedDfWriter, get_synced_df_path
+
+    with open(os.path.join(STAGE_DIRS['sync'], 'config.json'), 'r') as f:
+        config = {key: value for key, value in json.load(f).items() if key not in SYNC_PATH_KEYS}
+
+    input_hashes = session.manifest.file_hashes([session.location_file, session.orientation_file])
+    fingerprint = hash_values(stage_params(config), input_hashes[session.location_file], input_hashes[session.orientation_file], session.frames)
+
+    output_path = get_synced_df_path(session.work_dir, config.get('output_format', 'csv'))
+
+    if not session.manifest.pending('sync', {SESSION_ITEM: fingerprint}) and os.path.exists(output_path):
+        print('sync: up to date')
+        return
+
+    # The sensor streams are joined as a whole, which is vectorized and cheap next to the model stages
+    image_df = build_image_index(session.frames)
+
+    if config.get('streaming', False):
+        synchronize_streaming(session.location_file, session.orientation_file, image_df, config, output_path)
+    else:
+        synced_df = synchronize(pd.read_csv(session.location_file), pd.read_csv(session.orientation_file), image_df, config)
+        with SyncedDfWriter(output_path) as writer:
+            writer.write(synced_df)
+
+    session.manifest.record('sync', [(SESSION_ITEM, fingerprint, {'path': os.path.basename(output_path)})])
+    print(f'sync: synchronized dataframe saved to {output_path}')
+
+def run_geopose(session):
+    import_stage('geopose')
+    from create_geopose import GEOPOSE_COLUMNS, write_geopose
+    from synced_df_io import read_synced_df
+
+    synced = session.manifest.results('sync', [SESSION_ITEM])
+    if not synced:
+        raise RuntimeError('geopose needs the output of the sync stage')
+
+    synced_df_path = session.output_path(synced[0]['path'])
+    fingerprint = hash_values(session.manifest.file_hash(synced_df_path))
+    geopose_path = session.output_path('geopose_file.json')
+
+    if not session.manifest.pending('geopose', {SESSION_ITEM: fingerprint}) and os.path.exists(geopose_path):
+        print('geopose: up to date')
+        return
+
+    write_geopose(read_synced_df(synced_df_path, columns=GEOPOSE_COLUMNS), geopose_path)
+
+    session.manifest.record('geopose', [(SESSION_ITEM, fingerprint, {'path': os.path.basename(geopose_path)})])
+    print(f'geopose: GeoPose file saved to {geopose_path}')
+
+def run_dedup(session):
+    import_stage('dedup')
+    from dedup_frames import DEDUP_COLUMNS, find_duplicates
+    from synced_df_io import read_synced_df
+
+    config = session.config['dedup']
+
+    synced = session.manifest.results('sync', [SESSION_ITEM])
+    if not synced:
+        raise RuntimeError('dedup needs the output of the sync stage')
+
+    synced_df_path = session.output_path(synced[0]['path'])
+    crop_size = tuple(session.config['crop']['crop_size'])
+    fingerprint = hash_values(stage_params(config), crop_size, session.manifest.file_hash(synced_df_path), session.frame_hashes)
+    output_path = session.output_path('frame_selection.json')
+
+    if not session.manifest.pending('dedup', {SESSION_ITEM: fingerprint}) and os.path.exists(output_path):
+        print('dedup: up to date')
+        return
+
+    duplicates = {}
+    if config.get('enabled', True):
+        duplicates = find_duplicates(read_synced_df(synced_df_path, columns=DEDUP_COLUMNS), session.camera_dir, session.frames,
+                                     config['min_displacement'], config['max_hash_distance'], config['max_run'], crop_size)
+
+    write_json(output_path, {'duplicates': duplicates})
+    session._duplicates = duplicates
+
+    session.manifest.record('dedup', [(SESSION_ITEM, fingerprint, {'path': os.path.basename(output_path)})])
+    print(f'dedup: {len(duplicates)} of {len(session.frames)} frames are duplicates, frame selection saved to {output_path}')
+
+def run_crop(session):
+    import_stage('crop')
+    from crop_images import DECODE_STRATEGIES, init_worker, process_files
+
+    config = session.config['crop']
+    if config['decode'] not in DECODE_STRATEGIES:
+        raise ValueError(f"Unknown decode strategy '{config['decode']}', expected one of {DECODE_STRATEGIES}")
+
+    params = stage_params(config)
+    fingerprints = {frame: hash_values(params, frame_hash) for frame, frame_hash in session.frame_hashes.items()}
+
+    # Crops deleted from the work directory are made again
+    pending = session.pending('crop', fingerprints)
+    pending_set = set(pending)
+    pending += session.select([frame for frame in session.frames
+                               if frame not in pending_set and not os.path.exists(os.path.join(session.crops_dir, frame))], 'crop')
+
+    print(f'crop: {len(pending)} of {len(session.frames)} frames to crop')
+    os.makedirs(session.crops_dir, exist_ok=True)
+
+    crop_size = tuple(config['crop_size'])
+    workers = config.get('workers') or os.cpu_count()
+
+    # Every worker keeps its own part of the cache, the frames are published to shared memory
+    frame_cache = session.frame_cache
+    if frame_cache is not None:
+        frame_cache = FrameCache(frame_cache.max_bytes // workers, frame_cache.shared, frame_cache.namespace)
+
+    tasks = [(os.path.join(session.camera_dir, frame), os.path.join(session.crops_dir, frame), crop_size, config['decode'], frame_cache)
+             for frame in pending]
+
+    if tasks:
+        with Pool(workers, initializer=init_worker) as pool:
+            for chunk in chunks(tasks, 1024):
+                # Every worker returns the timers and counters of its part, merged into the snapshot of this run
+                task_size = max(1, len(chunk) // (workers * 4))
+                outcomes = []
+                for chunk_outcomes, worker_metrics in pool.map(process_files, list(chunks(chunk, task_size))):
+                    metrics.registry.merge(worker_metrics)
+                    outcomes.extend(chunk_outcomes)
+
+                cropped = [os.path.basename(input_path) for input_path, ok in outcomes if ok]
+
+                # Failed frames are not recorded and retried on the next run
+                session.manifest.record('crop', [(frame, fingerprints[frame], {'crop': frame}) for frame in cropped])
+
+    session.manifest.prune('crop', session.frames)
+
+def run_classify(session):
+    import_stage('classify')
+    import classify_images
+
+    config = session.config['classify']
+
+    # Predictions depend on the backend 'auto' resolves to on this machine, not on the setting
+    backend, quantization = classify_images.resolve_backend(config['backend'], config['quantization'])
+    params = dict(stage_params(config), backend=backend, quantization=quantization)
+
+    crop_fingerprints = session.manifest.fingerprints('crop')
+    frames = [frame for frame in session.frames if frame in crop_fingerprints]
+    fingerprints = {frame: hash_values(params, crop_fingerprints[frame]) for frame in frames}
+
+    pending = session.pending('classify', fingerprints)
+    print(f'classify: {len(pending)} of {len(frames)} frames to classify')
+
+    # The model is only loaded when there is something to classify
+    if pending:
+        classify_images.get_model(config['backend'], config['quantization'])
+
+    for chunk in chunks(pending, config['chunk_size']):
+        paths = [os.path.join(session.crops_dir, frame) for frame in chunk]
+        classifications = classify_images.classify_paths(paths, chunk, config['batch_size'], config.get('workers'),
+                                                         config.get('prefetch', classify_images.DEFAULT_PREFETCH))
+        session.manifest.record('classify', [(frame, fingerprints[frame], classification)
+                                             for frame, classification in zip(chunk, classifications)])
+
+    session.manifest.prune('classify', frames)
+
+    output_path = session.output_path('classifications.json')
+    write_json(output_path, session.results('classify', session.frames))
+    print(f'classify: classifications saved to {output_path}')
+
+def run_road(session):
+    import_stage('road')
+    from sam2_model import SAM2Model
+    from embedding_cache import EmbeddingCache
+    from segment_road import process_batches, process_sequence
+
+    config = session.config['road']
+    params = stage_params(config)
+
+    classify_fingerprints = session.manifest.fingerprints('classify')
+    frames = [frame for frame in session.frames if frame in classify_fingerprints]
+    fingerprints = {frame: hash_values(params, session.frame_hashes[frame], classify_fingerprints[frame]) for frame in frames}
+
+    pending = session.pending('road', fingerprints)
+    print(f'road: {len(pending)} of {len(frames)} frames to segment')
+
+    if pending:
+        embedding_cache = EmbeddingCache(os.path.join(session.work_dir, 'cache', 'embeddings'))
+        masking_model = SAM2Model(cache=embedding_cache, model_size=config['model_size'], refine=config['refine'])
+
+        classifications = dict(zip(pending, session.manifest.results('classify', pending)))
+
+        for chunk in chunks(pending, config['chunk_size']):
+            items = [classifications[frame] for frame in chunk]
+
+            if config['sequence']:
+                results = process_sequence(items, session.camera_dir, masking_model, config['batch_size'],
+                                           max_gap_ms=config.get('max_gap_ms'),
+                                           mask_format=config['mask_format'], tolerance=config['tolerance'],
+                                           frame_cache=session.frame_cache, num_workers=config['workers'],
+                                           prefetch=config['prefetch'])
+            else:
+                results = process_batches(items, session.camera_dir, masking_model, config['batch_size'],
+                                          config['mask_format'], config['tolerance'], session.frame_cache,
+                                          config['workers'], config['prefetch'])
+
+            session.manifest.record('road', [(result['image'], fingerprints[result['image']], result) for result in results])
+
+    session.manifest.prune('road', frames)
+
+    output_path = session.output_path('road_segmentations.json')
+    write_json(output_path, session.results('road', session.frames), compact=True)
+    print(f'road: segmentations saved to {output_path}')
+
+def run_objects(session):
+    import_stage('objects')
+    from object_segmenter import ObjectSegmenter
+    from segment_objects import read_images, segment_stream
+
+    config = session.config['objects']
+    params = stage_params(config)
+
+    fingerprints = {frame: hash_values(params, frame_hash) for frame, frame_hash in session.frame_hashes.items()}
+
+    pending = session.pending('objects', fingerprints)
+    print(f'objects: {len(pending)} of {len(session.frames)} frames to segment')
+
+    if pending:
+        segmenter = ObjectSegmenter(score_threshold=config['score_threshold'], min_size=config['min_size'])
+
+        for chunk in chunks(pending, config['chunk_size']):
+            paths = [os.path.join(session.camera_dir, frame) for frame in chunk]
+
+            records = []
+            for image_path, image, instances in segment_stream(segmenter, read_images(paths, frame_cache=session.frame_cache), config['batch_size']):
+                frame = os.path.basename(image_path)
+                result = {
+                    'image': frame,
+                    'size': list(image.shape[:2]),
+                    'instances': segmenter.format_instances(instances, config['mask_format'])
+                }
+                records.append((frame, fingerprints[frame], result))
+
+            session.manifest.record('objects', records)
+
+    session.manifest.prune('objects', session.frames)
+
+    output_path = session.output_path('object_segmentations.json')
+    write_json(output_path, session.results('objects', session.frames), compact=True)
+    print(f'objects: segmentations saved to {output_path}')
+
+STAGE_RUNNERS = {
+    'sync': run_sync,
+    'geopose': run_geopose,
+    'dedup': run_dedup,
+    'crop': run_crop,
+    'classify': run_classify,
+    'road': run_road,
+    'objects': run_objects,
+}
+
+def main():
+    import_stage('geopose')
+    from spatial_index import add_selection_arguments
+
+    parser = argparse.ArgumentParser(description='Run the processing pipeline on a Sensor Logger session, only processing new or changed frames')
+    parser.add_argument('session_dir', help='Directory with Location.csv, Orientation.csv and Camera/')
+    parser.add_argument('--work-dir', help='Output directory, defaults to <session_dir>/pipeline_output')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f'Comma separated stages to run, from {",".join(STAGES)}')
+    parser.add_argument('--config', default=os.path.join(script_dir, 'config.json'))
+    parser.add_argument('--force', action='store_true', help='Process the (selected) frames again even when they are up to date')
+    add_selection_arguments(parser)
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f'Unknown stages {unknown}, expected any of {STAGES}')
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+
+    area = args if any(value is not None for value in (args.bbox, args.radius, args.corridor)) else None
+
+    session = Session(args.session_dir, args.work_dir or os.path.join(args.session_dir, 'pipeline_output'), config, stages,
+                      area, args.force)
+
+    # Trace of the timed blocks and a Prometheus snapshot of this run, unless DT_METRICS_DIR already set them up
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('enabled', True) and not os.environ.get(metrics.METRICS_DIR_ENV):
+        trace_path, prometheus_path = metrics.configure(os.path.join(session.work_dir, 'metrics'), '_'.join(stages))
+        print(f'Writing metrics trace to {trace_path}')
+
+    try:
+        # Stages always run in pipeline order
+        for stage in STAGES:
+            if stage in stages:
+                with metrics.timer(f'pipeline.{stage}'):
+                    STAGE_RUNNERS[stage](session)
+    finally:
+        session.close()
+
+    if metrics_config.get('report', True):
+        metrics.registry.report()
+
+if __name__ == '__main__':
+    main()
@@ -2,152 +2,266 @@
 
 # Import relevant packages
 import pandas as pd
+import numpy as np
 import os
+import sys
 import json
 import datetime
+from dateutil import tz
+from synced_df_io import SyncedDfWriter, get_synced_df_path
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+import metrics
 
 # Get the directory of the script
 curr_directory = os.path.dirname(__file__)
 
-# 1. Load configuration file
-config_file = os.path.join(curr_directory, 'config.json')
-with open(config_file, 'r') as f:
-    config = json.load(f)
+# GPS epoch (January 6, 1980)
+GPS_EPOCH = datetime.datetime(1980, 1, 6, 0, 0, 0)
+
+# Current leap second difference between GPS and UTC (there is a 18-second difference)
+LEAP_SECONDS = 18
 
-# 2. Import raw data files
-location_file = os.path.join(curr_directory, config['location_file_path'])
-orientation_file = os.path.join(curr_directory, config['orientation_file_path'])
-image_folder = os.path.join(curr_directory, config['image_folder_path'])
+NS_PER_SECOND = 1_000_000_000
+NS_PER_MS = 1_000_000
 
-# 3. Perform conversions and merges
+# Narrow dtypes used when streaming Sensor Logger CSVs, other columns are read as float64
+STREAM_DTYPES = {
+    'time': np.int64,
+    'qx': np.float32,
+    'qy': np.float32,
+    'qz': np.float32,
+    'qw': np.float32,
+}
 
-# Load csv data into dataframes
-location_df = pd.read_csv(location_file)
-orientation_df = pd.read_csv(orientation_file)
+DEFAULT_CHUNK_SIZE = 200_000
 
-# Function to convert UTC time to GPS time
-def utc_to_gps(utc_time):
+def add_time_columns(df):
     """
-    :param utc_time: A datetime object representing UTC time.
-    :return: A datetime object representing GPS time.
+    Add date, time and gps_time columns derived from the epoch nanosecond 'timestamp' column.
+
+    Timestamps are truncated to whole seconds and expressed in the local timezone,
+    matching the per-row datetime.fromtimestamp conversion this replaces.
+
+    :param df: A dataframe with an int64 'timestamp' column in epoch nanoseconds.
+    :return: The dataframe with the added columns.
     """
+    seconds = df['timestamp'].to_numpy(dtype=np.int64) // NS_PER_SECOND
 
-    # GPS epoch (January 6, 1980)
-    GPS_EPOCH = datetime.datetime(1980, 1, 6, 0, 0, 0)
-
-    # Current leap second difference between GPS and UTC (there is a 18-second difference)
-    LEAP_SECONDS = 18
-
-    # Calculate the difference between UTC and GPS epoch
-    delta = utc_time - GPS_EPOCH
-
-    # Subtract leap seconds to get GPS time
-    gps_time = delta.total_seconds() + LEAP_SECONDS
-
-    return int(gps_time)
-
-# Function which converts epoch time (in nanoseconds) into gps time
-def epoch_ns_to_utc(epoch_ns):
-    epoch = str(epoch_ns)
-    epoch = epoch[:10]
-    epoch = int(epoch)
-    return datetime.datetime.fromtimestamp(epoch).strftime('%Y-%m-%d'), datetime.datetime.fromtimestamp(epoch).strftime('%H:%M:%S')
-
-def utc_to_gps_time(row):
-    # Combine the date and time into a datetime object
-    utc_datetime = datetime.datetime.strptime(f"{row['date']} {row['time']}", '%Y-%m-%d %H:%M:%S')
-
-    # Convert to GPS time using the utc_to_gps function
-    gps_time = utc_to_gps(utc_datetime)
-
-    return gps_time
-
-# Rename time column to timestamp
-location_df.rename(columns={'time': 'timestamp'}, inplace=True)
-orientation_df.rename(columns={'time': 'timestamp'}, inplace=True)
-
-# Create date and time columns
-location_df[['date', 'time']] = location_df['timestamp'].apply(lambda x: pd.Series(epoch_ns_to_utc(x)))
-orientation_df[['date', 'time']] = orientation_df['timestamp'].apply(lambda x: pd.Series(epoch_ns_to_utc(x)))
-
-# Merge location and orientation dataframes
-loc_ori_merged_df = pd.merge(location_df, orientation_df, on=['date', 'time'], how='inner')
-loc_ori_merged_df = loc_ori_merged_df.dropna()
-
-loc_ori_merged_df['gps_time'] = loc_ori_merged_df.apply(utc_to_gps_time, axis=1)
-
-# Move 'GPS Time' to the first column
-cols = loc_ori_merged_df.columns.tolist()
-
-# Remove 'GPS Time' from its original position and insert it at the first position
-cols.insert(0, cols.pop(cols.index('gps_time')))
-
-# Reorder the DataFrame using the updated column order
-loc_ori_merged_df = loc_ori_merged_df[cols]
-
-# Get list of image names
-image_names = os.listdir(image_folder)
-
-# Create a dictionary to map GPS times to image names
-image_gps_times = {}
-for image_name in image_names:
-    if image_name.endswith('.jpg'):
-        # Extract epoch time from image name (remove .jpg extension)
-        epoch_time_str = image_name.split('.')[0]
-        try:
-            # Convert to integer and then to GPS time
-            epoch_time = int(epoch_time_str)
-            # Convert milliseconds to nanoseconds for the epoch_ns_to_gps_time function
-            epoch_ns = epoch_time * 1000000  # Convert milliseconds to nanoseconds
-            img_date, img_time = epoch_ns_to_utc(epoch_ns)
-
-            sim_row = {
-                'date': img_date,
-                'time': img_time,
-            }
-
-            image_gps_time = utc_to_gps_time(sim_row)
-            image_gps_times[image_gps_time] = image_name
-        except ValueError:
-            print(f"Could not convert image name {image_name} to GPS time")
-
-# Function to find the closest GPS time match for each row
-def find_closest_image(row_gps_time, image_gps_times_dict):
-    if not image_gps_times_dict:
-        return None
-    
-    # Find the closest GPS time
-    closest_gps_time = min(image_gps_times_dict.keys(), key=lambda x: abs(x - row_gps_time))
-    
-    # Only return a match if it's within a reasonable time difference (e.g., 1 second)
-    # Adjust this threshold as needed based on your data collection frequency
-    if abs(closest_gps_time - row_gps_time) <= 1:  # 1 second threshold
-        return image_gps_times_dict[closest_gps_time]
-    else:
-        return None
+    local_time = pd.to_datetime(seconds, unit='s', utc=True).tz_convert(tz.tzlocal()).tz_localize(None)
+
+    df['date'] = local_time.strftime('%Y-%m-%d')
+    df['time'] = local_time.strftime('%H:%M:%S')
+    df['gps_time'] = (local_time - pd.Timestamp(GPS_EPOCH)) // pd.Timedelta(seconds=1) + LEAP_SECONDS
+
+    return df
+
+def build_image_index(image_names):
+    """
+    Parse Sensor Logger camera file names (epoch milliseconds) into a sorted dataframe.
 
-# 4. Create synchronized dataframe
-# Add the image column to the location-orientation dataframe
-loc_ori_merged_df['image'] = loc_ori_merged_df['gps_time'].apply(
-    lambda x: find_closest_image(x, image_gps_times)
-)
+    :param image_names: A list of image file names.
+    :return: A dataframe with int64 'timestamp' (epoch nanoseconds) and 'image' columns.
+    """
+    timestamps = []
+    images = []
+
+    for image_name in image_names:
+        if image_name.endswith('.jpg'):
+            # Extract epoch time from image name (remove .jpg extension)
+            epoch_time_str = image_name.split('.')[0]
+            try:
+                # Convert milliseconds to nanoseconds
+                timestamps.append(int(epoch_time_str) * NS_PER_MS)
+                images.append(image_name)
+            except ValueError:
+                print(f"Could not convert image name {image_name} to GPS time")
+
+    image_df = pd.DataFrame({'timestamp': np.array(timestamps, dtype=np.int64), 'image': images})
+
+    return image_df.sort_values('timestamp', ignore_index=True)
+
+def join_sensor_frames(location_df, orientation_df, image_df, config):
+    """
+    Join location, orientation and camera frames on their nanosecond timestamps.
+
+    Each location row is matched to the nearest orientation row and the nearest
+    image using sorted as-of joins, within the tolerances set in the config.
+
+    :param location_df: Sensor Logger Location.csv dataframe.
+    :param orientation_df: Sensor Logger Orientation.csv dataframe.
+    :param image_df: Image index created by build_image_index.
+    :param config: The parsed config.json.
+    :return: The joined dataframe with the columns in config['column_names'].
+    """
+    orientation_tolerance = int(config['orientation_tolerance_ms']) * NS_PER_MS
+    image_tolerance = int(config['image_tolerance_ms']) * NS_PER_MS
 
-fully_merged_df = loc_ori_merged_df.copy()
+    # Rename time column to timestamp
+    location_df = location_df.rename(columns={'time': 'timestamp'})
+    orientation_df = orientation_df.rename(columns={'time': 'timestamp'})
 
-# Drop all columns except those defined in config["column_names"]
-fully_merged_df = fully_merged_df[config['column_names']]
+    location_df['timestamp'] = location_df['timestamp'].astype(np.int64)
+    orientation_df['timestamp'] = orientation_df['timestamp'].astype(np.int64)
 
-# Remove duplicates to ensure images only appear once
-fully_merged_df = fully_merged_df.drop_duplicates(subset=['image'])
+    location_df = location_df.sort_values('timestamp', ignore_index=True)
+    orientation_df = orientation_df.sort_values('timestamp', ignore_index=True)
 
-# Create synchronized output directory if it doesn't exist
-synced_df_output_dir = os.path.join(curr_directory, config['synchronized_df_parentDir'])
+    # Merge location and orientation dataframes
+    with metrics.timer('sync.merge_orientation', items=len(location_df)):
+        loc_ori_merged_df = pd.merge_asof(location_df, orientation_df, on='timestamp',
+                                          direction='nearest', tolerance=orientation_tolerance)
+        loc_ori_merged_df = loc_ori_merged_df.dropna()
+
+    # Add the image column to the location-orientation dataframe
+    with metrics.timer('sync.merge_image', items=len(loc_ori_merged_df)):
+        fully_merged_df = pd.merge_asof(loc_ori_merged_df, image_df, on='timestamp',
+                                        direction='nearest', tolerance=image_tolerance)
+
+    with metrics.timer('sync.time_columns', items=len(fully_merged_df)):
+        fully_merged_df = add_time_columns(fully_merged_df)
+
+    # Drop all columns except those defined in config["column_names"]
+    return fully_merged_df[config['column_names']]
+
+def synchronize(location_df, orientation_df, image_df, config):
+    """
+    Create the synchronized dataframe from fully loaded Sensor Logger data.
+
+    :param location_df: Sensor Logger Location.csv dataframe.
+    :param orientation_df: Sensor Logger Orientation.csv dataframe.
+    :param image_df: Image index created by build_image_index.
+    :param config: The parsed config.json.
+    :return: The synchronized dataframe.
+    """
+    fully_merged_df = join_sensor_frames(location_df, orientation_df, image_df, config)
+
+    # Remove duplicates to ensure images only appear once
+    return fully_merged_df.drop_duplicates(subset=['image'])
+
+def read_csv_chunks(csv_file, column_names, chunk_size):
+    """
+    Read a Sensor Logger CSV in chunks, keeping only the raw 'time' column and the
+    columns needed for the synchronized dataframe, with narrow dtypes.
+
+    :param csv_file: Path to the CSV file.
+    :param column_names: The config['column_names'] list.
+    :param chunk_size: Number of rows per chunk.
+    :return: An iterator of dataframes.
+    """
+    header = pd.read_csv(csv_file, nrows=0).columns
+    usecols = [c for c in header if c == 'time' or c in column_names]
+    dtype = {c: STREAM_DTYPES.get(c, np.float64) for c in usecols}
+
+    return pd.read_csv(csv_file, usecols=usecols, dtype=dtype, chunksize=chunk_size)
+
+def synchronize_streaming(location_file, orientation_file, image_df, config, output_path):
+    """
+    Create the synchronized dataframe while streaming both CSVs in time-ordered chunks.
+
+    Orientation rows are kept in a window which only reaches back one tolerance
+    before the current location chunk, so peak memory does not grow with the
+    length of the session. Results are appended to output_path chunk by chunk.
+
+    :param location_file: Path to Location.csv.
+    :param orientation_file: Path to Orientation.csv.
+    :param image_df: Image index created by build_image_index.
+    :param config: The parsed config.json.
+    :param output_path: Path of the .csv, .parquet or .arrow file to write.
+    :return: Number of rows written.
+    """
+    chunk_size = int(config.get('chunk_size', DEFAULT_CHUNK_SIZE))
+    orientation_tolerance = int(config['orientation_tolerance_ms']) * NS_PER_MS
+
+    location_chunks = read_csv_chunks(location_file, config['column_names'], chunk_size)
+    orientation_chunks = read_csv_chunks(orientation_file, config['column_names'], chunk_size)
+
+    orientation_window = next(orientation_chunks, None)
+    orientation_done = orientation_window is None
+    if orientation_done:
+        orientation_window = pd.read_csv(orientation_file, nrows=0)
+
+    previous_end = None
+    seen_images = set()
+    seen_no_image = False
+
+    with SyncedDfWriter(output_path) as writer:
+        for location_chunk in location_chunks:
+            location_chunk = location_chunk.sort_values('time', ignore_index=True)
+            chunk_start = location_chunk['time'].iloc[0]
+            chunk_end = location_chunk['time'].iloc[-1]
+
+            if previous_end is not None and chunk_start < previous_end:
+                raise ValueError(f"{location_file} is not time ordered, streaming mode requires time-ordered CSVs")
+            previous_end = chunk_end
+
+            # Read ahead until the window covers every orientation row this chunk can match
+            while not orientation_done and (orientation_window.empty or
+                                            orientation_window['time'].iloc[-1] <= chunk_end + orientation_tolerance):
+                orientation_chunk = next(orientation_chunks, None)
+                if orientation_chunk is None:
+                    orientation_done = True
+                else:
+                    orientation_window = pd.concat([orientation_window, orientation_chunk], ignore_index=True)
+
+            # Bounded look-behind, older rows can not be matched by this or any later chunk
+            orientation_window = orientation_window[orientation_window['time'] >= chunk_start - orientation_tolerance]
+
+            merged_chunk = join_sensor_frames(location_chunk, orientation_window, image_df, config)
+
+            # Remove duplicates to ensure images only appear once, across chunks as well
+            merged_chunk = merged_chunk.drop_duplicates(subset=['image'])
+            no_image = merged_chunk['image'].isna()
+            keep = ~merged_chunk['image'].isin(seen_images)
+            if seen_no_image:
+                keep &= ~no_image
+
+            seen_no_image = seen_no_image or bool(no_image.any())
+            merged_chunk = merged_chunk[keep]
+            seen_images.update(merged_chunk['image'].dropna())
+
+            with metrics.timer('sync.write', items=len(merged_chunk)):
+                writer.write(merged_chunk)
+
+    return writer.rows_written
+
+def main():
+    # 1. Load configuration file
+    config_file = os.path.join(curr_directory, 'config.json')
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+
+    # 2. Import raw data files
+    location_file = os.path.join(curr_directory, config['location_file_path'])
+    orientation_file = os.path.join(curr_directory, config['orientation_file_path'])
+    image_folder = os.path.join(curr_directory, config['image_folder_path'])
+
+    # Get list of image names
+    image_df = build_image_index(os.listdir(image_folder))
+
+    # Create synchronized output directory if it doesn't exist
+    synced_df_output_dir = os.path.join(curr_directory, config['synchronized_df_parentDir'])
+
+    os.makedirs(synced_df_output_dir, exist_ok=True)
+
+    synced_df_output_path = get_synced_df_path(synced_df_output_dir, config.get('output_format', 'csv'))
+
+    # 3. Perform conversions and merges, then 4. save synchronized dataframe
+    if config.get('streaming', False):
+        # Long sessions: read, join and write in chunks with constant memory
+        synchronize_streaming(location_file, orientation_file, image_df, config, synced_df_output_path)
+    else:
+        # Load csv data into dataframes
+        with metrics.timer('sync.read_csv'):
+            location_df = pd.read_csv(location_file)
+            orientation_df = pd.read_csv(orientation_file)
 
-os.makedirs(synced_df_output_dir, exist_ok=True)
+        fully_merged_df = synchronize(location_df, orientation_df, image_df, config)
 
-# 5. Save synchronized dataframe to CSV
-synced_df_output_path = os.path.join(synced_df_output_dir, 'synchronized_df.csv')
-fully_merged_df.to_csv(synced_df_output_path, index=False)
+        with metrics.timer('sync.write', items=len(fully_merged_df)), SyncedDfWriter(synced_df_output_path) as writer:
+            writer.write(fully_merged_df)
 
-print(f"Synchronized dataframe saved to {synced_df_output_path}")
+    print(f"Synchronized dataframe saved to {synced_df_output_path}")
 
+if __name__ == '__main__':
+    main()
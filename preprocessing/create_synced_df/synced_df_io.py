@@ -0,0 +1,115 @@
+# Readers and writers for the synchronized dataframe in CSV, Parquet or Arrow IPC format
+
+import os
+import pandas as pd
+
+# 'arrow' is uncompressed Arrow IPC so it can be memory-mapped without a copy,
+# 'parquet' is compressed and smallest on disk
+OUTPUT_FORMATS = ('csv', 'parquet', 'arrow')
+FILE_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+PARQUET_COMPRESSION = 'zstd'
+
+SYNCED_DF_NAME = 'synchronized_df'
+
+def get_synced_df_path(directory, output_format='csv'):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+
+    return os.path.join(directory, SYNCED_DF_NAME + FILE_EXTENSIONS[output_format])
+
+def find_synced_df(directory):
+    """
+    Find the synchronized dataframe in a directory, the most recently written one when a
+    session was synchronized in several formats.
+
+    Args:
+        directory: Directory to search
+
+    Returns:
+        Path to the synchronized dataframe file
+    """
+    paths = [get_synced_df_path(directory, output_format) for output_format in OUTPUT_FORMATS]
+    paths = [path for path in paths if os.path.exists(path)]
+
+    if not paths:
+        raise FileNotFoundError(f"No {SYNCED_DF_NAME} file found in {directory}")
+
+    # A file left over from an earlier run in another format is older than the current one
+    return max(paths, key=os.path.getmtime)
+
+def read_synced_df(path, columns=None, memory_map=True):
+    """
+    Load a synchronized dataframe written in any of the supported formats.
+
+    Args:
+        path: Path to a .csv, .parquet or .arrow file
+        columns: Optional list of columns to load, other columns are never read
+        memory_map: Memory-map Parquet and Arrow files instead of reading them into a buffer
+
+    Returns:
+        pandas DataFrame
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == FILE_EXTENSIONS['parquet']:
+        return pd.read_parquet(path, columns=columns, engine='pyarrow', memory_map=memory_map)
+
+    if extension == FILE_EXTENSIONS['arrow']:
+        import pyarrow.feather as feather
+        return feather.read_table(path, columns=columns, memory_map=memory_map).to_pandas()
+
+    # round_trip keeps the exact float values written by to_csv
+    return pd.read_csv(path, usecols=columns, float_precision='round_trip')
+
+class SyncedDfWriter:
+    """
+    Writes the synchronized dataframe in one go or chunk by chunk (streaming mode).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.output_format = next((f for f, ext in FILE_EXTENSIONS.items() if path.endswith(ext)), 'csv')
+        self.rows_written = 0
+        self._writer = None
+        self._schema = None
+
+    def _to_table(self, df):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        if self._schema is None:
+            # Columns which are entirely empty in the first chunk (e.g. image) are strings
+            self._schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                      for f in table.schema])
+
+        return table.cast(self._schema)
+
+    def write(self, df):
+        if self.output_format == 'csv':
+            df.to_csv(self.path, mode='w' if self.rows_written == 0 else 'a', header=self.rows_written == 0, index=False)
+        else:
+            table = self._to_table(df)
+
+            if self._writer is None:
+                if self.output_format == 'parquet':
+                    import pyarrow.parquet as pq
+                    self._writer = pq.ParquetWriter(self.path, self._schema, compression=PARQUET_COMPRESSION)
+                else:
+                    import pyarrow as pa
+                    self._writer = pa.ipc.new_file(self.path, self._schema)
+
+            self._writer.write_table(table)
+
+        self.rows_written += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
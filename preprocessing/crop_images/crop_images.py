@@ -2,24 +2,49 @@
 # A script which crops images for classification
 
 import os
+import sys
 import cv2
 import numpy as np
+from multiprocessing import Pool
+from PIL import Image
 from tqdm import tqdm
 
-def crop_image(image, crop_size=(224, 224)):
+# Optional libjpeg-turbo bindings used for region-of-interest decoding
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+DECODE_STRATEGIES = ('full', 'roi')
+
+# iMCU size (width, height) for each TurboJPEG chroma subsampling mode:
+# 444, 422, 420, gray, 440, 411
+MCU_SIZES = [(8, 8), (16, 8), (16, 16), (8, 8), (8, 16), (32, 8)]
+
+# Decoded frames can be shared with the segmentation stages through the frame cache
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from frame_cache import read_frame
+import metrics
+
+# EXIF orientation tag, cv2.imread rotates frames which carry it
+EXIF_ORIENTATION_TAG = 0x0112
+
+# TurboJPEG handle, created lazily once per (worker) process
+_turbojpeg = None
+
+def get_crop_box(width, height, crop_size=(224, 224)):
     """
-    Crop a 224x224 slice from the image with the center point offset vertically
+    Calculate the crop window with the center point offset vertically
     by 25% below the image center (halfway between center and bottom edge).
-    
+
     Args:
-        image: Input image as numpy array
+        width: Image width
+        height: Image height
         crop_size: Size of the crop (width, height)
-    
+
     Returns:
-        Cropped image as numpy array
+        Tuple of (left, top, right, bottom) crop boundaries
     """
-    height, width = image.shape[:2]
-    
     # Calculate center point of the image
     center_x = width // 2
     center_y = height // 2
@@ -40,17 +65,173 @@ def crop_image(image, crop_size=(224, 224)):
     top = max(0, new_center_y - half_crop_height)
     right = min(width, new_center_x + half_crop_width)
     bottom = min(height, new_center_y + half_crop_height)
-    
-    # Crop the image
-    cropped_image = image[top:bottom, left:right]
-    
+
+    return left, top, right, bottom
+
+def resize_crop(cropped_image, crop_size=(224, 224)):
     # Resize if necessary to ensure exact dimensions
     if cropped_image.shape[0] != crop_size[1] or cropped_image.shape[1] != crop_size[0]:
         cropped_image = cv2.resize(cropped_image, crop_size)
     
     return cropped_image
 
-def process_directory(input_dir, output_dir, crop_size=(224, 224)):
+def crop_image(image, crop_size=(224, 224)):
+    """
+    Crop a 224x224 slice from the image with the center point offset vertically
+    by 25% below the image center (halfway between center and bottom edge).
+    
+    Args:
+        image: Input image as numpy array
+        crop_size: Size of the crop (width, height)
+    
+    Returns:
+        Cropped image as numpy array
+    """
+    height, width = image.shape[:2]
+    left, top, right, bottom = get_crop_box(width, height, crop_size)
+    
+    # Crop the image
+    cropped_image = image[top:bottom, left:right]
+    
+    return resize_crop(cropped_image, crop_size)
+
+def get_turbojpeg():
+    global _turbojpeg
+
+    if _turbojpeg is None and TurboJPEG is not None:
+        try:
+            _turbojpeg = TurboJPEG()
+        except Exception as e:
+            print(f"libjpeg-turbo unavailable, falling back to full decode: {e}")
+            _turbojpeg = False
+
+    return _turbojpeg or None
+
+def read_crop_roi(input_path, crop_size=(224, 224)):
+    """
+    Decode only the part of a JPEG around the crop window.
+
+    The JPEG is losslessly cropped to iMCU boundaries before decoding, padded by one
+    iMCU on each side so chroma upsampling at the window edges matches a full decode.
+
+    Args:
+        input_path: Path to a JPEG image
+        crop_size: Size of the crop (width, height)
+
+    Returns:
+        Cropped BGR image as numpy array, or None if ROI decoding does not apply
+    """
+    jpeg = get_turbojpeg()
+    if jpeg is None or os.path.splitext(input_path)[1].lower() not in ('.jpg', '.jpeg'):
+        return None
+
+    # cv2.imread applies EXIF rotation, which changes the crop geometry
+    with Image.open(input_path) as img:
+        if img.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1:
+            return None
+
+    with open(input_path, 'rb') as f:
+        jpeg_buf = f.read()
+
+    width, height, subsample, _ = jpeg.decode_header(jpeg_buf)
+    left, top, right, bottom = get_crop_box(width, height, crop_size)
+    mcu_width, mcu_height = MCU_SIZES[subsample]
+
+    # Region to decode, aligned to the iMCU grid with a one iMCU margin
+    region_left = max(0, (left // mcu_width - 1) * mcu_width)
+    region_top = max(0, (top // mcu_height - 1) * mcu_height)
+    region_right = min(width, right + mcu_width)
+    region_bottom = min(height, bottom + mcu_height)
+
+    region_buf = jpeg.crop(jpeg_buf, region_left, region_top, region_right - region_left, region_bottom - region_top)
+    region = jpeg.decode(region_buf)
+
+    cropped_image = region[top - region_top:bottom - region_top, left - region_left:right - region_left]
+
+    return resize_crop(cropped_image, crop_size)
+
+@metrics.timer('crop.read_crop')
+def read_crop(input_path, crop_size=(224, 224), decode='full', frame_cache=None):
+    """
+    Read an image and return its crop.
+
+    Args:
+        input_path: Path to the source image
+        crop_size: Size of the crop (width, height)
+        decode: 'full' decodes the whole frame, 'roi' only decodes the crop window
+            when libjpeg-turbo is available and falls back to 'full' otherwise
+        frame_cache: Optional FrameCache, the full frame is then decoded once and kept
+            for the segmentation stages, so 'roi' is not used
+
+    Returns:
+        Cropped image as numpy array, or None if the image could not be read
+    """
+    if decode == 'roi' and frame_cache is None:
+        try:
+            cropped_image = read_crop_roi(input_path, crop_size)
+            if cropped_image is not None:
+                metrics.increment('crop.decode.roi')
+                return cropped_image
+        except Exception as e:
+            print(f"ROI decode failed for {input_path}, decoding full frame: {e}")
+
+    metrics.increment('crop.decode.full')
+
+    image = read_frame(input_path, frame_cache)
+
+    if image is None:
+        return None
+
+    # Copy so the crop does not keep a cached frame alive
+    return np.ascontiguousarray(crop_image(image, crop_size))
+
+def process_file(args):
+    """
+    Crop a single image and save it. Runs inside the worker pool.
+
+    Args:
+        args: Tuple of (input_path, output_path, crop_size, decode, frame_cache)
+
+    Returns:
+        Tuple of (input_path, success)
+    """
+    input_path, output_path, crop_size, decode, frame_cache = args
+
+    try:
+        # Read and crop image
+        cropped_image = read_crop(input_path, crop_size, decode, frame_cache)
+        
+        if cropped_image is None:
+            print(f"Failed to read image: {input_path}")
+            return input_path, False
+        
+        # Save cropped image
+        with metrics.timer('crop.write'):
+            cv2.imwrite(output_path, cropped_image)
+        return input_path, True
+        
+    except Exception as e:
+        print(f"Error processing {input_path}: {e}")
+        return input_path, False
+
+def init_worker():
+    # Forked workers inherit the parent's timers and counters, which would otherwise be merged back twice
+    metrics.registry.reset()
+
+def process_files(tasks):
+    """
+    Crop a chunk of images. Runs inside the worker pool, which is set up with init_worker.
+
+    Args:
+        tasks: List of process_file arguments
+
+    Returns:
+        Tuple of (list of (input_path, success) tuples, metrics of the chunk for metrics.registry.merge)
+    """
+    return [process_file(task) for task in tasks], metrics.registry.drain()
+
+def process_directory(input_dir, output_dir, crop_size=(224, 224), workers=1, ordered=True, decode='full', frame_cache=None,
+                      selection=None):
     """
     Process all images in the input directory and save cropped versions to the output directory.
     
@@ -58,48 +239,67 @@ def process_directory(input_dir, output_dir, crop_size=(224, 224)):
         input_dir: Directory containing source images
         output_dir: Directory to save cropped images
         crop_size: Size of the crop (width, height)
+        workers: Number of worker processes, None uses all CPU cores
+        ordered: Yield results in input order, otherwise in completion order
+        decode: Decode strategy, one of DECODE_STRATEGIES
+        frame_cache: Optional FrameCache, use a shared one so the frames decoded by the
+            worker processes stay available to the later stages, and remove them with
+            frame_cache.unlink_frames when those are done
+        selection: Optional image names, e.g. from spatial_index.py, other images are skipped
+
+    Returns:
+        List of (input_path, success) tuples
     """
+    if decode not in DECODE_STRATEGIES:
+        raise ValueError(f"Unknown decode strategy '{decode}', expected one of {DECODE_STRATEGIES}")
+
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
     # Get list of image files
     image_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
     image_files = [f for f in os.listdir(input_dir) if os.path.splitext(f)[1].lower() in image_extensions]
+
+    if selection is not None:
+        selection = set(selection)
+        image_files = [f for f in image_files if f in selection]
     
     if not image_files:
         print(f"No image files found in {input_dir}")
-        return
-    
-    print(f"Processing {len(image_files)} images...")
+        return []
     
-    # Process each image
-    for filename in tqdm(image_files):
-        input_path = os.path.join(input_dir, filename)
-        output_path = os.path.join(output_dir, filename)
-        
-        try:
-            # Read image
-            image = cv2.imread(input_path)
-            
-            if image is None:
-                print(f"Failed to read image: {input_path}")
-                continue
-            
-            # Crop image
-            cropped_image = crop_image(image, crop_size)
-            
-            # Save cropped image
-            cv2.imwrite(output_path, cropped_image)
-            
-        except Exception as e:
-            print(f"Error processing {input_path}: {e}")
+    workers = workers or os.cpu_count()
+    print(f"Processing {len(image_files)} images with {workers} worker(s)...")
+
+    tasks = [(os.path.join(input_dir, filename), os.path.join(output_dir, filename), crop_size, decode, frame_cache)
+             for filename in image_files]
+
+    if workers == 1:
+        return [process_file(task) for task in tqdm(tasks)]
+
+    # Hand out several files per task to keep inter-process overhead low
+    chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+
+    task_chunks = [tasks[start:start + chunksize] for start in range(0, len(tasks), chunksize)]
+
+    results = []
+    with Pool(workers, initializer=init_worker) as pool, tqdm(total=len(tasks)) as progress:
+        imap = pool.imap if ordered else pool.imap_unordered
+
+        # The timers and counters of the workers are merged so the snapshot and report cover them
+        for outcomes, worker_metrics in imap(process_files, task_chunks):
+            metrics.registry.merge(worker_metrics)
+            results.extend(outcomes)
+            progress.update(len(outcomes))
+
+    return results
 
 def main():
     input_dir = os.path.join(os.path.dirname(__file__), '..', 'create_synced_df', 'sample_raw_data', 'Camera')
     output_dir = os.path.join(os.path.dirname(__file__), 'output')
     crop_size = (224, 224)
     
-    process_directory(input_dir, output_dir, crop_size)
+    process_directory(input_dir, output_dir, crop_size, workers=None, decode='roi')
     
     print("Image cropping completed!")
 
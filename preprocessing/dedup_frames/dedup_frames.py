@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# A script which finds camera frames that repeat the frame before them, e.g. while the car waits at a light
+#
+# A frame is a duplicate when the car moved less than min_displacement meters since the last kept frame
+# (its representative) and the road crop looks the same, compared with a 64-bit difference hash of the
+# crop window taken from a 1/4 scale decode. Only representatives go through the models, pipeline/run_pipeline.py
+# gives the skipped frames copies of their representative's results.
+
+import os
+import sys
+import json
+import cv2
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(script_dir, '..', 'create_synced_df'))
+from synced_df_io import find_synced_df, read_synced_df
+
+sys.path.append(os.path.join(script_dir, '..', 'crop_images'))
+from crop_images import get_crop_box
+
+sys.path.append(os.path.join(script_dir, '..', '..', 'modules', 'geopose'))
+from geodetic import geodetic_to_enu
+
+sys.path.append(os.path.join(script_dir, '..', '..', 'common'))
+import metrics
+
+# Columns of the synchronized dataframe used to find stationary frames
+DEDUP_COLUMNS = ['image', 'latitude', 'longitude', 'altitude']
+
+# Movement below this many meters is treated as GPS noise of a standing car
+DEFAULT_MIN_DISPLACEMENT = 3.0
+
+# Bits of the 64-bit road hash which may differ between duplicates
+DEFAULT_MAX_HASH_DISTANCE = 6
+
+# A representative stands in for at most this many frames, so long stops are still sampled
+DEFAULT_MAX_RUN = 30
+
+# Frames are decoded at 1/4 scale for hashing
+HASH_DECODE_FLAG = cv2.IMREAD_REDUCED_GRAYSCALE_4
+HASH_DECODE_SCALE = 4
+
+def road_hash(image_path, crop_size=(224, 224), hash_size=8):
+    """
+    Difference hash of the classification crop window.
+
+    Args:
+        image_path: Path to the camera frame
+        crop_size: Crop size of the crop stage (width, height), at full resolution
+        hash_size: The hash has hash_size * hash_size bits
+
+    Returns:
+        Hash as int, or None if the image could not be read
+    """
+    with metrics.timer('dedup.hash'):
+        image = cv2.imread(image_path, HASH_DECODE_FLAG)
+        if image is None:
+            return None
+
+        height, width = image.shape[:2]
+        left, top, right, bottom = get_crop_box(width, height, (crop_size[0] // HASH_DECODE_SCALE, crop_size[1] // HASH_DECODE_SCALE))
+        crop = cv2.resize(image[top:bottom, left:right], (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+
+        # Brightness gradient between horizontal neighbours
+        bits = crop[:, 1:] > crop[:, :-1]
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hash_distance(a, b):
+    return bin(a ^ b).count('1')
+
+def find_duplicates(synced_df, images_dir, frames, min_displacement=DEFAULT_MIN_DISPLACEMENT,
+                    max_hash_distance=DEFAULT_MAX_HASH_DISTANCE, max_run=DEFAULT_MAX_RUN, crop_size=(224, 224)):
+    """
+    Walk the frames in capture order and map every duplicate to the frame it repeats.
+
+    Hashes are only computed for frames taken close to their representative, so frames of a
+    moving car are never decoded.
+
+    Args:
+        synced_df: Synchronized dataframe, frames without a pose are always kept
+        images_dir: Directory containing the camera frames
+        frames: Frame file names, named by capture time so sorting puts them in capture order
+        min_displacement: Meters the car has to move for a frame to be kept without comparing images
+        max_hash_distance: Largest hash distance of a duplicate
+        max_run: Largest number of frames a representative stands in for
+        crop_size: Crop size of the crop stage (width, height)
+
+    Returns:
+        Dictionary of {duplicate frame: representative frame}
+    """
+    poses = synced_df.dropna(subset=DEDUP_COLUMNS).drop_duplicates(subset=['image'])
+    positions = {}
+    if len(poses):
+        reference = (poses['latitude'].iloc[0], poses['longitude'].iloc[0], poses['altitude'].iloc[0])
+        east, north, _ = geodetic_to_enu(poses['latitude'].to_numpy(), poses['longitude'].to_numpy(),
+                                         poses['altitude'].to_numpy(), *reference)
+        positions = dict(zip(poses['image'], zip(east, north)))
+
+    duplicates = {}
+    representative = None
+    representative_hash = None
+    run = 0
+
+    for frame in sorted(frames):
+        position = positions.get(frame)
+
+        duplicate = False
+        if representative is not None and position is not None and run < max_run:
+            representative_position = positions[representative]
+            displacement = np.hypot(position[0] - representative_position[0], position[1] - representative_position[1])
+
+            if displacement < min_displacement:
+                if representative_hash is None:
+                    representative_hash = road_hash(os.path.join(images_dir, representative), crop_size)
+                frame_hash = road_hash(os.path.join(images_dir, frame), crop_size)
+
+                duplicate = (frame_hash is not None and representative_hash is not None and
+                             hash_distance(frame_hash, representative_hash) <= max_hash_distance)
+
+        if duplicate:
+            duplicates[frame] = representative
+            run += 1
+            continue
+
+        # Frames without a pose are kept but can not represent others
+        representative = frame if position is not None else None
+        representative_hash = None
+        run = 0
+
+    metrics.increment('dedup.skipped', len(duplicates))
+    return duplicates
+
+def main():
+    synced_df_dir = os.path.join(script_dir, '..', 'create_synced_df', 'output')
+    images_dir = os.path.join(script_dir, '..', 'create_synced_df', 'sample_raw_data', 'Camera')
+    output_dir = os.path.join(script_dir, 'output')
+
+    synced_df = read_synced_df(find_synced_df(synced_df_dir), columns=DEDUP_COLUMNS)
+    frames = [f for f in os.listdir(images_dir) if f.lower().endswith(('.jpg', '.jpeg'))]
+
+    duplicates = find_duplicates(synced_df, images_dir, frames)
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, 'frame_selection.json')
+    with open(output_path, 'w') as f:
+        json.dump({'duplicates': duplicates}, f, indent=2)
+
+    print(f'{len(duplicates)} of {len(frames)} frames are duplicates, frame selection saved to {output_path}')
+
+if __name__ == '__main__':
+    main()
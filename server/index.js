@@ -2,7 +2,7 @@ import express from 'express';
 import multer from 'multer';
 import cors from 'cors';
 import { fileURLToPath } from 'url';
-import { dirname, join } from 'path';
+import { dirname, join, resolve } from 'path';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = dirname(__filename);
@@ -10,42 +10,123 @@ const __dirname = dirname(__filename);
 const app = express();
 const upload = multer({ dest: 'uploads/' });
 
+// Python inference workers (server/inference_worker.py), one per model environment
+const CLASSIFICATION_WORKER_URL = process.env.CLASSIFICATION_WORKER_URL || 'http://127.0.0.1:8001';
+const SEGMENTATION_WORKER_URL = process.env.SEGMENTATION_WORKER_URL || 'http://127.0.0.1:8002';
+
+// Engine names as shown by the web app, in processing order
+const ENGINE_NAMES = ['Image Processing', 'Segmentation', 'Classification', 'Integration', 'Output'];
+
+// Engines which run in this server rather than in a worker
+const localEngines = {
+  Integration: { name: 'Integration', status: 'idle' },
+  Output: { name: 'Output', status: 'idle' }
+};
+
 app.use(cors());
 app.use(express.json());
 
 // Serve uploaded files
 app.use('/uploads', express.static('uploads'));
 
+async function postWorker(url, images) {
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ images })
+  });
+  const body = await response.json();
+
+  if (!response.ok) {
+    throw new Error(body.error || `Worker returned ${response.status}`);
+  }
+  return body.results;
+}
+
+async function getWorkerEngines(url) {
+  try {
+    const response = await fetch(`${url}/status`);
+    const body = await response.json();
+    return body.engines;
+  } catch (error) {
+    // Worker not running (yet)
+    return [];
+  }
+}
+
+// Current status of every engine
+app.get('/api/status', async (req, res) => {
+  const workerEngines = (
+    await Promise.all([getWorkerEngines(CLASSIFICATION_WORKER_URL), getWorkerEngines(SEGMENTATION_WORKER_URL)])
+  ).flat();
+
+  const engines = ENGINE_NAMES.map(
+    (name) => workerEngines.find((engine) => engine.name === name) || localEngines[name] || { name, status: 'error', error: 'Worker unavailable' }
+  );
+
+  res.json({ engines });
+});
+
 // Process images endpoint
-app.post('/api/process', upload.array('images', 10), (req, res) => {
+app.post('/api/process', upload.array('images', 10), async (req, res) => {
+  const setLocal = (name, status) => {
+    localEngines[name].status = status;
+  };
+
   try {
     const files = req.files;
-    
-    // In a real application, you would process the images here
-    // For now, we'll just return mock data
-    
+    setLocal('Integration', 'idle');
+    setLocal('Output', 'idle');
+
+    // Workers read the uploads from disk, segmentation needs the road class of each image
+    const classifications = await postWorker(
+      `${CLASSIFICATION_WORKER_URL}/classify`,
+      files.map((file) => resolve(file.path))
+    );
+
+    const segmentations = await postWorker(
+      `${SEGMENTATION_WORKER_URL}/segment`,
+      files.map((file, index) => ({
+        path: resolve(file.path),
+        image: file.originalname,
+        predicted_class: classifications[index].predicted_class || null
+      }))
+    );
+
+    setLocal('Integration', 'processing');
+    const images = files.map((file, index) => ({
+      id: `img-${index}`,
+      url: `/uploads/${file.filename}`,
+      annotations: segmentations[index] ? [segmentations[index]] : [],
+      classification: classifications[index].predicted_class || 'unknown'
+    }));
+    setLocal('Integration', 'complete');
+
+    setLocal('Output', 'processing');
+    const timestamp = new Date().toISOString();
     const results = {
-      images: files.map((file, index) => ({
-        id: `img-${index}`,
-        url: `/uploads/${file.filename}`,
-        annotations: [],
-        classification: `class-${index}`
-      })),
+      images,
       segmentationData: {
         version: '1.0',
-        timestamp: new Date().toISOString(),
-        results: []
+        timestamp,
+        results: segmentations
       },
       classificationData: {
         version: '1.0',
-        timestamp: new Date().toISOString(),
-        results: []
+        timestamp,
+        results: classifications.map((classification, index) => ({ ...classification, image: files[index].originalname }))
       }
     };
 
     res.json(results);
+    setLocal('Output', 'complete');
   } catch (error) {
     console.error('Error processing images:', error);
+    for (const engine of Object.values(localEngines)) {
+      if (engine.status !== 'complete') {
+        engine.status = 'error';
+      }
+    }
     res.status(500).json({ error: 'Failed to process images' });
   }
 });
@@ -53,4 +134,4 @@ app.post('/api/process', upload.array('images', 10), (req, res) => {
 const PORT = process.env.PORT || 3000;
 app.listen(PORT, () => {
   console.log(`Server running on port ${PORT}`);
-});
\ No newline at end of file
+});
@@ -0,0 +1,249 @@
+# Long-lived inference worker which keeps the models loaded and micro-batches concurrent requests.
+#
+# The classifier and SAM2 need different Python environments, so each engine group runs in its
+# own worker, e.g.
+#   python server/inference_worker.py --engines classification --port 8001  (Tensorflow environment)
+#   python server/inference_worker.py --engines segmentation --port 8002    (SAM2 environment)
+#
+# Endpoints:
+#   POST /classify  {"images": ["<path>", ...]}                                        -> {"results": [...]}
+#   POST /segment   {"images": [{"path": "<path>", "image": "<name>", "predicted_class": "<class>"}, ...]}
+#                                                                                     -> {"results": [...]}
+#   GET  /status    -> {"engines": [{"name": ..., "status": ...}, ...]}
+#   GET  /metrics   -> timers and counters of the models and the frame cache, Prometheus text format
+#
+# Both workers read the uploads through a shared frame cache (common/frame_cache.py), so a frame
+# decoded by the classification worker is segmented without being decoded again.
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from micro_batcher import MicroBatcher
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(script_dir, '..', 'common'))
+from frame_cache import FrameCache, read_frame
+import metrics
+
+# Frame cache namespace shared by the workers
+FRAME_CACHE_NAMESPACE = 'uploads'
+
+# Engines of each worker type, named as the EngineStatus entries of the web app
+ENGINE_GROUPS = {
+    'classification': ('Image Processing', 'Classification'),
+    'segmentation': ('Segmentation',),
+}
+
+class EngineStatusBoard:
+    # Thread-safe status of the engines hosted by this worker
+    def __init__(self, names):
+        self.lock = threading.Lock()
+        self.engines = {name: {'name': name, 'status': 'idle', 'batches': 0, 'items': 0} for name in names}
+
+    def set(self, name, status, **info):
+        with self.lock:
+            self.engines[name].update(info, status=status)
+
+    def record_batch(self, name, batch_size, seconds):
+        with self.lock:
+            engine = self.engines[name]
+            engine['batches'] += 1
+            engine['items'] += batch_size
+            engine['last_batch_size'] = batch_size
+            engine['last_batch_ms'] = round(seconds * 1000, 1)
+            engine['status'] = 'complete'
+
+    def snapshot(self):
+        with self.lock:
+            return [dict(engine) for engine in self.engines.values()]
+
+    def run(self, name, function, batch_size):
+        # Run one batch of an engine and keep its status up to date
+        self.set(name, 'processing')
+        start = time.perf_counter()
+        try:
+            with metrics.timer(f'worker.{name}', items=batch_size):
+                result = function()
+        except Exception as e:
+            self.set(name, 'error', error=str(e))
+            raise
+        self.record_batch(name, batch_size, time.perf_counter() - start)
+        return result
+
+class ClassificationEngine:
+    """
+    Crops camera frames and classifies the road surface with the warm classifier.
+    """
+    def __init__(self, status, max_batch_size, max_wait_ms, frame_cache=None, decode_workers=None):
+        sys.path.append(os.path.join(script_dir, '..', 'modules', 'classification'))
+
+        import crop_and_classify
+        import classify_images
+
+        # Load the model once for the lifetime of the worker
+        classify_images.get_model()
+        self.crop_frame = crop_and_classify.crop_frame
+        self.classify_arrays = classify_images.classify_arrays
+        self.format_classifications = classify_images.format_classifications
+
+        self.status = status
+        self.frame_cache = frame_cache
+        self.executor = ThreadPoolExecutor(max_workers=decode_workers or os.cpu_count())
+        self.batcher = MicroBatcher(self.process_batch, max_batch_size, max_wait_ms)
+
+    def crop(self, image_path):
+        return self.crop_frame(image_path, frame_cache=self.frame_cache)
+
+    def process_batch(self, image_paths):
+        crops = self.status.run('Image Processing', lambda: list(self.executor.map(self.crop, image_paths)), len(image_paths))
+
+        valid = [i for i, crop in enumerate(crops) if crop is not None]
+        names = [os.path.basename(image_paths[i]) for i in valid]
+
+        def classify():
+            if not valid:
+                return []
+            predictions, scores = self.classify_arrays([crops[i] for i in valid], batch_size=len(valid))
+            return self.format_classifications(names, predictions, scores)
+
+        classifications = self.status.run('Classification', classify, len(valid))
+
+        results = [{'image': os.path.basename(path), 'error': 'Could not read image'} for path in image_paths]
+        for i, classification in zip(valid, classifications):
+            results[i] = classification
+        return results
+
+class SegmentationEngine:
+    """
+    Segments the road with the warm SAM2 model, encoding a micro-batch of frames at once.
+    """
+    def __init__(self, status, max_batch_size, max_wait_ms, frame_cache=None, model_size='large', refine='adaptive'):
+        sys.path.append(os.path.join(script_dir, '..', 'modules', 'road_segmentation'))
+        from sam2_model import SAM2Model
+        from segment_road import calculate_input_points, create_result
+
+        self.calculate_input_points = calculate_input_points
+        self.create_result = create_result
+
+        self.status = status
+        self.frame_cache = frame_cache
+        self.masking_model = SAM2Model(model_size=model_size, refine=refine)
+        self.batcher = MicroBatcher(self.process_batch, max_batch_size, max_wait_ms)
+
+    def process_batch(self, items):
+        images = [read_frame(item['path'], self.frame_cache, 'rgb') for item in items]
+
+        # Items of other requests share the batch, so an unreadable upload only fails its own item
+        valid = [i for i, image in enumerate(images) if image is not None]
+
+        def segment():
+            if not valid:
+                return []
+            valid_images = [images[i] for i in valid]
+            input_points_batch = [self.calculate_input_points(image) for image in valid_images]
+
+            segmentations = self.masking_model.segment_road_batch(valid_images, input_points_batch, input_labels=[1, 0])
+
+            return [self.create_result(items[i], mask, confidence_score, refinement, mask_format='rle')
+                    for i, (mask, confidence_score, refinement) in zip(valid, segmentations)]
+
+        segmented = self.status.run('Segmentation', segment, len(valid))
+
+        results = [{'image': item.get('image', os.path.basename(item['path'])), 'error': 'Could not read image'} for item in items]
+        for i, result in zip(valid, segmented):
+            results[i] = result
+        return results
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    # Set on the server: status board and the engines keyed by endpoint
+    server_version = 'InferenceWorker/1.0'
+
+    def send_json(self, code, payload):
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, {'engines': self.server.status.snapshot()})
+        elif self.path == '/metrics':
+            body = metrics.registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {'error': f'Unknown endpoint {self.path}'})
+
+    def do_POST(self):
+        engine = self.server.engines.get(self.path)
+        if engine is None:
+            self.send_json(404, {'error': f'Unknown endpoint {self.path}'})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            images = request['images']
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {'error': f'Invalid request: {e}'})
+            return
+
+        # Each image is batched with the images of concurrent requests
+        futures = [engine.batcher.submit(image) for image in images]
+
+        try:
+            self.send_json(200, {'results': [future.result() for future in futures]})
+        except Exception as e:
+            print(f'Error processing request\n{e}')
+            self.send_json(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        # Keep the console for model output
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Inference worker keeping the models loaded between requests')
+    parser.add_argument('--engines', choices=list(ENGINE_GROUPS), required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=20)
+    parser.add_argument('--frame-cache-mb', type=int, default=1024, help='Size of the shared frame cache, 0 disables it')
+    args = parser.parse_args()
+
+    status = EngineStatusBoard(ENGINE_GROUPS[args.engines])
+
+    frame_cache = None
+    if args.frame_cache_mb > 0:
+        frame_cache = FrameCache(args.frame_cache_mb * 1024 ** 2, shared=True, namespace=FRAME_CACHE_NAMESPACE)
+
+    if args.engines == 'classification':
+        engine = ClassificationEngine(status, args.max_batch_size, args.max_wait_ms, frame_cache)
+        engines = {'/classify': engine}
+    else:
+        engine = SegmentationEngine(status, args.max_batch_size, args.max_wait_ms, frame_cache)
+        engines = {'/segment': engine}
+
+    server = ThreadingHTTPServer((args.host, args.port), WorkerHandler)
+    server.status = status
+    server.engines = engines
+
+    print(f'{args.engines} worker listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    finally:
+        if frame_cache is not None:
+            frame_cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Groups single items submitted by concurrent requests into batches for one model call
+
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+class MicroBatcher:
+    """
+    Collects submitted items on a background thread and hands them to process_batch
+    together. A batch is flushed as soon as it holds max_batch_size items, or once the
+    oldest item in it has waited max_wait_ms.
+
+    Args:
+        process_batch: Function taking a list of items and returning a list of results in the same order
+        max_batch_size: Largest number of items per batch
+        max_wait_ms: Longest time the first item of a batch waits for more items
+    """
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=20):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """
+        Returns:
+            Future resolved with the item's result, or with the exception raised by process_batch
+        """
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def _next_batch(self):
+        # Block until there is work, then gather more until the batch is full or the deadline passes
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+            # Never leave a request waiting on an item process_batch did not return a result for
+            for future in futures[len(results):]:
+                future.set_exception(RuntimeError(f'No result for item, the batch returned {len(results)} of {len(items)} results'))
@@ -3,7 +3,7 @@ import { ImageUploader } from './components/ImageUploader';
 import { ProcessingStatus } from './components/ProcessingStatus';
 import { ResultViewer } from './components/ResultViewer';
 import { Brain } from 'lucide-react';
-import type { EngineStatus, ProcessedImage } from './types';
+import type { EngineStatus, ProcessedImage, ProcessingResult } from './types';
 import axios from 'axios';
 
 function App() {
@@ -26,63 +26,23 @@ function App() {
     const formData = new FormData();
     files.forEach((file) => formData.append('images', file));
 
-    try {
-      // Simulate processing with engines
-      for (let i = 0; i < engines.length; i++) {
-        setEngines((prev) =>
-          prev.map((engine, index) => ({
-            ...engine,
-            status: index === i ? 'processing' : engine.status
-          }))
-        );
-
-        // Simulate processing time
-        await new Promise((resolve) => setTimeout(resolve, 1500));
-
-        setEngines((prev) =>
-          prev.map((engine, index) => ({
-            ...engine,
-            status: index === i ? 'complete' : engine.status
-          }))
-        );
+    // Poll the real engine status while the request is running
+    const pollStatus = async () => {
+      try {
+        const { data } = await axios.get<{ engines: EngineStatus[] }>('/api/status');
+        setEngines(data.engines);
+      } catch (error) {
+        console.error('Status request failed:', error);
       }
+    };
+    const statusInterval = setInterval(pollStatus, 500);
 
-      // Simulate API response
-      const mockResults = {
-        images: files.map((file, index) => ({
-          id: `img-${index}`,
-          url: URL.createObjectURL(file),
-          annotations: [
-            { type: 'bbox', coordinates: [100, 100, 200, 200] },
-            { type: 'polygon', points: [[150, 150], [160, 160], [170, 150]] }
-          ],
-          classification: ['object-' + index]
-        })),
-        segmentationData: {
-          version: '1.0',
-          timestamp: new Date().toISOString(),
-          segments: files.map((_, i) => ({
-            imageId: `img-${i}`,
-            regions: [
-              { id: i, label: 'region-1', confidence: 0.95 },
-              { id: i + 1, label: 'region-2', confidence: 0.87 }
-            ]
-          }))
-        },
-        classificationData: {
-          version: '1.0',
-          timestamp: new Date().toISOString(),
-          classifications: files.map((_, i) => ({
-            imageId: `img-${i}`,
-            predictions: [
-              { label: 'class-A', confidence: 0.92 },
-              { label: 'class-B', confidence: 0.78 }
-            ]
-          }))
-        }
-      };
+    try {
+      const { data } = await axios.post<ProcessingResult>('/api/process', formData);
 
-      setResults(mockResults);
+      setResults(data);
+      clearInterval(statusInterval);
+      await pollStatus();
     } catch (error) {
       console.error('Processing failed:', error);
       setEngines((prev) =>
@@ -92,6 +52,7 @@ function App() {
         }))
       );
     } finally {
+      clearInterval(statusInterval);
       setIsProcessing(false);
     }
   };